@@ -1,14 +1,103 @@
+"""
+app.py
+------
+Streamlit front end. A thin client of the product matching API (server.py): all embedding,
+search and metadata work happens in the API service, on its long-lived event loop.
+"""
+
+import json
+import os
+import time
+import requests
 import streamlit as st
-import asyncio
 from PIL import Image
-import os
-from clip_inference import get_clip_visual_embedding, get_clip_text_embedding
-from product_matching import match_product_by_visual, match_product_by_text
-from utils.logger import log_event_sync  # logger for MongoDB
+from utils import metrics
+
+# Base URL of the product matching API.
+MATCH_API_URL = os.environ.get("MATCH_API_URL", "http://localhost:8080")
+REQUEST_TIMEOUT = 30
+
+##########################
+# API client
+##########################
+@st.cache_resource
+def get_session() -> requests.Session:
+    """
+    Returns a pooled HTTP session shared across Streamlit reruns.
+    """
+    return requests.Session()
+
+def parse_server_timing(header: str) -> dict:
+    """
+    Parses a Server-Timing header ("stage;dur=12.3, ...") into {stage: milliseconds}.
+    """
+    timings = {}
+    for entry in filter(None, (part.strip() for part in (header or "").split(","))):
+        name, _, params = entry.partition(";")
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "dur":
+                timings[name] = float(value)
+    return timings
+
+def call_api(path: str, **kwargs) -> tuple:
+    """
+    POSTs to the matching API.
+
+    Returns:
+        tuple: Ranked (match_score, product) results, and {stage: milliseconds} timings
+        (the round trip measured here plus the server's per-stage Server-Timing breakdown).
+    """
+    started = time.perf_counter()
+    with metrics.span("app.request"):
+        response = get_session().post(f"{MATCH_API_URL}{path}", timeout=REQUEST_TIMEOUT, **kwargs)
+    round_trip_ms = 1000.0 * (time.perf_counter() - started)
+    if not response.ok:
+        try:
+            detail = response.json().get("detail", response.text)
+        except ValueError:
+            detail = response.text
+        raise RuntimeError(f"API error {response.status_code}: {detail}")
+    timings = {"round trip": round_trip_ms, **parse_server_timing(response.headers.get("Server-Timing"))}
+    return [(item["score"], item["product"]) for item in response.json()["results"]], timings
+
+def display_timings(timings: dict):
+    """
+    Shows where the time of the last match went, slowest stage first.
+    """
+    with st.expander("Latency breakdown"):
+        for stage, ms in sorted(timings.items(), key=lambda item: -item[1]):
+            st.write(f"{stage}: {ms:.1f} ms")
+
+# Bounds of the sidebar price-range filter.
+PRICE_MIN, PRICE_MAX = 0, 1000
 
 ##########################
 # Helper: Display Product
 ##########################
+def display_results(results: list):
+    """
+    Displays ranked (match_score, product) results, best first.
+    """
+    if not results:
+        st.warning("No matching products found.")
+        return
+    for rank, (match_score, product) in enumerate(results, start=1):
+        if len(results) > 1:
+            st.subheader(f"#{rank}")
+        display_product_info(product, match_score)
+
+def build_filters(brand: str, price_range: tuple) -> dict:
+    """
+    Builds the payload filters pushed down to Qdrant from the sidebar inputs.
+    """
+    filters = {}
+    if brand.strip():
+        filters["brand"] = brand.strip()
+    if price_range != (PRICE_MIN, PRICE_MAX):
+        filters["price"] = {"gte": float(price_range[0]), "lte": float(price_range[1])}
+    return filters or None
+
 def display_product_info(product: dict, match_score):
     """
     Displays the product info in a two-column layout:
@@ -38,7 +127,7 @@ def display_product_info(product: dict, match_score):
         product_desc = product.get("description", "N/A")
 
         st.markdown(f"**Name**: {product_name}")
-        st.markdown(f"**Match**: {round((match_score)*100),2}%")
+        st.markdown(f"**Match**: {round(match_score * 100, 2)}%")
         st.markdown(f"**Price**: {product_price}$")
         st.markdown(f"**Description**: {product_desc}")
 
@@ -47,63 +136,76 @@ def display_product_info(product: dict, match_score):
 # Streamlit App
 ##########################
 st.title("Product Matching Pipeline")
-st.write("Upload an image or enter a product description to match a product.")
+st.write("Upload an image, enter a product description, or both to match a product.")
 
 # Input areas: Image uploader and text input
 uploaded_image = st.file_uploader("Upload an image", type=["jpg", "jpeg", "png"])
 input_text = st.text_input("Or enter a product description:")
 
+# Ranking options and payload filters
+with st.sidebar:
+    top_k = st.slider("Number of results", min_value=1, max_value=10, value=1)
+    min_score = st.slider("Minimum match score", min_value=0.0, max_value=1.0, value=0.0, step=0.01)
+    brand = st.text_input("Brand")
+    price_range = st.slider("Price range ($)", min_value=PRICE_MIN, max_value=PRICE_MAX, value=(PRICE_MIN, PRICE_MAX))
+    fusion = st.selectbox("Image + text fusion", ["rrf", "weighted"])
+    visual_weight = st.slider("Image weight", min_value=0.0, max_value=1.0, value=0.5, step=0.05)
+filters = build_filters(brand, price_range)
+
 if st.button("Match Product"):
     try:
-        # Visual matching if an image is provided
-        if uploaded_image:
+        form = {"top_k": top_k}
+        if filters:
+            form["filters"] = json.dumps(filters)
+
+        # Hybrid matching if both an image and text are provided
+        if uploaded_image and input_text:
             image = Image.open(uploaded_image)
             st.image(image, caption="Uploaded Image", use_column_width=True)
+            st.write("Input Text:", input_text)
 
-            st.info("Extracting visual embedding...")
-            visual_embedding = asyncio.run(get_clip_visual_embedding(image))
+            st.info("Performing hybrid matching on visual and text data...")
+            results, timings = call_api(
+                "/match/hybrid",
+                files={"file": (uploaded_image.name, uploaded_image.getvalue())},
+                data={**form, "text": input_text, "fusion": fusion, "visual_weight": visual_weight},
+            )
+
+            st.success("Product matched successfully!")
+            display_results(results)
+            display_timings(timings)
+
+        # Visual matching if an image is provided
+        elif uploaded_image:
+            image = Image.open(uploaded_image)
+            st.image(image, caption="Uploaded Image", use_column_width=True)
 
             st.info("Performing product matching on visual data...")
-            match_score, product = asyncio.run(match_product_by_visual(visual_embedding))
+            if min_score:
+                form["min_score"] = min_score
+            results, timings = call_api("/match/image", files={"file": (uploaded_image.name, uploaded_image.getvalue())}, data=form)
 
             st.success("Product matched successfully!")
             # Display product info in a grid layout
-            display_product_info(product, match_score)
-
-            # Log the execution result in MongoDB
-            log_event_sync(
-                "RESULT",
-                "Visual matching execution result stored.",
-                extra={"match_type": "visual", "product": product}
-            )
+            display_results(results)
+            display_timings(timings)
 
         # Text matching if text input is provided
         elif input_text:
             st.write("Input Text:", input_text)
 
-            st.info("Extracting text embedding...")
-            text_embedding = asyncio.run(get_clip_text_embedding(input_text))
-
             st.info("Performing product matching on text data...")
-            product = asyncio.run(match_product_by_text(text_embedding))
+            results, timings = call_api(
+                "/match/text",
+                json={"text": input_text, "top_k": top_k, "min_score": min_score or None, "filters": filters},
+            )
 
             st.success("Product matched successfully!")
             # Display product info in a grid layout
-            display_product_info(product)
-
-            # Log the execution result in MongoDB
-            log_event_sync(
-                "RESULT",
-                "Text matching execution result stored.",
-                extra={"match_type": "text", "product": product, "input_text": input_text}
-            )
+            display_results(results)
+            display_timings(timings)
         else:
             st.warning("Please upload an image or enter text for product matching.")
 
     except Exception as e:
         st.error(f"An error occurred during product matching: {e}")
-        log_event_sync(
-            "ERROR",
-            f"Product matching error: {e}",
-            extra={"input_image": bool(uploaded_image), "input_text": input_text}
-        )
@@ -0,0 +1,173 @@
+"""
+bench_compression.py
+--------------------
+Recall-vs-speed benchmark of compressed embedding search (utils/compression.py, used by the
+embedded backend with EMBEDDED_MODE = "compressed") against exact search on the same catalog.
+
+For every compression config and rescore multiplier it reports bytes per vector, the memory of
+the codes, recall@k against the exact top-k and latency per query. A multiplier of 1 ranks
+the first pass alone; larger ones rescore top_k * multiplier candidates with the full vectors.
+
+Catalog: an exported snapshot collection (python -m db.search_backend --out snapshots), or a
+synthetic catalog with a decaying variance spectrum (--synthetic N) when there is none.
+Queries are catalog vectors plus noise. The snapshot directory itself is left unchanged.
+
+Synthetic results are labelled as such in the output and the JSON. They show the relative cost
+of each config, but their recall says little about real CLIP embeddings, whose spectrum,
+clustering and near-duplicates differ; measure recall on a snapshot of the ingested catalog
+before enabling compressed mode.
+
+Usage (from the Pipeline directory):
+    python benchmarks/bench_compression.py --snapshot snapshots/products_visual --queries 500
+    python benchmarks/bench_compression.py --synthetic 100000 --configs int8 binary pca128-int8 --json compression.json
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.search_backend import EmbeddedCollection, build_compressed  # noqa: E402
+from utils.compression import l2_normalize  # noqa: E402
+
+CONFIG_PATTERN = re.compile(r"^(?:(pca|truncate)(\d+))?-?(int8|binary|float32)?$")
+BLOCK_ROWS = 65_536
+
+
+def parse_config(config: str) -> dict:
+    """
+    Parses e.g. "int8", "binary", "pca128-int8" or "truncate256-float32".
+    """
+    match = CONFIG_PATTERN.match(config)
+    if not match or not (match.group(1) or match.group(3)):
+        raise argparse.ArgumentTypeError(f"Invalid config '{config}'; expected e.g. int8, binary, pca128-int8.")
+    reduction, dim, quantization = match.groups()
+    return {
+        "name": config,
+        "reduction": reduction,
+        "dim": int(dim) if dim else None,
+        "quantization": None if quantization in (None, "float32") else quantization,
+    }
+
+
+def synthetic_catalog(n: int, dim: int, clusters: int, rng: np.random.Generator) -> np.ndarray:
+    """
+    Returns `n` normalized vectors around `clusters` centers, with most of the variance in a few
+    directions as in real CLIP embeddings.
+    """
+    spectrum = (1.0 / np.sqrt(1.0 + np.arange(dim))).astype(np.float32)
+    basis = np.linalg.qr(rng.standard_normal((dim, dim)))[0].astype(np.float32)
+    centers = rng.standard_normal((clusters, dim), dtype=np.float32) * spectrum
+    vectors = np.empty((n, dim), dtype=np.float32)
+    for start in range(0, n, BLOCK_ROWS):
+        rows = min(BLOCK_ROWS, n - start)
+        block = centers[rng.integers(clusters, size=rows)] + 0.5 * rng.standard_normal((rows, dim), dtype=np.float32) * spectrum
+        vectors[start:start + rows] = l2_normalize(block @ basis.T)
+    return vectors
+
+
+def prepare_directory(args, directory: str) -> np.ndarray:
+    """
+    Fills `directory` with vectors.npy and payloads.json (linked from --snapshot when given).
+    Returns the vectors (memory-mapped for snapshots).
+    """
+    if args.snapshot:
+        for name in ("vectors.npy", "payloads.json"):
+            os.symlink(os.path.abspath(os.path.join(args.snapshot, name)), os.path.join(directory, name))
+        return np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r")
+    vectors = synthetic_catalog(args.synthetic, args.dim, args.clusters, np.random.default_rng(args.seed))
+    np.save(os.path.join(directory, "vectors.npy"), vectors)
+    with open(os.path.join(directory, "payloads.json"), "w", encoding="utf-8") as f:
+        json.dump([{"id": str(i)} for i in range(vectors.shape[0])], f)
+    return vectors
+
+
+def run_queries(collection: EmbeddedCollection, queries: np.ndarray, top_k: int) -> tuple:
+    """
+    Returns (ids per query, latencies in ms).
+    """
+    results, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        hits = collection.search(query, top_k)
+        latencies.append(1000.0 * (time.perf_counter() - start))
+        results.append([product_id for _, product_id in hits])
+    return results, np.asarray(latencies)
+
+
+def summarize(latencies: np.ndarray) -> dict:
+    return {
+        "mean_ms": round(float(latencies.mean()), 3),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall and latency of compressed vs exact embedded search.")
+    parser.add_argument("--snapshot", default=None, help="Snapshot directory of one collection (vectors.npy, payloads.json).")
+    parser.add_argument("--synthetic", type=int, default=100_000, help="Synthetic catalog size when --snapshot is not given.")
+    parser.add_argument("--dim", type=int, default=512, help="Dimension of the synthetic catalog.")
+    parser.add_argument("--clusters", type=int, default=1000, help="Clusters of the synthetic catalog.")
+    parser.add_argument("--configs", type=parse_config, nargs="+",
+                        default=[parse_config(c) for c in ("int8", "binary", "pca256-int8", "pca128-int8", "pca256-binary")])
+    parser.add_argument("--rescore", type=int, nargs="+", default=[1, 4, 10], help="Rescore multipliers (1 = first pass only).")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--noise", type=float, default=0.3, help="Norm of the noise added to query vectors.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", default=None, help="Optional path to write the results as JSON.")
+    args = parser.parse_args()
+
+    rows = []
+    with tempfile.TemporaryDirectory(prefix="bench-compression-") as directory:
+        vectors = prepare_directory(args, directory)
+        n, dim = vectors.shape
+        rng = np.random.default_rng(args.seed + 1)
+        picked = np.asarray(vectors[np.sort(rng.choice(n, size=min(n, args.queries), replace=False))], dtype=np.float32)
+        queries = l2_normalize(picked + args.noise * rng.standard_normal(picked.shape, dtype=np.float32) / np.sqrt(dim))
+
+        exact = EmbeddedCollection(directory, mode="exact")
+        truth, latencies = run_queries(exact, queries, args.top_k)
+        full_mb = n * dim * 4 / 2**20
+        rows.append({"config": "exact", "rescore": None, "bytes_per_vector": dim * 4, "memory_mb": round(full_mb, 2),
+                     "recall": 1.0, **summarize(latencies)})
+        catalog = args.snapshot or "synthetic"
+        if not args.snapshot:
+            print("SYNTHETIC catalog: recall does not carry over to real embeddings; use --snapshot to measure it.")
+        print(f"{catalog}: {n} vectors x {dim}, {len(queries)} queries, recall@{args.top_k}")
+        print(f"{'exact':18s} {'':>8s} {dim * 4:>6d} B/vec {full_mb:>9.2f} MB  recall=1.000  "
+              f"p50={rows[0]['p50_ms']:>7.3f} ms")
+
+        for config in args.configs:
+            started = time.perf_counter()
+            compressor = build_compressed(directory, quantization=config["quantization"], reduction=config["reduction"], dim=config["dim"])
+            build_seconds = time.perf_counter() - started
+            bytes_per_vector = compressor.bytes_per_vector(dim)
+            for multiplier in args.rescore:
+                collection = EmbeddedCollection(directory, mode="compressed", rescore_multiplier=multiplier)
+                results, latencies = run_queries(collection, queries, args.top_k)
+                recall = float(np.mean([len(set(r) & set(t)) / max(1, len(t)) for r, t in zip(results, truth)]))
+                rows.append({
+                    "config": config["name"], "rescore": multiplier, "bytes_per_vector": bytes_per_vector,
+                    "memory_mb": round(n * bytes_per_vector / 2**20, 2), "build_seconds": round(build_seconds, 2),
+                    "recall": round(recall, 4), **summarize(latencies),
+                    "speedup": round(rows[0]["p50_ms"] / max(summarize(latencies)["p50_ms"], 1e-9), 2),
+                })
+                row = rows[-1]
+                print(f"{config['name']:18s} x{multiplier:<7d} {bytes_per_vector:>6d} B/vec {row['memory_mb']:>9.2f} MB  "
+                      f"recall={recall:.3f}  p50={row['p50_ms']:>7.3f} ms  speedup={row['speedup']:.2f}x")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"catalog": catalog, "vectors": n, "dim": dim, "queries": len(queries), "top_k": args.top_k, "rows": rows}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+bench_concurrency.py
+--------------------
+Throughput benchmark: synchronous clients driven through asyncio.to_thread (the previous
+implementation) against the native asyncio clients now used by clip_inference.py and
+db/qdrant_client.py, at several concurrency levels.
+
+Targets (live servers, reached through TRITON_URL / QDRANT_URL):
+  - triton: one clip_text inference per request (a single row of token ids).
+  - qdrant: one top-5 search per request with a random query vector.
+
+Usage (from the Pipeline directory):
+    python benchmarks/bench_concurrency.py --target triton --concurrency 1 4 16 64 --requests 500
+    python benchmarks/bench_concurrency.py --target qdrant --collection products_visual --json results.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import qdrant_client  # noqa: E402
+
+TRITON_URL = os.environ.get("TRITON_URL", "localhost:8000").split("://", 1)[-1].rstrip("/")
+
+
+async def run_level(call, concurrency: int, requests: int) -> dict:
+    """
+    Issues `requests` calls with `concurrency` in flight and returns throughput and latency.
+    """
+    await call()  # warm-up (connection set-up)
+    pending = iter(range(requests))
+    latencies = []
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        for _ in pending:
+            start = time.perf_counter()
+            try:
+                await call()
+            except Exception:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies_ms = 1000.0 * np.asarray(latencies or [0.0])
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 2),
+        "p95_ms": round(float(np.percentile(latencies_ms, 95)), 2),
+    }
+
+
+def triton_calls(args):
+    """
+    Returns (sync-in-thread call, async call) for one clip_text inference.
+    """
+    import tritonclient.http as httpclient
+    import tritonclient.http.aio as aio_httpclient
+
+    token_ids = np.zeros((1, 77), dtype=np.int64)
+    sync_client = httpclient.InferenceServerClient(url=TRITON_URL)
+    async_client = None
+
+    def build(module):
+        inputs = [module.InferInput("input", token_ids.shape, "INT64")]
+        inputs[0].set_data_from_numpy(token_ids)
+        return {"model_name": "clip_text", "model_version": "1", "inputs": inputs,
+                "outputs": [module.InferRequestedOutput("output")]}
+
+    async def sync_call():
+        await asyncio.to_thread(sync_client.infer, **build(httpclient))
+
+    async def async_call():
+        nonlocal async_client
+        if async_client is None:
+            async_client = aio_httpclient.InferenceServerClient(url=TRITON_URL, conn_limit=args.pool_size)
+        await async_client.infer(**build(aio_httpclient))
+
+    return sync_call, async_call
+
+
+def qdrant_calls(args):
+    """
+    Returns (sync-in-thread call, async call) for one top-5 search.
+    """
+    dim = qdrant_client.get_client().get_collection(args.collection).config.params.vectors.size
+    rng = np.random.default_rng(0)
+    qdrant_client.QDRANT_POOL_SIZE = args.pool_size
+
+    def query():
+        return {"collection_name": args.collection, "query": rng.standard_normal(dim).tolist(), "limit": 5}
+
+    async def sync_call():
+        await asyncio.to_thread(qdrant_client.get_client().query_points, **query())
+
+    async def async_call():
+        await qdrant_client.get_async_client().query_points(**query())
+
+    return sync_call, async_call
+
+
+async def run(args) -> list:
+    sync_call, async_call = (triton_calls if args.target == "triton" else qdrant_calls)(args)
+    rows = []
+    for mode, call in (("to_thread", sync_call), ("async", async_call)):
+        for concurrency in args.concurrency:
+            row = {"target": args.target, "mode": mode, **await run_level(call, concurrency, args.requests)}
+            rows.append(row)
+            print(f"{args.target:7s} {mode:9s} c={concurrency:<4d} rps={row['rps']:>8.1f}  "
+                  f"p50={row['p50_ms']:>7.2f} ms  p95={row['p95_ms']:>7.2f} ms  errors={row['errors']}")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Requests per second of sync (to_thread) vs async clients.")
+    parser.add_argument("--target", choices=("triton", "qdrant"), default="triton")
+    parser.add_argument("--collection", default="products_visual", help="Qdrant collection for --target qdrant.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64], help="Requests in flight.")
+    parser.add_argument("--requests", type=int, default=500, help="Requests per concurrency level.")
+    parser.add_argument("--pool-size", type=int, default=64, help="Connection pool size of the async client.")
+    parser.add_argument("--json", default=None, help="Optional path to write the results as JSON.")
+    args = parser.parse_args()
+
+    rows = asyncio.run(run(args))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+bench_preprocessing.py
+----------------------
+Parity check and benchmark: the NumPy preprocessing engine (utils/image_preprocessing.py)
+against Hugging Face's CLIPProcessor, on the images shipped in Dataset/.
+
+Usage (from the Pipeline directory):
+    python benchmarks/bench_preprocessing.py --repeat 20 --tolerance 0.05
+
+Exits with a non-zero status if any image differs from CLIPProcessor by more than the tolerance.
+The parity itself is asserted by tests/test_image_preprocessing.py; this script reports it on
+real photos next to the latency numbers.
+"""
+
+import argparse
+import glob
+import os
+import sys
+import time
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.image_preprocessing import ClipImagePreprocessor  # noqa: E402
+
+DATASET_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "Dataset")
+
+
+def timed(fn, repeat: int) -> float:
+    """
+    Returns the mean wall time of `fn()` in milliseconds.
+    """
+    fn()  # warm-up
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return 1000.0 * (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CLIP image preprocessing parity check and benchmark.")
+    parser.add_argument("--dataset", default=DATASET_DIR, help="Directory with .jpg/.png images.")
+    parser.add_argument("--repeat", type=int, default=20, help="Timed iterations per measurement.")
+    parser.add_argument("--tolerance", type=float, default=0.05, help="Max absolute difference allowed.")
+    parser.add_argument("--workers", type=int, default=4, help="Thread-pool size for the batched mode.")
+    args = parser.parse_args()
+
+    from transformers import CLIPProcessor
+    processor = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
+    engine = ClipImagePreprocessor()
+    threaded_engine = ClipImagePreprocessor(num_workers=args.workers)
+
+    paths = sorted(glob.glob(os.path.join(args.dataset, "*.jpg")) + glob.glob(os.path.join(args.dataset, "*.png")))
+    if not paths:
+        sys.exit(f"No images found in {args.dataset}")
+    images = [Image.open(path).convert("RGB") for path in paths]
+
+    # Parity: compare against CLIPProcessor cast to float16, as clip_inference did.
+    failed = False
+    for path, image in zip(paths, images):
+        reference = processor(images=image, return_tensors="np")["pixel_values"].astype(np.float16)
+        ours = engine.preprocess(image)
+        diff = np.abs(reference.astype(np.float32) - ours.astype(np.float32))
+        status = "ok" if diff.max() <= args.tolerance else "FAIL"
+        failed |= status == "FAIL"
+        print(f"{status:4} max_abs={diff.max():.4f} mean_abs={diff.mean():.5f}  {os.path.basename(path)}")
+
+    # Latency: single image and full batch.
+    image = images[0]
+    buffer = engine.allocate(1)
+    batch_buffer = engine.allocate(len(images))
+    results = {
+        "clip_processor_single_ms": timed(lambda: processor(images=image, return_tensors="np")["pixel_values"].astype(np.float16), args.repeat),
+        "numpy_single_ms": timed(lambda: engine.preprocess(image, out=buffer), args.repeat),
+        "clip_processor_batch_ms": timed(lambda: processor(images=images, return_tensors="np")["pixel_values"].astype(np.float16), args.repeat),
+        "numpy_batch_ms": timed(lambda: engine.preprocess_batch(images, out=batch_buffer), args.repeat),
+        "numpy_batch_threaded_ms": timed(lambda: threaded_engine.preprocess_batch(images, out=batch_buffer), args.repeat),
+        "numpy_batch_threaded_from_files_ms": timed(lambda: threaded_engine.preprocess_batch(paths, out=batch_buffer), args.repeat),
+    }
+    threaded_engine.close()
+
+    print(f"\n{len(images)} images, {args.repeat} iterations")
+    for name, value in results.items():
+        print(f"{name:40} {value:9.2f}")
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+bench_startup.py
+----------------
+Startup benchmark: import time of the pipeline modules and latency of the first request, each
+measured in a fresh interpreter so nothing is already loaded.
+
+  - import:         `import <module>` for clip_inference, product_matching and server.
+  - first request:  the first and second get_clip_text_embedding() calls after import, with and
+                    without clip_inference.warm_up() beforehand (needs Triton at TRITON_URL).
+
+Usage (from the Pipeline directory):
+    python benchmarks/bench_startup.py --repeat 5
+    python benchmarks/bench_startup.py --repeat 3 --first-request --json startup.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+PIPELINE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = ("clip_inference", "product_matching", "server")
+
+IMPORT_SNIPPET = """
+import json, time
+started = time.perf_counter()
+import {module}
+print(json.dumps({{"seconds": time.perf_counter() - started}}))
+"""
+
+FIRST_REQUEST_SNIPPET = """
+import asyncio, json, time
+import clip_inference
+
+async def main():
+    timings = {{}}
+    if {warm_up}:
+        started = time.perf_counter()
+        await clip_inference.warm_up()
+        timings["warm_up"] = time.perf_counter() - started
+    started = time.perf_counter()
+    await clip_inference.get_clip_text_embedding("a pair of red running shoes")
+    timings["first_request"] = time.perf_counter() - started
+    started = time.perf_counter()
+    await clip_inference.get_clip_text_embedding("a black leather jacket")
+    timings["second_request"] = time.perf_counter() - started
+    return timings
+
+print(json.dumps(asyncio.run(main())))
+"""
+
+
+def run_snippet(code: str) -> dict:
+    """
+    Runs `code` in a fresh interpreter from the Pipeline directory and returns its JSON output.
+    """
+    completed = subprocess.run(
+        [sys.executable, "-c", code], cwd=PIPELINE_DIR, capture_output=True, text=True, check=False
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else "failed")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def median_of(samples: list) -> dict:
+    return {key: round(statistics.median(sample[key] for sample in samples), 4) for key in samples[0]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import time and first-request latency in fresh interpreters.")
+    parser.add_argument("--repeat", type=int, default=5, help="Fresh interpreters per measurement (median reported).")
+    parser.add_argument("--first-request", action="store_true", help="Also time the first requests (needs Triton).")
+    parser.add_argument("--json", default=None, help="Optional path to write the results as JSON.")
+    args = parser.parse_args()
+
+    results = {"import": {}, "first_request": {}}
+    for module in MODULES:
+        try:
+            results["import"][module] = median_of([run_snippet(IMPORT_SNIPPET.format(module=module)) for _ in range(args.repeat)])
+        except RuntimeError as e:
+            results["import"][module] = {"error": str(e)}
+        print(f"import {module:18s} {results['import'][module]}")
+
+    if args.first_request:
+        for warm_up in (False, True):
+            label = "with_warm_up" if warm_up else "cold"
+            samples = [run_snippet(FIRST_REQUEST_SNIPPET.format(warm_up=warm_up)) for _ in range(args.repeat)]
+            results["first_request"][label] = median_of(samples)
+            print(f"first request ({label:12s}) {results['first_request'][label]}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
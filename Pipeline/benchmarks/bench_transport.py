@@ -0,0 +1,95 @@
+"""
+bench_transport.py
+------------------
+Benchmark of the Triton transports supported by clip_inference.py (TRITON_TRANSPORT) on the
+clip_visual model: JSON over HTTP, the binary HTTP extension, gRPC and system shared memory.
+
+Each mode sends the same random [batch, 3, 224, 224] float16 batches through _infer_visual and
+reports latency per batch and images per second. The "shm" mode needs Triton on this host.
+
+Usage (from the Pipeline directory):
+    python benchmarks/bench_transport.py --batch-sizes 1 8 32 --repeat 50 \
+        --http-url localhost:8000 --grpc-url localhost:8001
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import clip_inference  # noqa: E402
+
+
+async def bench_mode(mode: str, url: str, batch_sizes: list, repeat: int, concurrency: int) -> list:
+    clip_inference.TRITON_TRANSPORT = mode
+    clip_inference.TRITON_URL = url
+    await clip_inference.close_triton_client()
+    rng = np.random.default_rng(0)
+
+    rows = []
+    for batch_size in batch_sizes:
+        data = rng.standard_normal((batch_size, 3, 224, 224)).astype(np.float16)
+        await clip_inference._infer_visual(data)  # warm-up: connections and shm registration
+
+        latencies = []
+        pending = iter(range(repeat))
+
+        async def worker():
+            for _ in pending:
+                start = time.perf_counter()
+                await clip_inference._infer_visual(data)
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+        latencies_ms = 1000.0 * np.asarray(latencies)
+        rows.append({
+            "mode": mode,
+            "batch_size": batch_size,
+            "p50_ms": round(float(np.percentile(latencies_ms, 50)), 2),
+            "p95_ms": round(float(np.percentile(latencies_ms, 95)), 2),
+            "images_per_second": round(batch_size * repeat / elapsed, 1),
+        })
+        row = rows[-1]
+        print(f"{mode:12s} batch={batch_size:<4d} p50={row['p50_ms']:>8.2f} ms  p95={row['p95_ms']:>8.2f} ms  "
+              f"{row['images_per_second']:>9.1f} images/s")
+
+    await clip_inference.close_triton_client()
+    return rows
+
+
+async def run(args) -> list:
+    rows = []
+    for mode in args.modes:
+        url = args.grpc_url if mode == "grpc" else args.http_url
+        rows.extend(await bench_mode(mode, url, args.batch_sizes, args.repeat, args.concurrency))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency and throughput of each Triton transport for clip_visual.")
+    parser.add_argument("--modes", nargs="+", default=list(clip_inference.TRITON_TRANSPORTS),
+                        choices=clip_inference.TRITON_TRANSPORTS)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--repeat", type=int, default=50, help="Batches sent per mode and batch size.")
+    parser.add_argument("--concurrency", type=int, default=4, help="Batches in flight.")
+    parser.add_argument("--http-url", default="localhost:8000")
+    parser.add_argument("--grpc-url", default="localhost:8001")
+    parser.add_argument("--json", default=None, help="Optional path to write the results as JSON.")
+    args = parser.parse_args()
+
+    rows = asyncio.run(run(args))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
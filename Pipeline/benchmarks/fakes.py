@@ -0,0 +1,228 @@
+"""
+fakes.py
+--------
+Local stand-ins for the services behind the matching pipeline, so benchmarks/loadtest.py runs
+on a laptop or a CI runner without Triton, Qdrant or MongoDB:
+
+  - FakeClipModel: replaces the clip_text / clip_visual Triton models. Embeddings are
+    deterministic (a fixed random projection of the token ids / pooled pixels, blended with
+    noise seeded by the input bytes, L2-normalized), with an optional simulated latency.
+  - FakeTokenizer: hashes words to token ids; used when the CLIP tokenizer files are not in
+    CLIP_ASSETS_DIR (loading them would need the Hugging Face Hub).
+  - FakeMongoCollection: an in-memory product collection answering the `$in` lookups of
+    db/mongodb_client.py, with an optional simulated latency.
+  - FakeLogCollection: swallows the log documents shipped by utils/logger.py.
+  - Qdrant is replaced by qdrant-client's in-memory local mode (AsyncQdrantClient(":memory:")).
+
+install() points clip_inference, db/qdrant_client.py, db/mongodb_client.py and utils/logger.py
+at the stand-ins; everything above them (caches, batching, search backends, matching) is the
+real code.
+"""
+
+import asyncio
+import hashlib
+import re
+import warnings
+import zlib
+import numpy as np
+from qdrant_client import AsyncQdrantClient
+
+import clip_inference
+from db import mongodb_client, qdrant_client
+from utils import logger
+from utils.lazy import Lazy, LoopLocal
+
+EMBEDDING_DIM = 512
+# CLIP's special tokens; padding uses the end-of-text token, as CLIPTokenizer does.
+BOS_TOKEN = 49406
+EOS_TOKEN = 49407
+# Token ids are hashed into this many rows of the text projection.
+TEXT_BUCKETS = 4096
+# Images are average-pooled to POOL x POOL per channel before the projection.
+POOL = 8
+# Weight of the input-seeded noise relative to the content projection. Distinct inputs with the
+# same content end up around cosine 0.5, so they do not collide in the near-duplicate cache.
+# Real CLIP embeddings of similar prompts are far closer, so load tests with these stand-ins
+# measure the near-duplicate cache's cost but say nothing about false hits.
+NOISE_WEIGHT = 1.0
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+class FakeClipModel:
+    """
+    Deterministic stand-in for the clip_text and clip_visual models.
+
+    Args:
+        dim (int): Embedding dimension.
+        seed (int): Seed of the projection matrices.
+        latency_ms (float): Simulated latency per call.
+        per_item_ms (float): Simulated latency per row of a batch.
+    """
+
+    def __init__(self, dim: int = EMBEDDING_DIM, seed: int = 0, latency_ms: float = 0.0, per_item_ms: float = 0.0):
+        rng = np.random.default_rng(seed)
+        self.dim = dim
+        self.latency_ms = latency_ms
+        self.per_item_ms = per_item_ms
+        self.text_projection = rng.standard_normal((TEXT_BUCKETS, dim)).astype(np.float32)
+        self.visual_projection = rng.standard_normal((3 * POOL * POOL, dim)).astype(np.float32)
+        self.calls = 0
+        self.rows = 0
+
+    def _noise(self, rows: np.ndarray) -> np.ndarray:
+        noise = np.empty((rows.shape[0], self.dim), dtype=np.float32)
+        for i, row in enumerate(rows):
+            seed = int.from_bytes(hashlib.blake2b(np.ascontiguousarray(row).tobytes(), digest_size=8).digest(), "little")
+            noise[i] = np.random.default_rng(seed).standard_normal(self.dim, dtype=np.float32)
+        return _normalize_rows(noise)
+
+    async def _simulate(self, rows: int):
+        self.calls += 1
+        self.rows += rows
+        delay = (self.latency_ms + self.per_item_ms * rows) / 1000.0
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def embed_text(self, token_ids: np.ndarray) -> np.ndarray:
+        content = _normalize_rows(self.text_projection[token_ids % TEXT_BUCKETS].mean(axis=1))
+        return _normalize_rows(content + NOISE_WEIGHT * self._noise(token_ids))
+
+    def embed_visual(self, pixel_values: np.ndarray) -> np.ndarray:
+        n, channels, height, width = pixel_values.shape
+        pooled = pixel_values.astype(np.float32).reshape(
+            n, channels, POOL, height // POOL, POOL, width // POOL
+        ).mean(axis=(3, 5)).reshape(n, -1)
+        content = _normalize_rows(pooled @ self.visual_projection)
+        return _normalize_rows(content + NOISE_WEIGHT * self._noise(pixel_values))
+
+    async def infer_text(self, token_ids: np.ndarray) -> np.ndarray:
+        """
+        Drop-in replacement for clip_inference._infer_text.
+        """
+        await self._simulate(token_ids.shape[0])
+        return self.embed_text(token_ids)
+
+    async def infer_visual(self, pixel_values: np.ndarray) -> np.ndarray:
+        """
+        Drop-in replacement for clip_inference._infer_visual.
+        """
+        await self._simulate(pixel_values.shape[0])
+        return self.embed_visual(pixel_values)
+
+
+class FakeTokenizer:
+    """
+    Callable with the subset of the CLIPTokenizer interface used by clip_inference.py.
+    Words are lower-cased and hashed into the vocabulary.
+    """
+
+    def __call__(self, text, return_tensors="np", padding="max_length", max_length=77, truncation=True):
+        texts = [text] if isinstance(text, str) else list(text)
+        input_ids = np.full((len(texts), max_length), EOS_TOKEN, dtype=np.int64)
+        for i, item in enumerate(texts):
+            ids = [zlib.crc32(word.encode("utf-8")) % BOS_TOKEN for word in re.findall(r"\w+", item.lower())]
+            ids = [BOS_TOKEN] + ids[:max_length - 2] + [EOS_TOKEN]
+            input_ids[i, :len(ids)] = ids
+        return {"input_ids": input_ids}
+
+
+def _project(document: dict, projection: dict) -> dict:
+    if not projection:
+        return dict(document)
+    if any(value == 1 for key, value in projection.items() if key != "_id"):
+        return {key: value for key, value in document.items() if projection.get(key) == 1}
+    return {key: value for key, value in document.items() if projection.get(key, 1) != 0}
+
+
+class _FakeCursor:
+    def __init__(self, documents: list, latency_ms: float):
+        self._documents = documents
+        self._latency_ms = latency_ms
+
+    async def to_list(self, length=None):
+        if self._latency_ms > 0:
+            await asyncio.sleep(self._latency_ms / 1000.0)
+        return self._documents if length is None else self._documents[:length]
+
+
+class FakeMongoCollection:
+    """
+    In-memory product collection supporting find({"id": {"$in": [...]}}, projection).
+
+    Args:
+        documents (list[dict]): Product documents keyed by their "id" field.
+        latency_ms (float): Simulated round-trip time per query.
+    """
+
+    def __init__(self, documents=(), latency_ms: float = 0.0):
+        self.documents = {}
+        self.latency_ms = latency_ms
+        self.queries = 0
+        self.insert_many(documents)
+
+    def insert_many(self, documents, ordered=False):
+        for document in documents:
+            self.documents[document["id"]] = dict(document)
+
+    def find(self, query: dict, projection: dict = None):
+        self.queries += 1
+        ids = query["id"]["$in"] if isinstance(query.get("id"), dict) else [query.get("id")]
+        found = [_project(self.documents[i], projection) for i in ids if i in self.documents]
+        return _FakeCursor(found, self.latency_ms)
+
+
+class FakeLogCollection:
+    """
+    Counts log documents instead of storing them.
+    """
+
+    def __init__(self):
+        self.inserted = 0
+
+    def insert_many(self, documents, ordered=False):
+        self.inserted += len(documents)
+
+
+def install(model: FakeClipModel, mongo_latency_ms: float = 0.0, fake_tokenizer: bool = False) -> dict:
+    """
+    Points the pipeline modules at the local stand-ins. The product collection starts empty;
+    fill it with insert_many() and the Qdrant collections through qdrant_client.get_async_client().
+
+    Args:
+        model (FakeClipModel): Replaces both Triton models (direct calls and micro-batchers).
+        mongo_latency_ms (float): Simulated MongoDB round-trip time.
+        fake_tokenizer (bool): Replace the CLIP tokenizer with FakeTokenizer.
+
+    Returns:
+        dict: The stand-in objects ("products", "logs"), e.g. for their counters.
+    """
+    products_collection = FakeMongoCollection(latency_ms=mongo_latency_ms)
+    log_collection = FakeLogCollection()
+
+    clip_inference.TRITON_TRANSPORT = "http-binary"
+    clip_inference._infer_text = model.infer_text
+    clip_inference._infer_visual = model.infer_visual
+    clip_inference.TEXT_BATCHER.infer_fn = model.infer_text
+    clip_inference.VISUAL_BATCHER.infer_fn = model.infer_visual
+    if fake_tokenizer:
+        clip_inference.TOKENIZER = Lazy(FakeTokenizer, "fake_tokenizer")
+
+    def create_qdrant_client():
+        return AsyncQdrantClient(location=":memory:")
+
+    def create_mongo_client():
+        return {mongodb_client.DB_NAME: {mongodb_client.COLLECTION_NAME: products_collection}}
+
+    def create_log_client():
+        return {logger.LOG_DB_NAME: {logger.LOG_COLLECTION_NAME: log_collection}}
+
+    # Local mode always searches exactly and warns about the quantization search params.
+    warnings.filterwarnings("ignore", message="Local mode performs exact", category=UserWarning)
+    qdrant_client.ASYNC_CLIENT = LoopLocal(create_qdrant_client, "fake_qdrant_async_client")
+    mongodb_client.CLIENT = LoopLocal(create_mongo_client, "fake_mongodb_client")
+    logger.CLIENT = Lazy(create_log_client, "fake_log_mongodb_client")
+    return {"products": products_collection, "logs": log_collection}
@@ -0,0 +1,467 @@
+"""
+loadtest.py
+-----------
+Reproducible load test of the matching pipeline. Image and text workloads are built from
+Dataset/ and replayed against the real pipeline code, with Triton, Qdrant and MongoDB replaced
+by the local stand-ins in benchmarks/fakes.py, so results depend only on the code under test
+and the machine.
+
+Scenarios:
+  - preprocess_image:  decode an uploaded image and run clip_inference.preprocess_image().
+  - search_embedding:  qdrant_client.search_embedding() against the in-memory Qdrant catalog.
+  - cache_hit:         full image request for a small hot set of uploads (embedding and match
+                       caches warm).
+  - match_visual:      get_clip_visual_embedding() + match_product_by_visual() for fresh uploads
+                       (random crops of the Dataset images, re-encoded as JPEG).
+  - match_text:        get_clip_text_embedding() + match_product_by_text() for generated queries.
+
+Load is closed-loop (--concurrency workers issuing requests back to back) or open-loop
+(--rate: Poisson arrivals; latency counts from the scheduled arrival, so queueing is included).
+Every run reports throughput, end-to-end latency percentiles and per-stage latency from
+utils/metrics.py (stage quantiles cover the last metrics.QUANTILE_WINDOW observations).
+Workloads, catalog vectors and fake embeddings are seeded by --seed.
+
+Results are saved with --json and tagged with the git commit; --compare flags runs of a
+baseline file (taken on the same machine) whose throughput or latency got worse by more than
+--threshold percent, and exits with status 1 if any did.
+
+Usage (from the Pipeline directory):
+    python benchmarks/loadtest.py --concurrency 1 16 --requests 500 --json before.json
+    python benchmarks/loadtest.py --scenarios match_visual match_text --rate 200 --compare before.json
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+import numpy as np
+from PIL import Image
+
+PIPELINE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PIPELINE_DIR)
+
+import clip_inference  # noqa: E402
+import fakes  # noqa: E402
+import ingest_catalog  # noqa: E402
+import product_matching  # noqa: E402
+from db import qdrant_client, search_backend  # noqa: E402
+from qdrant_client.http import models  # noqa: E402
+from utils import metrics  # noqa: E402
+
+DEFAULT_DATASET = os.path.join(PIPELINE_DIR, "..", "Dataset")
+SCENARIOS = ("preprocess_image", "search_embedding", "cache_hit", "match_visual", "match_text")
+# Words mixed into generated text queries.
+QUERY_WORDS = ("new", "original", "cheap", "best", "for men", "for women", "sale", "authentic",
+               "official", "lightweight", "premium", "classic", "wireless", "size m", "gift")
+# Spread of the catalog replicas around their Dataset product (norm of the added noise).
+REPLICA_NOISE = 0.5
+# Headline metrics compared against a baseline: (path, +1 if higher is better else -1).
+COMPARED_METRICS = (("throughput_rps", 1), ("latency_ms.p50", -1), ("latency_ms.p95", -1), ("latency_ms.p99", -1))
+
+
+def git_commit() -> dict:
+    """
+    Returns the current commit and whether the working tree has uncommitted changes.
+    """
+    def git(*args):
+        return subprocess.run(["git", *args], cwd=PIPELINE_DIR, capture_output=True, text=True, check=True).stdout.strip()
+
+    try:
+        return {"commit": git("rev-parse", "HEAD"), "dirty": bool(git("status", "--porcelain", "--untracked-files=no"))}
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+
+
+def load_dataset(dataset_dir: str):
+    """
+    Returns (product records, encoded bytes of every Dataset image).
+    """
+    with open(os.path.join(dataset_dir, "metadata.json"), "r", encoding="utf-8") as f:
+        records = json.load(f)
+    for record in records:
+        record["image_file"] = os.path.join(dataset_dir, os.path.basename(record["image_path"]))
+    images = []
+    for name in sorted(os.listdir(dataset_dir)):
+        if name.lower().endswith((".jpg", ".jpeg", ".png")):
+            with open(os.path.join(dataset_dir, name), "rb") as f:
+                images.append(f.read())
+    return records, images
+
+
+def jitter_image(data: bytes, rng: np.random.Generator) -> bytes:
+    """
+    Returns a random 85-100% crop of an encoded image, re-encoded as JPEG (a distinct upload).
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        image = image.convert("RGB")
+        width, height = image.size
+        scale = rng.uniform(0.85, 1.0)
+        w, h = max(1, int(width * scale)), max(1, int(height * scale))
+        left, top = int(rng.integers(0, width - w + 1)), int(rng.integers(0, height - h + 1))
+        buffer = io.BytesIO()
+        image.crop((left, top, left + w, top + h)).save(buffer, format="JPEG", quality=int(rng.integers(80, 96)))
+    return buffer.getvalue()
+
+
+def make_query(record: dict, rng: np.random.Generator) -> str:
+    """
+    Returns a shopper-style query for a product: some of its attributes plus filler words.
+    """
+    words = [record["brand"], record["color"], record["category"].split("/")[-1].strip(), record["name"]]
+    words = [words[i] for i in sorted(rng.choice(len(words), size=int(rng.integers(2, len(words) + 1)), replace=False))]
+    words += list(rng.choice(QUERY_WORDS, size=int(rng.integers(0, 3)), replace=False))
+    return " ".join(words)
+
+
+def build_workload(make_item, count: int, repeat_ratio: float, rng: np.random.Generator) -> list:
+    """
+    Returns `count` payloads; each is, with probability `repeat_ratio`, a repeat of an earlier one.
+    """
+    payloads = []
+    for _ in range(count):
+        if payloads and rng.random() < repeat_ratio:
+            payloads.append(payloads[int(rng.integers(len(payloads)))])
+        else:
+            payloads.append(make_item())
+    return payloads
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+
+async def build_catalog(records: list, size: int, rng: np.random.Generator) -> tuple:
+    """
+    Embeds the Dataset products with the fake model and grows them to `size` products: the
+    originals plus renamed replicas whose vectors are noisy copies of their source product.
+
+    Returns:
+        tuple: (product documents, {collection: float32 matrix of normalized rows}).
+    """
+    images = []
+    for record in records:
+        with Image.open(record["image_file"]) as image:
+            images.append(image.convert("RGB"))
+    base = {
+        ingest_catalog.VISUAL_COLLECTION: await clip_inference.embed_images(images),
+        ingest_catalog.TEXT_COLLECTION: await clip_inference.embed_texts([record["text"] for record in records]),
+    }
+
+    products = []
+    sources = np.arange(max(size, len(records))) % len(records)
+    for i, source in enumerate(sources):
+        product = {key: value for key, value in records[source].items() if key != "image_file"}
+        if i >= len(records):
+            product["id"] = f"{product['id']}-r{i}"
+            product["SKU"] = f"{product['SKU']}-R{i}"
+        products.append(product)
+
+    vectors = {}
+    for collection, matrix in base.items():
+        noise = rng.standard_normal((len(sources), matrix.shape[1])).astype(np.float32)
+        noise *= REPLICA_NOISE / np.sqrt(matrix.shape[1])
+        noise[:len(records)] = 0.0
+        vectors[collection] = _normalize_rows(matrix[sources] + noise).astype(np.float32)
+    return products, vectors
+
+
+async def load_qdrant(products: list, vectors: dict):
+    """
+    Creates and fills the collections of the in-memory Qdrant stand-in.
+    """
+    client = qdrant_client.get_async_client()
+    for collection, matrix in vectors.items():
+        await client.create_collection(
+            collection_name=collection,
+            vectors_config=models.VectorParams(size=matrix.shape[1], distance=models.Distance.COSINE),
+        )
+        await ingest_catalog.upsert_points(collection, products, matrix, batch_size=256, parallel=4)
+
+
+def write_snapshot(products: list, vectors: dict, out_dir: str):
+    """
+    Writes the catalog in the embedded-backend snapshot layout (see db/search_backend.py).
+    """
+    payloads = [{field: product[field] for field in ingest_catalog.PAYLOAD_FIELDS if field in product} for product in products]
+    for collection, matrix in vectors.items():
+        directory = os.path.join(out_dir, collection)
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, "vectors.npy"), matrix)
+        with open(os.path.join(directory, "payloads.json"), "w", encoding="utf-8") as f:
+            json.dump(payloads, f)
+
+
+def reset_caches():
+    """
+    Empties the embedding, match and product-document caches.
+    """
+    clip_inference.TEXT_EMBEDDING_CACHE.memory.clear()
+    clip_inference.VISUAL_EMBEDDING_CACHE.memory.clear()
+    product_matching.invalidate_catalog()
+
+
+async def match_visual(data: bytes):
+    embedding = await clip_inference.get_clip_visual_embedding(data)
+    return await product_matching.match_product_by_visual(embedding)
+
+
+async def match_text(text: str):
+    embedding = await clip_inference.get_clip_text_embedding(text)
+    return await product_matching.match_product_by_text(embedding)
+
+
+async def preprocess_upload(data: bytes):
+    # On a worker thread, as in get_clip_visual_embedding.
+    return await asyncio.to_thread(clip_inference.decode_and_preprocess_image, data)
+
+
+def build_scenario(name: str, ctx: dict, warmup: int, requests: int, rng: np.random.Generator) -> tuple:
+    """
+    Returns (call, warm-up payloads, measured payloads) for one scenario.
+    """
+    images, records, repeat_ratio = ctx["images"], ctx["records"], ctx["repeat_ratio"]
+    count = warmup + requests
+
+    def upload():
+        return jitter_image(images[int(rng.integers(len(images)))], rng)
+
+    def query():
+        return make_query(records[int(rng.integers(len(records)))], rng)
+
+    if name == "cache_hit":
+        # The warm-up covers the whole hot set, so every measured request is a cache hit.
+        hot_set = [upload() for _ in range(ctx["hot_set"])]
+        warm = hot_set + [hot_set[int(rng.integers(len(hot_set)))] for _ in range(max(0, warmup - len(hot_set)))]
+        return match_visual, warm, [hot_set[int(rng.integers(len(hot_set)))] for _ in range(requests)]
+
+    if name == "preprocess_image":
+        call, make_item = preprocess_upload, upload
+    elif name == "search_embedding":
+        matrix = ctx["vectors"][ingest_catalog.VISUAL_COLLECTION]
+
+        def query_vector():
+            row = matrix[int(rng.integers(matrix.shape[0]))]
+            return _normalize_rows((row + 0.3 * rng.standard_normal(row.shape[0]) / np.sqrt(row.shape[0]))[None, :])
+
+        async def search(vector):
+            return await qdrant_client.search_embedding(vector, ingest_catalog.VISUAL_COLLECTION, top_k=5)
+
+        call, make_item = search, query_vector
+    elif name == "match_visual":
+        call, make_item = match_visual, upload
+    elif name == "match_text":
+        call, make_item = match_text, query
+    else:
+        raise ValueError(f"Unknown scenario '{name}'.")
+    payloads = build_workload(make_item, count, repeat_ratio, rng)
+    return call, payloads[:warmup], payloads[warmup:]
+
+
+async def drive(call, payloads: list, concurrency: int = None, rate: float = None, rng: np.random.Generator = None) -> dict:
+    """
+    Replays `payloads` through `call`, closed-loop with `concurrency` workers or open-loop at
+    `rate` requests per second (Poisson arrivals), and summarizes throughput and latency.
+    """
+    latencies = []
+    errors = {}
+
+    async def one(payload, started):
+        try:
+            await call(payload)
+        except Exception as e:
+            errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+            return
+        latencies.append(time.perf_counter() - started)
+
+    start = time.perf_counter()
+    if rate:
+        arrivals = start + np.cumsum(rng.exponential(1.0 / rate, size=len(payloads)))
+        tasks = []
+        for payload, arrival in zip(payloads, arrivals):
+            delay = arrival - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(one(payload, arrival)))
+        await asyncio.gather(*tasks)
+    else:
+        pending = iter(payloads)
+
+        async def worker():
+            for payload in pending:
+                await one(payload, time.perf_counter())
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies_ms = 1000.0 * np.asarray(latencies or [0.0])
+    return {
+        "requests": len(payloads),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "latency_ms": {
+            "mean": round(float(latencies_ms.mean()), 3),
+            "p50": round(float(np.percentile(latencies_ms, 50)), 3),
+            "p95": round(float(np.percentile(latencies_ms, 95)), 3),
+            "p99": round(float(np.percentile(latencies_ms, 99)), 3),
+            "max": round(float(latencies_ms.max()), 3),
+        },
+    }
+
+
+def stage_summary() -> tuple:
+    """
+    Returns (per-stage latency, per-stage error counts) recorded since the last metrics.reset().
+    """
+    snapshot = metrics.snapshot()
+    stages = {
+        stage: {key: round(value, 3) if isinstance(value, float) else value for key, value in stats.items()}
+        for stage, stats in sorted(snapshot.get(metrics.STAGE_SECONDS.name, {}).items())
+    }
+    return stages, {stage: int(count) for stage, count in snapshot.get(metrics.STAGE_ERRORS.name, {}).items()}
+
+
+async def run(args) -> dict:
+    rng = np.random.default_rng(args.seed)
+    model = fakes.FakeClipModel(seed=args.seed, latency_ms=args.triton_latency_ms, per_item_ms=args.triton_per_item_ms)
+    tokenizer = args.tokenizer
+    if tokenizer == "auto":
+        tokenizer = "clip" if os.path.exists(os.path.join(clip_inference.CLIP_ASSETS_DIR, "vocab.json")) else "fake"
+    stand_ins = fakes.install(model, mongo_latency_ms=args.mongo_latency_ms, fake_tokenizer=tokenizer == "fake")
+
+    records, images = load_dataset(args.dataset)
+    products, vectors = await build_catalog(records, args.catalog_size, rng)
+    stand_ins["products"].insert_many(products)
+    await load_qdrant(products, vectors)
+
+    snapshot_dir = None
+    if args.backend == "embedded":
+        snapshot_dir = tempfile.TemporaryDirectory(prefix="loadtest-snapshot-")
+        write_snapshot(products, vectors, snapshot_dir.name)
+        search_backend.set_backend(search_backend.EmbeddedBackend(snapshot_dir.name))
+    else:
+        search_backend.set_backend(search_backend.QdrantBackend())
+
+    ctx = {"images": images, "records": records, "vectors": vectors, "repeat_ratio": args.repeat_ratio, "hot_set": args.hot_set}
+    loads = [("rate", rate) for rate in args.rate] if args.rate else [("concurrency", c) for c in args.concurrency]
+    runs = []
+    for scenario in args.scenarios:
+        for mode, level in loads:
+            call, warm, payloads = build_scenario(scenario, ctx, args.warmup, args.requests, rng)
+            reset_caches()
+            await drive(call, warm, concurrency=1)
+            metrics.reset()
+            calls, rows = model.calls, model.rows
+            if mode == "rate":
+                result = await drive(call, payloads, rate=level, rng=rng)
+            else:
+                result = await drive(call, payloads, concurrency=level)
+            stages, stage_errors = stage_summary()
+            model_calls = model.calls - calls
+            runs.append({
+                "scenario": scenario,
+                "mode": mode,
+                "level": level,
+                **result,
+                "model": {"calls": model_calls, "avg_batch_size": round((model.rows - rows) / model_calls, 2) if model_calls else 0.0},
+                "stages": stages,
+                "stage_errors": stage_errors,
+            })
+            row = runs[-1]
+            print(f"{scenario:17s} {mode}={level:<6g} rps={row['throughput_rps']:>8.1f}  "
+                  f"p50={row['latency_ms']['p50']:>7.2f} ms  p95={row['latency_ms']['p95']:>7.2f} ms  "
+                  f"p99={row['latency_ms']['p99']:>7.2f} ms  errors={sum(row['errors'].values())}")
+
+    await qdrant_client.close_async_client()
+    if snapshot_dir is not None:
+        snapshot_dir.cleanup()
+    return {
+        "meta": {
+            **git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "tokenizer": tokenizer,
+            "catalog_products": len(products),
+            "args": {key: value for key, value in vars(args).items() if key not in ("json", "compare")},
+        },
+        "runs": runs,
+    }
+
+
+def _lookup(row: dict, path: str) -> float:
+    for key in path.split("."):
+        row = row[key]
+    return row
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> list:
+    """
+    Prints the change of each headline metric per run and returns the regressions, i.e. the
+    metrics that got worse by more than `threshold` percent.
+    """
+    previous = {(row["scenario"], row["mode"], row["level"]): row for row in baseline["runs"]}
+    print(f"\nCompared with {baseline['meta'].get('commit') or 'baseline'} (threshold {threshold:g}%):")
+    regressions = []
+    for row in current["runs"]:
+        base = previous.get((row["scenario"], row["mode"], row["level"]))
+        if base is None:
+            continue
+        for path, direction in COMPARED_METRICS:
+            old, new = _lookup(base, path), _lookup(row, path)
+            change = 100.0 * (new - old) / old if old else 0.0
+            regressed = direction * change < -threshold
+            print(f"  {row['scenario']:17s} {row['mode']}={row['level']:<6g} {path:15s} "
+                  f"{old:>10.2f} -> {new:>10.2f} ({change:+6.1f}%){'  REGRESSION' if regressed else ''}")
+            if regressed:
+                regressions.append({"scenario": row["scenario"], "mode": row["mode"], "level": row["level"],
+                                    "metric": path, "baseline": old, "current": new, "change_pct": round(change, 1)})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of the matching pipeline against local stand-ins.")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16], help="Closed-loop workers per run.")
+    parser.add_argument("--rate", type=float, nargs="+", default=None, help="Open-loop arrival rates (requests/s); overrides --concurrency.")
+    parser.add_argument("--requests", type=int, default=500, help="Measured requests per run.")
+    parser.add_argument("--warmup", type=int, default=20, help="Unmeasured requests before each run.")
+    parser.add_argument("--repeat-ratio", type=float, default=0.0, help="Fraction of requests repeating an earlier payload.")
+    parser.add_argument("--hot-set", type=int, default=8, help="Distinct uploads in the cache_hit scenario.")
+    parser.add_argument("--catalog-size", type=int, default=1000, help="Products in the stand-in catalog.")
+    parser.add_argument("--backend", choices=("qdrant", "embedded"), default="qdrant", help="Search backend of the match scenarios.")
+    parser.add_argument("--triton-latency-ms", type=float, default=2.0, help="Simulated latency per Triton call.")
+    parser.add_argument("--triton-per-item-ms", type=float, default=0.2, help="Simulated latency per row of a Triton batch.")
+    parser.add_argument("--mongo-latency-ms", type=float, default=0.5, help="Simulated latency per MongoDB query.")
+    parser.add_argument("--tokenizer", choices=("auto", "clip", "fake"), default="auto",
+                        help="'auto' uses the CLIP tokenizer if it is in CLIP_ASSETS_DIR, else the fake one.")
+    parser.add_argument("--dataset", default=DEFAULT_DATASET, help="Directory with metadata.json and the product images.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", default=None, help="Optional path to write the results as JSON.")
+    parser.add_argument("--compare", default=None, help="Baseline results (JSON) to compare against.")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Regression threshold in percent for --compare.")
+    args = parser.parse_args()
+    if args.hot_set < 1:
+        parser.error("--hot-set must be at least 1.")
+
+    results = asyncio.run(run(args))
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            results["regressions"] = compare(json.load(f), results, args.threshold)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if results.get("regressions"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
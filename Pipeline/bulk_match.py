@@ -0,0 +1,440 @@
+"""
+bulk_match.py
+-------------
+Offline bulk matching: matches a folder of images, or a JSONL / CSV / JSON file of listings,
+against the catalog and writes the top-k matches of every input to JSONL or Parquet.
+
+Pipeline (async stages connected by queues of at most --queue-size chunks, so memory stays flat
+whatever the input size):
+  1. Stream inputs in chunks of --batch-size (directory walk in sorted order, or file rows).
+  2. Decode: images are read, decoded and preprocessed on a thread pool; texts are tokenized.
+  3. Embed each chunk through the batched CLIP path (embed_pixel_values / embed_token_ids).
+  4. Search each chunk with one batched request per collection (search_batch of the search
+     backend); inputs with both an image and a text are fused as in match_product_hybrid.
+  5. Join metadata of all products matched by the chunk with one bulk MongoDB lookup.
+  6. Write rows in input order. Every --flush-rows rows the output is flushed to disk and the
+     checkpoint records how many inputs are committed. At most --max-pending chunks are read
+     ahead of the next one to write, so a slow chunk cannot make finished ones pile up.
+
+Running the same command again resumes after the last checkpoint; output written after it is
+discarded first. Use --restart to start over. Unreadable inputs are reported per row
+(status "error"); failures of Triton, the search backend or MongoDB stop the job so the
+affected chunk is retried on resume.
+
+Input rows use --key-field (default "id", else the row number), --image-field (default
+"image_path", relative paths are resolved against --image-root) and --text-field (default "text").
+
+Usage (from the Pipeline directory):
+    python bulk_match.py --input /data/supplier_photos --output matches.jsonl
+    python bulk_match.py --input listings.csv --text-field title --output matches.parquet --top-k 3
+"""
+
+import argparse
+import asyncio
+import csv
+import glob
+import io
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+from clip_inference import embed_pixel_values, embed_token_ids, preprocess_image, preprocess_texts
+from db import mongodb_client, search_backend
+from ingest_catalog import TEXT_COLLECTION, VISUAL_COLLECTION, iter_batches, iter_metadata, load_state, save_state
+from product_matching import HYBRID_CANDIDATE_MULTIPLIER, candidate_limit, collapse_variants, fuse_results
+from utils.logger import log_event_sync
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp", ".gif")
+MODES = ("auto", "image", "text", "hybrid")
+# Product fields copied into each match of the output.
+MATCH_FIELDS = ("SKU", "name", "brand", "category", "color", "price")
+
+
+def iter_directory(root: str):
+    """
+    Yields the image files under `root` as input items, in a stable (sorted) order.
+    """
+    for directory, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                path = os.path.join(directory, name)
+                yield {"key": os.path.relpath(path, root), "image_path": path, "text": None}
+
+
+def iter_rows(path: str):
+    """
+    Streams rows of a CSV, JSONL or JSON-array file.
+    """
+    if path.lower().endswith(".csv"):
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            yield from csv.DictReader(f)
+    else:
+        yield from iter_metadata(path)
+
+
+def iter_inputs(args):
+    """
+    Yields input items {"seq", "key", "kind", "image_path", "text"} (and "error" for rows that
+    cannot be matched in the requested mode).
+    """
+    if os.path.isdir(args.input):
+        items = iter_directory(args.input)
+    else:
+        items = (
+            {
+                "key": str(row.get(args.key_field) or seq),
+                "image_path": _resolve(row.get(args.image_field), args.image_root),
+                "text": (row.get(args.text_field) or "").strip() or None,
+            }
+            for seq, row in enumerate(iter_rows(args.input))
+        )
+    for seq, item in enumerate(items):
+        item["seq"] = seq
+        has_image, has_text = item["image_path"] is not None, item["text"] is not None
+        mode = args.mode
+        if mode == "auto":
+            mode = "hybrid" if has_image and has_text else "image" if has_image else "text"
+        item["kind"] = mode
+        needs_image, needs_text = mode in ("image", "hybrid"), mode in ("text", "hybrid")
+        if not has_image and not has_text:
+            item["error"] = "Input has neither an image nor a text."
+        elif (needs_image and not has_image) or (needs_text and not has_text):
+            item["error"] = f"Input has no {'image' if needs_image and not has_image else 'text'} for mode '{mode}'."
+        yield item
+
+
+def _resolve(value, root: str):
+    if not value:
+        return None
+    return value if os.path.isabs(value) else os.path.join(root, value)
+
+
+def load_pixels(path: str) -> np.ndarray:
+    """
+    Reads, decodes and preprocesses one image into a [1, 3, 224, 224] float16 array.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    with Image.open(io.BytesIO(data)) as image:
+        return preprocess_image(image.convert("RGB"))
+
+
+async def decode_chunk(chunk: dict, executor, args) -> dict:
+    loop = asyncio.get_running_loop()
+    items = [item for item in chunk["items"] if "error" not in item]
+
+    image_items = [item for item in items if item["kind"] in ("image", "hybrid")]
+    results = await asyncio.gather(
+        *(loop.run_in_executor(executor, load_pixels, item["image_path"]) for item in image_items), return_exceptions=True
+    )
+    decoded = []
+    for item, result in zip(image_items, results):
+        if isinstance(result, BaseException):
+            item["error"] = f"Could not read image: {result}"
+        else:
+            decoded.append((item, result))
+    chunk["visual_items"] = [item for item, _ in decoded]
+    chunk["pixels"] = np.concatenate([pixels for _, pixels in decoded]) if decoded else None
+
+    text_items = [item for item in items if item["kind"] in ("text", "hybrid") and "error" not in item]
+    chunk["text_items"] = text_items
+    chunk["tokens"] = await loop.run_in_executor(executor, preprocess_texts, [item["text"] for item in text_items]) if text_items else None
+    return chunk
+
+
+async def embed_chunk(chunk: dict, args) -> dict:
+    pixels, tokens = chunk.pop("pixels"), chunk.pop("tokens")
+    visual, text = await asyncio.gather(
+        embed_pixel_values(pixels, batch_size=args.embed_batch_size) if pixels is not None else _none(),
+        embed_token_ids(tokens, batch_size=args.embed_batch_size) if tokens is not None else _none(),
+    )
+    chunk["visual_vectors"], chunk["text_vectors"] = visual, text
+    return chunk
+
+
+async def _none():
+    return None
+
+
+async def search_chunk(chunk: dict, args) -> dict:
+    backend = search_backend.get_backend()
+    # Hybrid inputs fuse larger candidate lists, as match_product_hybrid does.
+    hybrid = any(item["kind"] == "hybrid" and "error" not in item for item in chunk["items"])
+    limit = candidate_limit(args.top_k) * (HYBRID_CANDIDATE_MULTIPLIER if hybrid else 1)
+
+    async def search(vectors, collection):
+        if vectors is None:
+            return []
+        return await backend.search_batch(vectors, collection, top_k=limit, min_score=args.min_score, filters=args.filters)
+
+    visual_hits, text_hits = await asyncio.gather(
+        search(chunk.pop("visual_vectors"), VISUAL_COLLECTION), search(chunk.pop("text_vectors"), TEXT_COLLECTION)
+    )
+    visual_by_seq = {item["seq"]: hits for item, hits in zip(chunk.pop("visual_items"), visual_hits)}
+    text_by_seq = {item["seq"]: hits for item, hits in zip(chunk.pop("text_items"), text_hits)}
+
+    for item in chunk["items"]:
+        if "error" in item:
+            continue
+        if item["kind"] == "hybrid":
+            hits = fuse_results(visual_by_seq[item["seq"]], text_by_seq[item["seq"]])
+        elif item["kind"] == "image":
+            hits = visual_by_seq[item["seq"]]
+        else:
+            hits = text_by_seq[item["seq"]]
+        # Variant clusters are collapsed as in the API (DEDUP_COLLAPSE_VARIANTS).
+        item["hits"] = collapse_variants(hits, args.top_k)
+    return chunk
+
+
+async def join_chunk(chunk: dict, args) -> dict:
+    product_ids = list(dict.fromkeys(product_id for item in chunk["items"] for _, product_id in item.get("hits", ())))
+    products = await mongodb_client.get_products(product_ids) if product_ids else []
+    by_id = {product_id: product for product_id, product in zip(product_ids, products) if product is not None}
+
+    rows = []
+    for item in chunk["items"]:
+        row = {
+            "key": item["key"],
+            "kind": item["kind"],
+            "input": item["image_path"] if item["kind"] == "image" else item["text"] if item["kind"] == "text"
+            else f"{item['image_path']} | {item['text']}",
+            "status": "error" if "error" in item else "ok",
+            "error": item.get("error"),
+            "matches": [],
+        }
+        for score, product_id in item.get("hits", ()):
+            product = by_id.get(product_id)
+            if product is None:
+                continue
+            row["matches"].append({
+                "rank": len(row["matches"]) + 1,
+                "score": float(score),
+                "product_id": product_id,
+                **{field.lower(): product.get(field) for field in MATCH_FIELDS},
+            })
+        if row["status"] == "ok" and not row["matches"]:
+            row["status"] = "no_match"
+        rows.append(row)
+    chunk["rows"] = rows
+    return chunk
+
+
+class JsonlSink:
+    """
+    Appends rows to a JSONL file. The committed state is the file size.
+    """
+
+    def __init__(self, path: str, state: dict):
+        if state.get("output_bytes"):
+            if not os.path.isfile(path) or os.path.getsize(path) < state["output_bytes"]:
+                raise ValueError(f"Cannot resume: {path} is missing or shorter than its checkpoint "
+                                 f"({state['output_bytes']} bytes); pass --restart to start over.")
+            self._file = open(path, "r+b")
+            self._file.truncate(state["output_bytes"])
+            self._file.seek(0, os.SEEK_END)
+        else:
+            self._file = open(path, "wb")
+
+    def write(self, rows: list):
+        self._file.write("".join(json.dumps(row, default=str) + "\n" for row in rows).encode("utf-8"))
+
+    def commit(self) -> dict:
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return {"output_bytes": self._file.tell()}
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetSink:
+    """
+    Writes rows to a directory of Parquet files, one part per commit. The committed state is
+    the number of parts. Needs pyarrow.
+    """
+
+    def __init__(self, path: str, state: dict):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise RuntimeError("Parquet output needs pyarrow (pip install pyarrow); use a .jsonl output instead.")
+        self._pa, self._pq = pa, pq
+        self._schema = pa.schema([
+            ("key", pa.string()), ("kind", pa.string()), ("input", pa.string()),
+            ("status", pa.string()), ("error", pa.string()),
+            ("matches", pa.list_(pa.struct([
+                ("rank", pa.int32()), ("score", pa.float32()), ("product_id", pa.string()),
+                ("sku", pa.string()), ("name", pa.string()), ("brand", pa.string()),
+                ("category", pa.string()), ("color", pa.string()), ("price", pa.float64()),
+            ]))),
+        ])
+        self._path = path
+        self._parts = state.get("parts", 0)
+        os.makedirs(path, exist_ok=True)
+        # Parts beyond the checkpoint come from an interrupted run.
+        for part in glob.glob(os.path.join(path, "part-*.parquet")):
+            if int(os.path.basename(part)[5:-8]) >= self._parts:
+                os.remove(part)
+        self._rows = []
+
+    def write(self, rows: list):
+        self._rows.extend(rows)
+
+    def commit(self) -> dict:
+        if self._rows:
+            table = self._pa.Table.from_pylist(self._rows, schema=self._schema)
+            part = os.path.join(self._path, f"part-{self._parts:05d}.parquet")
+            self._pq.write_table(table, part + ".tmp")
+            os.replace(part + ".tmp", part)
+            self._parts += 1
+            self._rows = []
+        return {"parts": self._parts}
+
+    def close(self):
+        pass
+
+
+async def run_stage(fn, inbox: asyncio.Queue, outbox: asyncio.Queue, workers: int):
+    """
+    Runs `fn` on every chunk from `inbox` with `workers` concurrent workers and forwards the
+    results. A None chunk marks the end of the input.
+    """
+    async def worker():
+        while True:
+            chunk = await inbox.get()
+            if chunk is None:
+                await inbox.put(None)  # let the other workers see the end too
+                return
+            await outbox.put(await fn(chunk))
+
+    await asyncio.gather(*(worker() for _ in range(workers)))
+    await outbox.put(None)
+
+
+async def bulk_match(args) -> dict:
+    checkpoint = {} if args.restart else load_state(args.checkpoint)
+    identity = {"input": os.path.abspath(args.input), "output": os.path.abspath(args.output), "format": args.format}
+    if checkpoint and any(checkpoint.get(key) != value for key, value in identity.items()):
+        raise ValueError(f"Checkpoint {args.checkpoint} belongs to another job; pass --restart to start over.")
+    processed = checkpoint.get("processed", 0)
+    counts = {"matched": checkpoint.get("matched", 0), "no_match": checkpoint.get("no_match", 0), "failed": checkpoint.get("failed", 0)}
+    if processed:
+        print(f"Resuming after {processed} inputs.")
+
+    sink = (ParquetSink if args.format == "parquet" else JsonlSink)(args.output, checkpoint)
+    executor = ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="bulk-match-io")
+    queues = [asyncio.Queue(maxsize=args.queue_size) for _ in range(5)]
+    # Chunks read but not yet written; the writer releases one permit per chunk it writes.
+    in_flight = asyncio.Semaphore(args.max_pending)
+    started = time.perf_counter()
+    start_processed = processed
+
+    async def read():
+        items = itertools.islice(iter_inputs(args), processed, None)
+        for index, batch in enumerate(iter_batches(items, args.batch_size)):
+            await in_flight.acquire()
+            await queues[0].put({"index": index, "items": batch})
+        await queues[0].put(None)
+
+    async def write():
+        nonlocal processed
+        pending, next_index, uncommitted = {}, 0, 0
+        while True:
+            chunk = await queues[4].get()
+            if chunk is not None:
+                pending[chunk["index"]] = chunk
+            # Chunks may finish out of order; rows are written in input order.
+            while next_index in pending:
+                ready = pending.pop(next_index)
+                sink.write(ready["rows"])
+                for row in ready["rows"]:
+                    counts["failed" if row["status"] == "error" else "matched" if row["status"] == "ok" else "no_match"] += 1
+                processed += len(ready["rows"])
+                uncommitted += len(ready["rows"])
+                next_index += 1
+                in_flight.release()
+            if uncommitted and (uncommitted >= args.flush_rows or chunk is None):
+                save_state(args.checkpoint, {**identity, "processed": processed, **counts, **sink.commit()})
+                uncommitted = 0
+                elapsed = time.perf_counter() - started
+                print(f"processed={processed} matched={counts['matched']} no_match={counts['no_match']} "
+                      f"failed={counts['failed']} rate={(processed - start_processed) / elapsed:.1f} items/s")
+            if chunk is None:
+                return
+
+    tasks = [
+        asyncio.create_task(read()),
+        asyncio.create_task(run_stage(lambda chunk: decode_chunk(chunk, executor, args), queues[0], queues[1], args.concurrency)),
+        asyncio.create_task(run_stage(lambda chunk: embed_chunk(chunk, args), queues[1], queues[2], args.concurrency)),
+        asyncio.create_task(run_stage(lambda chunk: search_chunk(chunk, args), queues[2], queues[3], args.concurrency)),
+        asyncio.create_task(run_stage(lambda chunk: join_chunk(chunk, args), queues[3], queues[4], args.concurrency)),
+        asyncio.create_task(write()),
+    ]
+    try:
+        await asyncio.gather(*tasks)
+    except Exception as e:
+        log_event_sync("ERROR", f"Bulk matching stopped: {e}", extra={"function": "bulk_match", "processed": processed})
+        raise
+    finally:
+        for task in tasks:
+            task.cancel()
+        executor.shutdown()
+        sink.close()
+
+    elapsed = time.perf_counter() - started
+    summary = {
+        "processed": processed, **counts, "seconds": round(elapsed, 2),
+        "items_per_second": round((processed - start_processed) / elapsed, 2) if elapsed else 0.0,
+    }
+    log_event_sync("INFO", "Bulk matching finished.", extra=summary)
+    print(json.dumps(summary))
+    return summary
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Match a folder of images or a JSONL / CSV file against the catalog.")
+    parser.add_argument("--input", required=True, help="Image directory, or a .jsonl / .csv / .json file of listings.")
+    parser.add_argument("--output", required=True, help="Output .jsonl file or .parquet directory.")
+    parser.add_argument("--format", choices=["jsonl", "parquet"], default=None, help="Defaults to the output extension.")
+    parser.add_argument("--checkpoint", default=None, help="Checkpoint file (defaults to <output>.checkpoint.json).")
+    parser.add_argument("--restart", action="store_true", help="Ignore the checkpoint and start over.")
+    parser.add_argument("--mode", choices=MODES, default="auto", help="'auto' uses every field a row has (hybrid if both).")
+    parser.add_argument("--key-field", default="id")
+    parser.add_argument("--image-field", default="image_path")
+    parser.add_argument("--text-field", default="text")
+    parser.add_argument("--image-root", default=None, help="Base directory of relative image paths (defaults to the input's directory).")
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--min-score", type=float, default=None)
+    parser.add_argument("--filters", type=json.loads, default=None, help='Payload filters as JSON, e.g. \'{"brand": "Sony"}\'.')
+    parser.add_argument("--batch-size", type=int, default=64, help="Inputs per chunk.")
+    parser.add_argument("--embed-batch-size", type=int, default=64, help="Items per Triton call.")
+    parser.add_argument("--concurrency", type=int, default=2, help="Chunks processed concurrently by each stage.")
+    parser.add_argument("--queue-size", type=int, default=2, help="Chunks buffered between two stages.")
+    parser.add_argument("--max-pending", type=int, default=None,
+                        help="Chunks read ahead of the next one to write (defaults to what the stages and queues hold).")
+    parser.add_argument("--workers", type=int, default=8, help="Threads reading and decoding images.")
+    parser.add_argument("--flush-rows", type=int, default=2048, help="Rows written between checkpoints.")
+    args = parser.parse_args(argv)
+    if args.top_k < 1:
+        parser.error("--top-k must be at least 1.")
+    if args.max_pending is None:
+        args.max_pending = 4 * args.concurrency + 5 * args.queue_size
+    if args.max_pending < 1:
+        parser.error("--max-pending must be at least 1.")
+    if args.format is None:
+        args.format = "parquet" if args.output.rstrip("/").lower().endswith(".parquet") else "jsonl"
+    if args.checkpoint is None:
+        args.checkpoint = args.output.rstrip("/") + ".checkpoint.json"
+    if args.image_root is None:
+        args.image_root = args.input if os.path.isdir(args.input) else os.path.dirname(os.path.abspath(args.input))
+    return args
+
+
+if __name__ == "__main__":
+    asyncio.run(bulk_match(parse_args()))
@@ -4,26 +4,340 @@ clip_inference.py
 Triton client wrappers for obtaining CLIP embeddings separately:
   - get_clip_text_embedding: Uses the "clip_text" model.
   - get_clip_visual_embedding: Uses the "clip_visual" model.
-This version uses PIL for images and Hugging Face's CLIPProcessor for preprocessing.
+Concurrent requests are coalesced into batched Triton calls by a micro-batcher, and repeated
+inputs are answered from a content-addressed embedding cache before any preprocessing.
+Concurrent calls for the same input share one in-flight computation (utils/singleflight.py).
+embed_texts / embed_images embed whole lists and return one (N, D) float32 matrix.
+Images are preprocessed by a vectorized NumPy engine equivalent to Hugging Face's CLIPProcessor;
+text is tokenized with CLIPTokenizer.
+Triton is called through its native asyncio clients (HTTP via aiohttp, or gRPC), so requests
+never wait for a free executor thread and connections are pooled and kept alive.
+Tensors travel as JSON, with the binary HTTP extension, over gRPC, or through system shared
+memory regions on the same host (TRITON_TRANSPORT).
+Importing this module loads no model and opens no connection: the tokenizer, CLIPProcessor and
+Triton client are created on first use, and warm_up() does all of it ahead of the first request.
 """
 
 import asyncio
+import atexit
+import io
+import os
+import time
 import numpy as np
-import tritonclient.http as httpclient  # NVIDIA Triton client library
+from PIL import Image
+import tritonclient.grpc.aio as grpcclient  # NVIDIA Triton client library (asyncio gRPC)
+import tritonclient.http.aio as httpclient  # NVIDIA Triton client library (asyncio HTTP)
 from utils.logger import log_event_sync  # our MongoDB logger
-from transformers import CLIPProcessor, CLIPTokenizer
+from utils.batcher import MicroBatcher
+from utils.image_preprocessing import ClipImagePreprocessor
+from utils.triton_shm import SharedMemoryPool
+from utils.embedding_cache import EmbeddingCache, hash_bytes, hash_image, normalize_prompt
+from utils.lazy import Lazy, LoopLocal
+from utils.singleflight import SingleFlight
+from utils import metrics
 
-# Global processor and tokenizer instances.
+CLIP_MODEL_NAME = "openai/clip-vit-base-patch32"
+# Serialized tokenizer / processor files. After the first download they are loaded from here
+# with local_files_only=True, so startup makes no Hugging Face Hub requests.
+CLIP_ASSETS_DIR = os.environ.get(
+    "CLIP_ASSETS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "model", "clip_assets")
+)
 
-PROCESSOR = CLIPProcessor.from_pretrained("openai/clip-vit-base-patch32")
-TOKENIZER = CLIPTokenizer.from_pretrained("openai/clip-vit-base-patch32")
+def _load_pretrained(cls, marker_file: str):
+    """
+    Loads `cls` from CLIP_ASSETS_DIR if it was serialized there, otherwise from the Hub,
+    saving a local copy for the next start.
+    """
+    if os.path.exists(os.path.join(CLIP_ASSETS_DIR, marker_file)):
+        return cls.from_pretrained(CLIP_ASSETS_DIR, local_files_only=True)
+    instance = cls.from_pretrained(CLIP_MODEL_NAME)
+    try:
+        instance.save_pretrained(CLIP_ASSETS_DIR)
+    except OSError as e:
+        log_event_sync("ERROR", f"Could not save {cls.__name__} to {CLIP_ASSETS_DIR}: {e}", extra={"function": "_load_pretrained"})
+    return instance
+
+def _load_tokenizer():
+    from transformers import CLIPTokenizer
+    return _load_pretrained(CLIPTokenizer, "vocab.json")
+
+def _load_processor():
+    from transformers import CLIPProcessor
+    return _load_pretrained(CLIPProcessor, "preprocessor_config.json")
+
+# Global processor and tokenizer instances, loaded on first use.
+TOKENIZER = Lazy(_load_tokenizer, "clip_tokenizer")
+PROCESSOR = Lazy(_load_processor, "clip_processor")
+
+# Vectorized NumPy preprocessing for the fixed CLIP ViT-B/32 image pipeline.
+# Set USE_FAST_PREPROCESSING = False to fall back to CLIPProcessor.
+USE_FAST_PREPROCESSING = True
+PREPROCESS_WORKERS = 4
+IMAGE_PREPROCESSOR = ClipImagePreprocessor(num_workers=PREPROCESS_WORKERS)
+
+# Triton Inference Server endpoint, e.g. "triton:8000" (a leading "http://" is ignored).
+TRITON_URL = os.environ.get("TRITON_URL", "localhost:8000").split("://", 1)[-1].rstrip("/")
+# How tensors are sent to Triton:
+#   "http-json"    HTTP with tensors serialized as JSON (slowest; kept for comparison)
+#   "http-binary"  HTTP with the binary tensor data extension
+#   "grpc"         gRPC (point TRITON_URL at the gRPC port, 8001 by default)
+#   "shm"          HTTP, with image batches passed through system shared-memory regions;
+#                  needs Triton on the same host. Text batches are small and use http-binary.
+TRITON_TRANSPORT = os.environ.get("TRITON_TRANSPORT", "http-binary")
+TRITON_TRANSPORTS = ("http-json", "http-binary", "grpc", "shm")
+# Connection pooling: the HTTP client keeps up to TRITON_CONN_LIMIT keep-alive connections;
+# gRPC multiplexes all requests over one channel and pings it every TRITON_KEEPALIVE_MS.
+TRITON_CONN_LIMIT = 64
+TRITON_TIMEOUT = 60.0  # seconds
+TRITON_KEEPALIVE_MS = 30_000
+TRITON_KEEPALIVE_TIMEOUT_MS = 10_000
+
+# Shared-memory regions for the "shm" transport, each sized for the largest image batch.
+SHM_POOL_REGIONS = 8
+
+# Dynamic micro-batching: concurrent requests arriving within BATCH_MAX_WAIT_MS are sent
+# to Triton as one batch of at most BATCH_MAX_SIZE rows.
+USE_MICRO_BATCHING = True
+BATCH_MAX_SIZE = 32
+BATCH_MAX_WAIT_MS = 5.0
+
+# Content-addressed embedding cache checked before preprocessing and Triton.
+# Keys are hashes of the uploaded image bytes or of the normalized prompt. Set
+# EMBEDDING_CACHE_DIR to also keep a memory-mapped on-disk tier that survives restarts.
+EMBEDDING_CACHE_ENABLED = True
+EMBEDDING_CACHE_MAX_ENTRIES = 50_000
+EMBEDDING_CACHE_DIR = None
+EMBEDDING_CACHE_DISK_CAPACITY = 100_000
 
-trition_url = "localhost:8000"  # Triton Inference Server endpoint
-TCLIENT = httpclient.InferenceServerClient(url=trition_url)
+TEXT_EMBEDDING_CACHE = EmbeddingCache("clip_text", max_entries=EMBEDDING_CACHE_MAX_ENTRIES, disk_dir=EMBEDDING_CACHE_DIR, disk_capacity=EMBEDDING_CACHE_DISK_CAPACITY)
+VISUAL_EMBEDDING_CACHE = EmbeddingCache("clip_visual", max_entries=EMBEDDING_CACHE_MAX_ENTRIES, disk_dir=EMBEDDING_CACHE_DIR, disk_capacity=EMBEDDING_CACHE_DISK_CAPACITY)
 
+# Request coalescing: concurrent calls for the same prompt or image (same content hash as the
+# embedding cache) wait for one preprocessing + Triton call instead of each making their own.
+SINGLE_FLIGHT_ENABLED = True
+TEXT_FLIGHTS = SingleFlight("clip_text")
+VISUAL_FLIGHTS = SingleFlight("clip_visual")
+
+# Bulk embedding (embed_images / embed_texts): items per Triton call and chunks in flight.
+EMBED_BATCH_SIZE = 64
+EMBED_MAX_CONCURRENCY = 4
+
+VISUAL_SHM_POOL = SharedMemoryPool(
+    "clip_visual_input",
+    region_bytes=max(BATCH_MAX_SIZE, EMBED_BATCH_SIZE) * 3 * 224 * 224 * np.dtype(np.float16).itemsize,
+    num_regions=SHM_POOL_REGIONS,
+)
+atexit.register(VISUAL_SHM_POOL.destroy)
+
+def _create_triton_client():
+    if TRITON_TRANSPORT not in TRITON_TRANSPORTS:
+        raise ValueError(f"Unknown TRITON_TRANSPORT '{TRITON_TRANSPORT}'; use one of {TRITON_TRANSPORTS}.")
+    if TRITON_TRANSPORT == "grpc":
+        return grpcclient.InferenceServerClient(
+            url=TRITON_URL,
+            keepalive_options=grpcclient.KeepAliveOptions(
+                keepalive_time_ms=TRITON_KEEPALIVE_MS,
+                keepalive_timeout_ms=TRITON_KEEPALIVE_TIMEOUT_MS,
+                keepalive_permit_without_calls=True,
+            ),
+        )
+    return httpclient.InferenceServerClient(url=TRITON_URL, conn_limit=TRITON_CONN_LIMIT, conn_timeout=TRITON_TIMEOUT)
+
+# The aio clients are bound to the loop that created them, so there is one per event loop
+# (e.g. successive asyncio.run() calls in scripts each get their own).
+TRITON_CLIENT = LoopLocal(_create_triton_client, "triton_client")
+
+def get_triton_client():
+    """
+    Returns the asyncio Triton client for the running event loop, creating it on first use.
+    """
+    return TRITON_CLIENT.get()
+
+async def close_triton_client():
+    """
+    Closes the running loop's Triton client (and unregisters shared-memory regions), if any.
+    """
+    client = TRITON_CLIENT.pop()
+    if client is not None:
+        await VISUAL_SHM_POOL.close(client)
+        await client.close()
+
+async def _triton_infer(model_name: str, input_name: str, data: np.ndarray, datatype: str, output_name: str,
+                        shm_slot=None) -> np.ndarray:
+    """
+    Sends one batch to a Triton model over the configured transport and returns the named output.
+    If `shm_slot` is given, `data` must already be a view of that shared-memory region and only
+    a reference to it is sent.
+    """
+    if TRITON_TRANSPORT == "grpc":
+        inputs = [grpcclient.InferInput(input_name, data.shape, datatype)]
+        inputs[0].set_data_from_numpy(data)
+        outputs = [grpcclient.InferRequestedOutput(output_name)]
+        options = {"client_timeout": TRITON_TIMEOUT}
+    else:
+        binary = TRITON_TRANSPORT != "http-json"
+        inputs = [httpclient.InferInput(input_name, data.shape, datatype)]
+        if shm_slot is not None:
+            inputs[0].set_shared_memory(shm_slot.name, data.nbytes)
+        else:
+            inputs[0].set_data_from_numpy(data, binary_data=binary)
+        outputs = [httpclient.InferRequestedOutput(output_name, binary_data=binary)]
+        options = {}
+
+    with metrics.span(f"triton.{model_name}"):
+        result = await get_triton_client().infer(
+            model_name=model_name, model_version="1", inputs=inputs, outputs=outputs, **options
+        )
+    return result.as_numpy(output_name)
+
+async def _infer_text(text_data: np.ndarray) -> np.ndarray:
+    """
+    Runs the clip_text model on a batch of token ids.
+
+    Args:
+        text_data (np.ndarray): Token ids with shape [N, 77] and dtype int64.
+
+    Returns:
+        np.ndarray: The text embeddings with shape [N, D].
+    """
+    text_embedding = await _triton_infer("clip_text", "input", text_data, "INT64", "output")
+    if text_embedding is None:
+        raise ValueError("Triton returned an empty result for text inference.")
+    return text_embedding
+
+async def _infer_visual(image_data: np.ndarray) -> np.ndarray:
+    """
+    Runs the clip_visual model on a batch of preprocessed images.
+
+    Args:
+        image_data (np.ndarray): Pixel values with shape [N, 3, 224, 224] and dtype float16.
+
+    Returns:
+        np.ndarray: The visual embeddings with shape [N, D].
+    """
+    # Micro-batches are assembled in private memory, so they are copied into a region once here.
+    if TRITON_TRANSPORT == "shm" and VISUAL_SHM_POOL.fits(image_data.nbytes):
+        async with VISUAL_SHM_POOL.slot(get_triton_client()) as slot:
+            shared = slot.view(image_data.shape, np.float16)
+            np.copyto(shared, image_data)
+            visual_embedding = await _triton_infer("clip_visual", "Input_Image", shared, "FP16", "Image_Embeddings", shm_slot=slot)
+    else:
+        visual_embedding = await _triton_infer("clip_visual", "Input_Image", image_data, "FP16", "Image_Embeddings")
+    if visual_embedding is None:
+        raise ValueError("Triton returned an empty result for image inference.")
+    return visual_embedding
+
+# Micro-batchers coalescing concurrent single-item requests into one Triton call.
+# Their infer_fn can be swapped for a local stand-in when Triton is not available.
+TEXT_BATCHER = MicroBatcher("clip_text", _infer_text, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS)
+VISUAL_BATCHER = MicroBatcher("clip_visual", _infer_visual, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS)
+
+async def _preprocess_and_infer_visual_shm(images: list) -> np.ndarray:
+    """
+    "shm" transport for bulk embedding: preprocesses a chunk of images straight into a
+    shared-memory region, so the pixels are written exactly once and never serialized.
+    """
+    shape = (len(images), 3, 224, 224)
+    if not VISUAL_SHM_POOL.fits(int(np.prod(shape)) * np.dtype(np.float16).itemsize):
+        return await _infer_visual(await asyncio.to_thread(preprocess_images, images))
+    async with VISUAL_SHM_POOL.slot(get_triton_client()) as slot:
+        shared = slot.view(shape, np.float16)
+        with metrics.span("preprocess.images"):
+            await asyncio.to_thread(preprocess_images, images, shared)
+        visual_embedding = await _triton_infer("clip_visual", "Input_Image", shared, "FP16", "Image_Embeddings", shm_slot=slot)
+    if visual_embedding is None:
+        raise ValueError("Triton returned an empty result for image inference.")
+    return visual_embedding
+
+def get_embedding_cache_stats() -> dict:
+    """
+    Returns hit / miss metrics of the raw-input embedding caches.
+    """
+    return {
+        "clip_text": TEXT_EMBEDDING_CACHE.snapshot(),
+        "clip_visual": VISUAL_EMBEDDING_CACHE.snapshot(),
+    }
+
+def get_batching_stats() -> dict:
+    """
+    Returns batch-size and queue-wait metrics for both micro-batchers.
+    """
+    return {
+        "clip_text": TEXT_BATCHER.stats.snapshot(),
+        "clip_visual": VISUAL_BATCHER.stats.snapshot(),
+    }
+
+async def warm_up(inference: bool = True) -> dict:
+    """
+    Loads everything the first request would otherwise pay for: the tokenizer (and CLIPProcessor
+    when USE_FAST_PREPROCESSING is off) and the Triton connection. With `inference`, also sends
+    one text and one image batch, so Triton has both models resident. Bypasses the caches and
+    micro-batchers.
+
+    Returns:
+        dict: Seconds spent per step.
+    """
+    timings = {}
+    started = time.perf_counter()
+    await asyncio.to_thread(TOKENIZER.get)
+    timings["tokenizer"] = time.perf_counter() - started
+    if not USE_FAST_PREPROCESSING:
+        started = time.perf_counter()
+        await asyncio.to_thread(PROCESSOR.get)
+        timings["processor"] = time.perf_counter() - started
+
+    get_triton_client()
+    if inference:
+        started = time.perf_counter()
+        await _infer_text(preprocess_text("warm up"))
+        timings["triton_text"] = time.perf_counter() - started
+        started = time.perf_counter()
+        await _infer_visual(np.zeros((1, 3, 224, 224), dtype=np.float16))
+        timings["triton_visual"] = time.perf_counter() - started
+
+    log_event_sync("INFO", "CLIP inference warmed up.", extra={"function": "warm_up", "seconds": timings})
+    return timings
+
+def get_single_flight_stats() -> dict:
+    """
+    Returns how many embedding requests were coalesced into an identical in-flight request.
+    """
+    return {
+        "clip_text": {**TEXT_FLIGHTS.stats.snapshot(), "in_flight": TEXT_FLIGHTS.in_flight},
+        "clip_visual": {**VISUAL_FLIGHTS.stats.snapshot(), "in_flight": VISUAL_FLIGHTS.in_flight},
+    }
+
+def get_transport_stats() -> dict:
+    """
+    Returns the active Triton transport and shared-memory pool usage.
+    """
+    return {"transport": TRITON_TRANSPORT, "shm_pool": VISUAL_SHM_POOL.snapshot()}
+
+def _collect_metrics():
+    for name, stats in get_embedding_cache_stats().items():
+        yield from metrics.snapshot_samples(
+            "embedding_cache", stats, {"cache": name},
+            counters=("hits", "misses", "evictions", "disk_hits"), gauges=("hit_ratio", "entries", "bytes"),
+        )
+    for name, stats in get_batching_stats().items():
+        yield from metrics.snapshot_samples(
+            "batcher", stats, {"batcher": name}, counters=("batches", "items", "failed_batches"), gauges=("avg_batch_size",)
+        )
+    for name, stats in get_single_flight_stats().items():
+        yield from metrics.snapshot_samples(
+            "singleflight", stats, {"flight": name}, counters=("calls", "coalesced", "failed", "abandoned"), gauges=("in_flight",)
+        )
+    yield from metrics.snapshot_samples("triton_shm_pool", VISUAL_SHM_POOL.snapshot(), {}, counters=("acquired", "waited"), gauges=("regions", "in_use"))
+
+metrics.register_collector(_collect_metrics)
+
+@metrics.traced("embed.text")
 async def get_clip_text_embedding(text_prompt: str) -> np.ndarray:
     """
     Given a text prompt, obtain the text embedding from the clip_text model.
+    Repeated prompts are served from the embedding cache without tokenizing or calling Triton;
+    concurrent calls for the same prompt share one computation, and different prompts are
+    micro-batched into a single Triton request when enabled.
     
     Args:
         text_prompt (str): The text input.
@@ -31,107 +345,237 @@ async def get_clip_text_embedding(text_prompt: str) -> np.ndarray:
     Returns:
         np.ndarray: The text embedding.
     """
+    cache_key = None
+    if (EMBEDDING_CACHE_ENABLED or SINGLE_FLIGHT_ENABLED) and isinstance(text_prompt, str) and text_prompt.strip():
+        cache_key = hash_bytes(normalize_prompt(text_prompt).encode("utf-8"))
+        cached = TEXT_EMBEDDING_CACHE.get(cache_key) if EMBEDDING_CACHE_ENABLED else None
+        if cached is not None:
+            return cached
+
+    if SINGLE_FLIGHT_ENABLED and cache_key is not None:
+        return await TEXT_FLIGHTS.do(cache_key, lambda: _compute_text_embedding(text_prompt, cache_key))
+    return await _compute_text_embedding(text_prompt, cache_key)
+
+async def _compute_text_embedding(text_prompt: str, cache_key: str) -> np.ndarray:
     try:
         # Preprocess text using Hugging Face's tokenizer.
-        text_data = preprocess_text(text_prompt)
+        with metrics.span("preprocess.text"):
+            text_data = preprocess_text(text_prompt)
     except Exception as e:
         log_event_sync("ERROR", f"Text preprocessing failed: {e}", extra={"function": "get_clip_text_embedding", "text": text_prompt})
         raise ValueError(f"Text preprocessing failed: {e}")
 
     try:
-        # Create Triton client.
-        client = TCLIENT
-    except Exception as e:
-        log_event_sync("ERROR", f"Failed to create Triton client for text: {e}", extra={"function": "get_clip_text_embedding"})
-        raise ConnectionError(f"Failed to create Triton client: {e}")
-
-    try:
-        # Prepare input for the clip_text model.
-        text_inputs = [
-            httpclient.InferInput("input", text_data.shape, "INT64")
-        ]
-        text_inputs[0].set_data_from_numpy(text_data)
-    
-        text_outputs = [
-            httpclient.InferRequestedOutput("output")
-        ]
-    
-        # Perform inference asynchronously.
-        text_result = await asyncio.to_thread(
-            client.infer, model_name="clip_text", model_version="1", inputs=text_inputs, outputs=text_outputs
-        )
-    
-        text_embedding = text_result.as_numpy("output")
-        if text_embedding is None:
-            raise ValueError("Triton returned an empty result for text inference.")
+        if USE_MICRO_BATCHING:
+            text_embedding = await TEXT_BATCHER.submit(text_data)
+        else:
+            text_embedding = await _infer_text(text_data)
     except Exception as e:
         log_event_sync("ERROR", f"Error during text inference: {e}", extra={"function": "get_clip_text_embedding"})
         raise RuntimeError(f"Error during text inference: {e}")
 
+    if EMBEDDING_CACHE_ENABLED and cache_key is not None:
+        TEXT_EMBEDDING_CACHE.set(cache_key, text_embedding)
     return text_embedding
 
+@metrics.traced("embed.visual")
 async def get_clip_visual_embedding(image) -> np.ndarray:
     """
-    Given a PIL image, obtain the visual embedding from the clip_visual model.
+    Given an image, obtain the visual embedding from the clip_visual model.
+    Repeated images are served from the embedding cache without decoding, preprocessing or
+    calling Triton; concurrent calls for the same image share one computation, and different
+    images are micro-batched into a single Triton request when enabled.
     
     Args:
-        image (PIL.Image.Image): The input image.
+        image (PIL.Image.Image | bytes): The input image, or the encoded bytes of an upload
+            (cheapest to hash, and decoding is skipped entirely on a cache hit).
     
     Returns:
         np.ndarray: The visual embedding.
+
+    Raises:
+        ValueError: If the image cannot be decoded or preprocessed.
     """
-    try:
-        # Preprocess image using Hugging Face's CLIPProcessor.
-        image_data = preprocess_image(image)
-    except Exception as e:
-        log_event_sync("ERROR", f"Image preprocessing failed: {e}", extra={"function": "get_clip_visual_embedding"})
-        raise RuntimeError(f"Image preprocessing failed: {e}")
+    cache_key = None
+    if EMBEDDING_CACHE_ENABLED or SINGLE_FLIGHT_ENABLED:
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            cache_key = hash_bytes(image)
+        elif isinstance(image, Image.Image):
+            cache_key = hash_image(image)
+        if EMBEDDING_CACHE_ENABLED and cache_key is not None:
+            cached = VISUAL_EMBEDDING_CACHE.get(cache_key)
+            if cached is not None:
+                return cached
+
+    if SINGLE_FLIGHT_ENABLED and cache_key is not None:
+        return await VISUAL_FLIGHTS.do(cache_key, lambda: _compute_visual_embedding(image, cache_key))
+    return await _compute_visual_embedding(image, cache_key)
+
+@metrics.traced("preprocess.image", profile=True)
+def decode_and_preprocess_image(image) -> np.ndarray:
+    """
+    Decodes an upload (if given as bytes) and preprocesses it with preprocess_image.
+    CPU-bound; called on a worker thread so it does not block the event loop.
 
+    Returns:
+        A numpy array with shape [1, 3, 224, 224] and dtype float16.
+    """
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        image = Image.open(io.BytesIO(image))
+    return preprocess_image(image)
+
+async def _compute_visual_embedding(image, cache_key: str) -> np.ndarray:
     try:
-        # Create Triton client.
-        client = TCLIENT
+        image_data = await asyncio.to_thread(decode_and_preprocess_image, image)
     except Exception as e:
-        log_event_sync("ERROR", f"Failed to create Triton client for image: {e}", extra={"function": "get_clip_visual_embedding"})
-        raise ConnectionError(f"Failed to create Triton client: {e}")
+        log_event_sync("ERROR", f"Image preprocessing failed: {e}", extra={"function": "get_clip_visual_embedding"})
+        # Undecodable or unsupported input: a client error, not a server failure.
+        raise ValueError(f"Image preprocessing failed: {e}")
 
     try:
-        # Prepare input for the clip_visual model.
-        visual_inputs = [
-            httpclient.InferInput("Input_Image", image_data.shape, "FP16")
-        ]
-        visual_inputs[0].set_data_from_numpy(image_data)
-        
-        visual_outputs = [
-            httpclient.InferRequestedOutput("Image_Embeddings")
-        ]
-        
-        # Perform inference asynchronously.
-        visual_result = await asyncio.to_thread(
-            client.infer, model_name="clip_visual", model_version="1", inputs=visual_inputs, outputs=visual_outputs
-        )
-        
-        visual_embedding = visual_result.as_numpy("Image_Embeddings")
+        if USE_MICRO_BATCHING:
+            visual_embedding = await VISUAL_BATCHER.submit(image_data)
+        else:
+            visual_embedding = await _infer_visual(image_data)
     except Exception as e:
         log_event_sync("ERROR", f"Error during image inference: {e}", extra={"function": "get_clip_visual_embedding"})
         raise RuntimeError(f"Error during image inference: {e}")
 
+    if EMBEDDING_CACHE_ENABLED and cache_key is not None:
+        VISUAL_EMBEDDING_CACHE.set(cache_key, visual_embedding)
     return visual_embedding
 
+async def _embed_in_chunks(items: list, preprocess_fn, infer_fn, batch_size: int) -> np.ndarray:
+    """
+    Splits `items` into chunks of `batch_size`, preprocesses each chunk in bulk and runs
+    the chunks through `infer_fn`, keeping at most EMBED_MAX_CONCURRENCY chunks in flight.
+    With `preprocess_fn=None`, `infer_fn` receives the raw chunk and preprocesses it itself.
+
+    Returns:
+        np.ndarray: A contiguous float32 matrix of shape (len(items), D), in input order.
+    """
+    if batch_size < 1:
+        raise ValueError("batch_size must be at least 1.")
+    semaphore = asyncio.Semaphore(EMBED_MAX_CONCURRENCY)
+
+    async def run_chunk(chunk):
+        async with semaphore:
+            # Preprocessing is CPU-bound; keep it off the event loop so it overlaps with inference.
+            if preprocess_fn is None:
+                return await infer_fn(chunk)
+            with metrics.span(preprocess_fn.__name__.replace("_", ".", 1)):
+                data = await asyncio.to_thread(preprocess_fn, chunk)
+            return await infer_fn(data)
+
+    chunks = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+    results = await asyncio.gather(*(run_chunk(chunk) for chunk in chunks))
+
+    embeddings = np.empty((len(items), results[0].shape[-1]), dtype=np.float32)
+    offset = 0
+    for result in results:
+        embeddings[offset:offset + result.shape[0]] = result
+        offset += result.shape[0]
+    return embeddings
+
+async def embed_texts(texts: list, batch_size: int = None) -> np.ndarray:
+    """
+    Embeds a list of text prompts with the clip_text model.
+    Tokenization happens in one tokenizer call per chunk of `batch_size` prompts.
+
+    Args:
+        texts (list[str]): The text inputs.
+        batch_size (int): Maximum number of prompts per Triton call (defaults to EMBED_BATCH_SIZE).
+
+    Returns:
+        np.ndarray: A contiguous float32 matrix of shape (len(texts), D).
+    """
+    if not texts:
+        raise ValueError("embed_texts requires a non-empty list of texts.")
+    try:
+        return await _embed_in_chunks(list(texts), preprocess_texts, _infer_text, batch_size or EMBED_BATCH_SIZE)
+    except Exception as e:
+        log_event_sync("ERROR", f"Error during batch text embedding: {e}", extra={"function": "embed_texts", "count": len(texts)})
+        raise RuntimeError(f"Error during batch text embedding: {e}")
+
+async def embed_images(images: list, batch_size: int = None) -> np.ndarray:
+    """
+    Embeds a list of PIL images with the clip_visual model.
+    Pixel arrays are preprocessed and stacked per chunk of `batch_size` images.
+
+    Args:
+        images (list[PIL.Image.Image]): The image inputs.
+        batch_size (int): Maximum number of images per Triton call (defaults to EMBED_BATCH_SIZE).
+
+    Returns:
+        np.ndarray: A contiguous float32 matrix of shape (len(images), D).
+    """
+    if not images:
+        raise ValueError("embed_images requires a non-empty list of images.")
+    try:
+        if TRITON_TRANSPORT == "shm":
+            return await _embed_in_chunks(list(images), None, _preprocess_and_infer_visual_shm, batch_size or EMBED_BATCH_SIZE)
+        return await _embed_in_chunks(list(images), preprocess_images, _infer_visual, batch_size or EMBED_BATCH_SIZE)
+    except Exception as e:
+        log_event_sync("ERROR", f"Error during batch image embedding: {e}", extra={"function": "embed_images", "count": len(images)})
+        raise RuntimeError(f"Error during batch image embedding: {e}")
+
+async def embed_pixel_values(pixel_values: np.ndarray, batch_size: int = None) -> np.ndarray:
+    """
+    Embeds images that were already preprocessed (see preprocess_images) with the clip_visual model.
+
+    Args:
+        pixel_values (np.ndarray): Pixel values with shape [N, 3, 224, 224] and dtype float16.
+        batch_size (int): Maximum number of images per Triton call (defaults to EMBED_BATCH_SIZE).
+
+    Returns:
+        np.ndarray: A contiguous float32 matrix of shape (N, D).
+    """
+    if len(pixel_values) == 0:
+        raise ValueError("embed_pixel_values requires at least one image.")
+    try:
+        return await _embed_in_chunks(pixel_values, None, _infer_visual, batch_size or EMBED_BATCH_SIZE)
+    except Exception as e:
+        log_event_sync("ERROR", f"Error during batch image embedding: {e}", extra={"function": "embed_pixel_values", "count": len(pixel_values)})
+        raise RuntimeError(f"Error during batch image embedding: {e}")
+
+async def embed_token_ids(token_ids: np.ndarray, batch_size: int = None) -> np.ndarray:
+    """
+    Embeds prompts that were already tokenized (see preprocess_texts) with the clip_text model.
+
+    Args:
+        token_ids (np.ndarray): Token ids with shape [N, 77] and dtype int64.
+        batch_size (int): Maximum number of prompts per Triton call (defaults to EMBED_BATCH_SIZE).
+
+    Returns:
+        np.ndarray: A contiguous float32 matrix of shape (N, D).
+    """
+    if len(token_ids) == 0:
+        raise ValueError("embed_token_ids requires at least one prompt.")
+    try:
+        return await _embed_in_chunks(token_ids, None, _infer_text, batch_size or EMBED_BATCH_SIZE)
+    except Exception as e:
+        log_event_sync("ERROR", f"Error during batch text embedding: {e}", extra={"function": "embed_token_ids", "count": len(token_ids)})
+        raise RuntimeError(f"Error during batch text embedding: {e}")
+
 def preprocess_image(image):
     """
-    Preprocess the PIL image into the required numpy array format using Hugging Face's CLIPProcessor.
+    Preprocess the PIL image into the required numpy array format.
+    Uses the dedicated NumPy engine (utils/image_preprocessing.py) unless USE_FAST_PREPROCESSING
+    is disabled, in which case Hugging Face's CLIPProcessor is used.
     
     Returns:
         A numpy array with shape [1, 3, 224, 224] and dtype float16.
     """
     try:
         # Check if the input is a valid PIL Image.
-        from PIL import Image
         if not isinstance(image, Image.Image):
             raise ValueError("Input is not a valid PIL Image.")
 
+        if USE_FAST_PREPROCESSING:
+            return IMAGE_PREPROCESSOR.preprocess(image)
+
         # Use the processor to preprocess the image.
-        inputs = PROCESSOR(images=image, return_tensors="np")
+        inputs = PROCESSOR.get()(images=image, return_tensors="np")
         if "pixel_values" not in inputs:
             raise ValueError("Processor output missing key 'pixel_values'.")
 
@@ -172,7 +616,7 @@ def preprocess_text(text):
             raise ValueError("Input text must be a non-empty string.")
 
         # Use the tokenizer to tokenize the text.
-        inputs = TOKENIZER(text, return_tensors="np", padding="max_length", max_length=77, truncation=True)
+        inputs = TOKENIZER.get()(text, return_tensors="np", padding="max_length", max_length=77, truncation=True)
         if "input_ids" not in inputs:
             raise ValueError("Tokenizer output missing key 'input_ids'.")
         text_array = inputs["input_ids"].astype(np.int64)
@@ -182,3 +626,57 @@ def preprocess_text(text):
     except Exception as e:
         log_event_sync("ERROR", f"Error in preprocessing text: {e}", extra={"function": "preprocess_text", "text": text})
         raise RuntimeError(f"Error in preprocessing text: {e}")
+
+def preprocess_images(images, out=None):
+    """
+    Preprocess a list of PIL images into one stacked array (decoded and resized on the
+    preprocessor's thread pool when PREPROCESS_WORKERS > 0).
+
+    Args:
+        images (list[PIL.Image.Image]): The image inputs.
+        out (np.ndarray): Optional [N, 3, 224, 224] float16 destination, e.g. a shared-memory view.
+
+    Returns:
+        A numpy array with shape [N, 3, 224, 224] and dtype float16 (`out` if given).
+    """
+    try:
+        if not all(isinstance(image, Image.Image) for image in images):
+            raise ValueError("All inputs must be valid PIL Images.")
+
+        if USE_FAST_PREPROCESSING:
+            return IMAGE_PREPROCESSOR.preprocess_batch(list(images), out=out)
+
+        inputs = PROCESSOR.get()(images=list(images), return_tensors="np")
+        if "pixel_values" not in inputs:
+            raise ValueError("Processor output missing key 'pixel_values'.")
+
+        pixel_values = np.asarray(inputs["pixel_values"], dtype=np.float16)
+        if out is None:
+            return pixel_values
+        np.copyto(out, pixel_values)
+        return out
+
+    except Exception as e:
+        log_event_sync("ERROR", f"Error in preprocessing images: {e}", extra={"function": "preprocess_images", "count": len(images)})
+        raise RuntimeError(f"Error in preprocessing images: {e}")
+
+def preprocess_texts(texts):
+    """
+    Tokenize a list of text prompts in a single CLIPTokenizer call.
+
+    Returns:
+        A numpy array with shape [N, 77] and dtype int64.
+    """
+    try:
+        if not all(isinstance(text, str) and text.strip() for text in texts):
+            raise ValueError("All inputs must be non-empty strings.")
+
+        inputs = TOKENIZER.get()(list(texts), return_tensors="np", padding="max_length", max_length=77, truncation=True)
+        if "input_ids" not in inputs:
+            raise ValueError("Tokenizer output missing key 'input_ids'.")
+
+        return inputs["input_ids"].astype(np.int64)
+
+    except Exception as e:
+        log_event_sync("ERROR", f"Error in preprocessing texts: {e}", extra={"function": "preprocess_texts", "count": len(texts)})
+        raise RuntimeError(f"Error in preprocessing texts: {e}")
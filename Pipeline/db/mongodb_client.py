@@ -1,31 +1,254 @@
+"""
+mongodb_client.py
+-----------------
+Client wrapper for the product metadata collection in MongoDB.
+Product documents are fetched in bulk with a single `$in` query per chunk of ids and kept in a
+read-through in-process cache (utils/cache.py), keyed by product id and projection.
+Catalog writers record each committed change in a versioned change log, which API processes poll
+to invalidate their caches.
+The Motor client is created on first use, so importing this module opens no connection.
+"""
+
+import asyncio
+import datetime
+import os
 import motor.motor_asyncio
+from pymongo import ReturnDocument
+from utils.cache import ResultCache
+from utils.lazy import LoopLocal
+from utils import metrics
 from utils.logger import log_event_sync  # Import the MongoDB logger
 
-MONGO_URI = "mongodb://localhost:27017"
+MONGO_URI = os.environ.get("MONGO_URI", "mongodb://localhost:27017")
 DB_NAME = "product_db"
 COLLECTION_NAME = "product_metadata"
+# Connection pool of the Motor client.
+MONGO_MAX_POOL_SIZE = 100
+MONGO_MAX_IDLE_TIME_MS = 60_000
+MONGO_TIMEOUT_MS = 5_000
+
+def _create_client():
+    return motor.motor_asyncio.AsyncIOMotorClient(
+        MONGO_URI,
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+        serverSelectionTimeoutMS=MONGO_TIMEOUT_MS,
+        socketTimeoutMS=MONGO_TIMEOUT_MS,
+    )
+
+# Motor clients are bound to the event loop they first run on, so there is one per loop,
+# created on first use.
+CLIENT = LoopLocal(_create_client, "mongodb_client")
+
+def get_collection():
+    """
+    Returns the product metadata collection on the running event loop's client.
+    """
+    return CLIENT.get()[DB_NAME][COLLECTION_NAME]
+
+def close_client():
+    """
+    Closes the running event loop's client, if any.
+    """
+    client = CLIENT.pop()
+    if client is not None:
+        client.close()
+
+# Fields needed to display a match; used by default for bulk fetches so full documents
+# (including the long "text" field) are not shipped over the wire.
+PRODUCT_PROJECTION = {
+    "_id": 0, "id": 1, "SKU": 1, "name": 1, "brand": 1, "category": 1, "color": 1,
+    "price": 1, "description": 1, "image_path": 1, "image_url": 1,
+}
+
+# Maximum number of ids per $in query; larger requests are split and fetched concurrently.
+IN_QUERY_BATCH_SIZE = 500
+
+# Read-through cache of hot product documents.
+PRODUCT_CACHE_MAX_ENTRIES = 20_000
+PRODUCT_CACHE_TTL_SECONDS = 600
+product_doc_cache = ResultCache(
+    "product_documents",
+    policy="ttl",
+    max_entries=PRODUCT_CACHE_MAX_ENTRIES,
+    ttl_seconds=PRODUCT_CACHE_TTL_SECONDS,
+)
+
+# Catalog change log: `catalog_state` holds the current catalog version, `catalog_changes` one
+# document per version with the ids of the products it changed (None for a full-catalog change).
+CATALOG_STATE_COLLECTION = "catalog_state"
+CATALOG_CHANGES_COLLECTION = "catalog_changes"
+# Changes listing more ids than this are recorded as full-catalog changes.
+CATALOG_CHANGE_MAX_IDS = 10_000
+# Change documents expire after this long; readers that fall further behind see a gap in the
+# versions and invalidate everything.
+CATALOG_CHANGE_RETENTION_SECONDS = 7 * 24 * 3600
+
+def _projection_key(projection) -> tuple:
+    if projection is None:
+        return ()
+    return tuple(sorted(projection.items()))
+
+async def ensure_indexes():
+    """
+    Creates the index on `id` used by product lookups, and checks that it exists, plus the
+    indexes of the catalog change log. Intended to be called once at startup.
+
+    Raises:
+        RuntimeError: If the index could not be created or is missing afterwards.
+    """
+    try:
+        collection = get_collection()
+        await collection.create_index("id", name="id_1")
+        indexes = await collection.index_information()
+        if not any(info.get("key") == [("id", 1)] for info in indexes.values()):
+            raise RuntimeError(f"Index on 'id' is missing from {DB_NAME}.{COLLECTION_NAME}.")
+        changes = CLIENT.get()[DB_NAME][CATALOG_CHANGES_COLLECTION]
+        await changes.create_index("version", name="version_1", unique=True)
+        await changes.create_index("recorded_at", name="recorded_at_1", expireAfterSeconds=CATALOG_CHANGE_RETENTION_SECONDS)
+    except Exception as e:
+        log_event_sync("ERROR", f"Error in ensure_indexes: {e}", extra={"function": "ensure_indexes"})
+        raise RuntimeError(f"Failed to ensure MongoDB indexes: {e}")
+
+async def _fetch_products(product_ids: list, projection) -> dict:
+    """
+    Fetches documents for `product_ids` with one $in query and returns them keyed by id.
+    """
+    if projection is not None and projection.get("id") != 1 and any(v == 1 for v in projection.values()):
+        # An inclusion projection must keep `id`, otherwise results cannot be matched to ids.
+        projection = {**projection, "id": 1}
+    with metrics.span("mongodb.find"):
+        cursor = get_collection().find({"id": {"$in": product_ids}}, projection)
+        documents = await cursor.to_list(length=None)
+    return {document["id"]: document for document in documents}
+
+@metrics.traced("mongodb.get_products")
+async def get_products(product_ids: list, projection: dict = PRODUCT_PROJECTION) -> list:
+    """
+    Retrieve product metadata for several product ids, preserving the order of `product_ids`
+    (e.g. Qdrant's ranking order). Cached documents are served from memory; the rest are
+    fetched with `$in` queries of at most IN_QUERY_BATCH_SIZE ids, run concurrently.
+
+    Args:
+        product_ids (list[str]): The product identifiers.
+        projection (dict): MongoDB projection applied to the documents (None for full documents).
+
+    Returns:
+        list[dict | None]: One document per id, or None where the product was not found.
+    """
+    projection_key = _projection_key(projection)
+    documents = {}
+    missing = []
+    for product_id in dict.fromkeys(product_ids):
+        cached = product_doc_cache.get((product_id, projection_key))
+        if cached is not None:
+            documents[product_id] = cached
+        else:
+            missing.append(product_id)
+
+    if missing:
+        try:
+            chunks = [missing[i:i + IN_QUERY_BATCH_SIZE] for i in range(0, len(missing), IN_QUERY_BATCH_SIZE)]
+            for fetched in await asyncio.gather(*(_fetch_products(chunk, projection) for chunk in chunks)):
+                for product_id, document in fetched.items():
+                    product_doc_cache.set((product_id, projection_key), document, tags=(product_id,))
+                    documents[product_id] = document
+        except Exception as e:
+            log_event_sync("ERROR", f"Error in get_products: {e}", extra={"function": "get_products", "product_ids": missing})
+            raise
+
+        not_found = [product_id for product_id in missing if product_id not in documents]
+        if not_found:
+            log_event_sync("ERROR", f"Products not found: {not_found}", extra={"function": "get_products", "product_ids": not_found})
+
+    # Hand out copies so callers cannot mutate cached documents.
+    return [dict(documents[product_id]) if product_id in documents else None for product_id in product_ids]
+
+def _collect_metrics():
+    yield from metrics.snapshot_samples(
+        "product_doc_cache", product_doc_cache.snapshot(), {},
+        counters=("hits", "misses", "evictions", "expirations", "invalidations"), gauges=("hit_ratio", "entries"),
+    )
+
+metrics.register_collector(_collect_metrics)
+
+def invalidate_products(product_ids=None) -> int:
+    """
+    Drops cached documents for the given product ids (or all of them if None).
+    """
+    if product_ids is None:
+        return product_doc_cache.clear()
+    return sum(product_doc_cache.invalidate_tag(product_id) for product_id in product_ids)
+
+async def record_catalog_change(product_ids=None) -> int:
+    """
+    Records a committed catalog change under a new catalog version.
+    Call it after the change is written to Qdrant and MongoDB, so readers that see the version
+    also see the new data.
+
+    Args:
+        product_ids (iterable): Ids of the products that changed. If None, the whole catalog changed.
+
+    Returns:
+        int: The new catalog version.
+    """
+    try:
+        database = CLIENT.get()[DB_NAME]
+        state = await database[CATALOG_STATE_COLLECTION].find_one_and_update(
+            {"_id": "catalog"}, {"$inc": {"version": 1}}, upsert=True, return_document=ReturnDocument.AFTER,
+        )
+        if product_ids is not None:
+            product_ids = list(dict.fromkeys(product_ids))
+            if len(product_ids) > CATALOG_CHANGE_MAX_IDS:
+                product_ids = None
+        await database[CATALOG_CHANGES_COLLECTION].insert_one({
+            "version": state["version"],
+            "product_ids": product_ids,
+            "recorded_at": datetime.datetime.now(datetime.timezone.utc),
+        })
+        return state["version"]
+    except Exception as e:
+        log_event_sync("ERROR", f"Error in record_catalog_change: {e}", extra={"function": "record_catalog_change"})
+        raise
 
-client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_URI)
-db = client[DB_NAME]
-collection = db[COLLECTION_NAME]
+async def get_catalog_version() -> int:
+    """
+    Returns the current catalog version (0 if no change was ever recorded).
+    """
+    state = await CLIENT.get()[DB_NAME][CATALOG_STATE_COLLECTION].find_one({"_id": "catalog"})
+    return state["version"] if state else 0
 
-async def get_product(product_id: str):
+async def get_catalog_changes(since_version: int) -> list:
+    """
+    Returns the recorded catalog changes newer than `since_version`, oldest first.
+
+    Returns:
+        list[dict]: Documents with "version" and "product_ids" (None for a full-catalog change).
+    """
+    cursor = CLIENT.get()[DB_NAME][CATALOG_CHANGES_COLLECTION].find(
+        {"version": {"$gt": since_version}}, {"_id": 0, "version": 1, "product_ids": 1},
+    ).sort("version", 1)
+    return await cursor.to_list(length=None)
+
+async def get_product(product_id: str, projection: dict = None):
     """
     Retrieve product metadata by product id.
+    Served from the read-through document cache when possible.
     Logs errors to MongoDB if not found or if any exception occurs.
-    
+
     Args:
         product_id (str): The unique identifier for the product.
-    
+        projection (dict): Optional MongoDB projection (None returns the full document).
+
     Returns:
         dict: The product metadata document.
-        
+
     Raises:
         ValueError: If the product is not found.
         Exception: Propagates any other errors after logging.
     """
     try:
-        product = await collection.find_one({"id": product_id})
+        product = (await get_products([product_id], projection=projection))[0]
         if product:
             # Optionally, log the successful retrieval.
             # log_event_sync("INFO", f"Product {product_id} retrieved successfully.", extra={"product_id": product_id})
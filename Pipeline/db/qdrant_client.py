@@ -3,67 +3,217 @@ qdrant_client.py
 ----------------
 Client wrapper to interact with Qdrant vector database, supporting multiple collections.
 This version uses the official QdrantClient to perform a search.
+Searches return ranked top-k hits with scores, support a minimum-score cutoff, and push
+payload filters (e.g. brand, category, price range) down into Qdrant.
+Online searches go through AsyncQdrantClient with a pooled keep-alive HTTP connection set;
+the synchronous client (get_client()) is kept for offline tools (ingestion, snapshot export).
+Both are created on first use, so importing this module opens no connection.
+Quantized collections are searched over their compact codes, then rescored with the originals.
 """
 
-import asyncio
-import requests
+import os
+import httpx
 import numpy as np
+from utils.lazy import Lazy, LoopLocal
+from utils import metrics
 from utils.logger import log_event_sync
-from qdrant_client import QdrantClient
+from qdrant_client import AsyncQdrantClient, QdrantClient
+from qdrant_client.http import models
 
-# Create a global QdrantClient instance.
-CLIENT = QdrantClient(host="localhost", port=6333)
+# Qdrant endpoint, e.g. "http://qdrant:6333".
+QDRANT_URL = os.environ.get("QDRANT_URL", "http://localhost:6333")
+QDRANT_TIMEOUT = 10  # seconds
+# Connection pool of the async client: at most QDRANT_POOL_SIZE open connections, of which
+# QDRANT_KEEPALIVE_CONNECTIONS are kept idle for up to QDRANT_KEEPALIVE_EXPIRY seconds.
+QDRANT_POOL_SIZE = 64
+QDRANT_KEEPALIVE_CONNECTIONS = 32
+QDRANT_KEEPALIVE_EXPIRY = 30.0
+# Quantized collections (ingest_catalog.py --quantization): the first pass over the compact codes
+# keeps limit * QDRANT_OVERSAMPLING candidates, rescored with the original vectors when
+# QDRANT_RESCORE is set. Ignored for collections without quantization.
+QDRANT_RESCORE = True
+QDRANT_OVERSAMPLING = 2.0
 
-async def search_embedding(embedding: np.ndarray, collection: str, top_k: int = 5):
+def _create_client() -> QdrantClient:
+    return QdrantClient(url=QDRANT_URL, timeout=QDRANT_TIMEOUT)
+
+def _create_async_client() -> AsyncQdrantClient:
+    return AsyncQdrantClient(
+        url=QDRANT_URL,
+        timeout=QDRANT_TIMEOUT,
+        limits=httpx.Limits(
+            max_connections=QDRANT_POOL_SIZE,
+            max_keepalive_connections=QDRANT_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=QDRANT_KEEPALIVE_EXPIRY,
+        ),
+    )
+
+# Global clients, created on first use. The async client's connections belong to one event
+# loop, so there is one per loop.
+CLIENT = Lazy(_create_client, "qdrant_client")
+ASYNC_CLIENT = LoopLocal(_create_async_client, "qdrant_async_client")
+
+def get_client() -> QdrantClient:
     """
-    Searches Qdrant for the closest matching embedding in the specified collection.
-    
+    Returns the synchronous QdrantClient used by offline tools, creating it on first use.
+    """
+    return CLIENT.get()
+
+def get_async_client() -> AsyncQdrantClient:
+    """
+    Returns the AsyncQdrantClient for the running event loop, creating it on first use.
+    """
+    return ASYNC_CLIENT.get()
+
+async def close_async_client():
+    """
+    Closes the running loop's async client, if any.
+    """
+    client = ASYNC_CLIENT.pop()
+    if client is not None:
+        await client.close()
+
+def build_filter(filters: dict):
+    """
+    Translates a simple filter spec into a Qdrant payload filter. All conditions must match.
+
+    Supported values per payload field:
+      - a scalar (str / int / bool): exact match, e.g. {"brand": "Sony"}
+      - a list / tuple / set: match any of the values, e.g. {"category": ["A", "B"]}
+      - a dict with any of gt / gte / lt / lte: numeric range, e.g. {"price": {"gte": 50, "lte": 200}}
+
+    Args:
+        filters (dict): Payload field -> condition. None or empty means no filter.
+
+    Returns:
+        models.Filter | None: The Qdrant filter.
+    """
+    if not filters:
+        return None
+    conditions = []
+    for field, condition in filters.items():
+        if isinstance(condition, dict):
+            unknown = set(condition) - {"gt", "gte", "lt", "lte"}
+            if unknown:
+                raise ValueError(f"Unsupported range keys for '{field}': {sorted(unknown)}")
+            conditions.append(models.FieldCondition(key=field, range=models.Range(**condition)))
+        elif isinstance(condition, (list, tuple, set)):
+            conditions.append(models.FieldCondition(key=field, match=models.MatchAny(any=list(condition))))
+        else:
+            conditions.append(models.FieldCondition(key=field, match=models.MatchValue(value=condition)))
+    return models.Filter(must=conditions)
+
+def _search_params() -> models.SearchParams:
+    return models.SearchParams(
+        quantization=models.QuantizationSearchParams(rescore=QDRANT_RESCORE, oversampling=QDRANT_OVERSAMPLING)
+    )
+
+async def search_top_k(embedding: np.ndarray, collection: str, top_k: int = 5,
+                       min_score: float = None, filters: dict = None) -> list:
+    """
+    Searches Qdrant for the `top_k` closest embeddings in the specified collection.
+
     Args:
         embedding (np.ndarray): The embedding vector to search for.
-        collection (str): The name of the Qdrant collection (e.g., "product_image" or "product_text").
+        collection (str): The name of the Qdrant collection (e.g., "products_visual" or "products_text").
         top_k (int): The number of top results to return.
-        
+        min_score (float): Hits scoring below this are dropped by Qdrant (None for no cutoff).
+        filters (dict): Payload filters, see build_filter().
+
     Returns:
-        product_id: Identifier of the top matched product from the specified collection.
-        
-    Raises:
-        ValueError: If no matching product is found.
+        list[tuple[float, str]]: (score, product_id) pairs, best first. May be empty.
     """
+    query_vector = None
     try:
-        query_vector = embedding.tolist()[0]
+        query_vector = np.asarray(embedding).reshape(-1).tolist()
+        query_filter = build_filter(filters)
 
-        # Since QdrantClient is synchronous, wrap the search call in asyncio.to_thread.
-        def do_search():
-            return CLIENT.search(
+        with metrics.span("qdrant.search"):
+            response = await get_async_client().query_points(
                 collection_name=collection,
-                query_vector=query_vector,
-                limit=top_k
-            )
-        hits = await asyncio.to_thread(do_search)
-
-        if hits and len(hits) > 0:
-            # Assuming each hit is an object with an 'id' attribute.
-            product_id = hits[0].payload["id"]
-            match_score =hits[0].score
-            log_event_sync(
-                "INFO",
-                f"Successfully retrieved product from collection '{collection}'.",
-                extra={"collection": collection, "product_id": product_id}
-            )
-            return match_score, product_id
-        else:
-            msg = f"No matching product found in collection '{collection}'."
-            log_event_sync(
-                "ERROR",
-                msg,
-                extra={"collection": collection, "query_vector": query_vector}
+                query=query_vector,
+                query_filter=query_filter,
+                score_threshold=min_score,
+                limit=top_k,
+                with_payload=["id"],
+                search_params=_search_params(),
             )
-            raise ValueError(msg)
-            
+
+        return [(hit.score, hit.payload["id"]) for hit in response.points]
+
     except Exception as e:
         log_event_sync(
             "ERROR",
             f"Error during Qdrant search in collection '{collection}': {e}",
-            extra={"collection": collection, "query_vector": query_vector}
+            extra={"collection": collection, "filters": filters}
         )
         raise e
+
+async def search_top_k_batch(embeddings: np.ndarray, collection: str, top_k: int = 5,
+                             min_score: float = None, filters: dict = None) -> list:
+    """
+    Runs one top-k search per row of `embeddings` in a single Qdrant request (query_batch_points).
+
+    Args:
+        embeddings (np.ndarray): Query embeddings with shape [N, D].
+        collection (str): The name of the Qdrant collection.
+        top_k (int): The number of top results per query.
+        min_score (float): Hits scoring below this are dropped by Qdrant (None for no cutoff).
+        filters (dict): Payload filters applied to every query, see build_filter().
+
+    Returns:
+        list[list[tuple[float, str]]]: Ranked (score, product_id) pairs per query, in input order.
+    """
+    try:
+        query_filter = build_filter(filters)
+        params = _search_params()
+        requests = [
+            models.QueryRequest(query=row.tolist(), filter=query_filter, params=params, limit=top_k,
+                                score_threshold=min_score, with_payload=["id"])
+            for row in np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1)
+        ]
+        with metrics.span("qdrant.search_batch"):
+            responses = await get_async_client().query_batch_points(collection_name=collection, requests=requests)
+        return [[(hit.score, hit.payload["id"]) for hit in response.points] for response in responses]
+
+    except Exception as e:
+        log_event_sync(
+            "ERROR",
+            f"Error during batched Qdrant search in collection '{collection}': {e}",
+            extra={"collection": collection, "filters": filters, "count": len(embeddings)}
+        )
+        raise e
+
+async def search_embedding(embedding: np.ndarray, collection: str, top_k: int = 5):
+    """
+    Searches Qdrant for the closest matching embedding in the specified collection.
+
+    Args:
+        embedding (np.ndarray): The embedding vector to search for.
+        collection (str): The name of the Qdrant collection (e.g., "product_image" or "product_text").
+        top_k (int): The number of top results to return.
+
+    Returns:
+        tuple: (match_score, product_id) of the top matched product from the specified collection.
+
+    Raises:
+        ValueError: If no matching product is found.
+    """
+    hits = await search_top_k(embedding, collection, top_k=top_k)
+
+    if hits:
+        match_score, product_id = hits[0]
+        log_event_sync(
+            "INFO",
+            f"Successfully retrieved product from collection '{collection}'.",
+            extra={"collection": collection, "product_id": product_id}
+        )
+        return match_score, product_id
+    else:
+        msg = f"No matching product found in collection '{collection}'."
+        log_event_sync(
+            "ERROR",
+            msg,
+            extra={"collection": collection}
+        )
+        raise ValueError(msg)
@@ -0,0 +1,420 @@
+"""
+search_backend.py
+-----------------
+Pluggable vector-search backends used by product matching.
+
+  - "qdrant":   the Qdrant server (db/qdrant_client.py).
+  - "embedded": an in-process index over a snapshot exported from Qdrant. Normalized embeddings
+                live in a memory-mapped float16/float32 matrix; search is a brute-force
+                matrix-vector product with `argpartition` top-k (exact), an IVF index that
+                only scores the `nprobe` closest clusters (approximate, for larger catalogs), or
+                a compressed first pass (int8 / binary codes, optionally PCA-reduced; see
+                utils/compression.py) whose best candidates are rescored with the full vectors.
+
+Both backends return the same (score, product_id) ranking for cosine collections, support the
+same min_score cutoff and the filter spec of qdrant_client.build_filter().
+
+Select with SEARCH_BACKEND. Export a snapshot (from the Pipeline directory) with:
+    python -m db.search_backend --out snapshots --collections products_visual products_text
+and add --compress int8 [--reduction pca --dim 128] for EMBEDDED_MODE = "compressed".
+"""
+
+import abc
+import argparse
+import asyncio
+import json
+import os
+import threading
+import numpy as np
+from db import qdrant_client
+from utils.compression import EmbeddingCompressor
+from utils.logger import log_event_sync
+from utils import metrics
+
+SEARCH_BACKEND = "qdrant"  # "qdrant" or "embedded"
+EMBEDDED_SNAPSHOT_DIR = "snapshots"
+EMBEDDED_MODE = "exact"  # "exact", "ivf" or "compressed"
+EMBEDDED_IVF_NPROBE = 8
+# Compressed mode: the first pass keeps top_k * EMBEDDED_RESCORE_MULTIPLIER candidates, which
+# are then rescored with the full vectors.
+EMBEDDED_RESCORE_MULTIPLIER = 10
+# Rows scored per block when upcasting a float16 matrix.
+EMBEDDED_BLOCK_ROWS = 65_536
+
+
+class SearchBackend(abc.ABC):
+    """
+    Interface for vector-search backends. Subclasses implement `search`; `search_batch` falls
+    back to concurrent single searches unless overridden.
+    """
+
+    name = "base"
+
+    @abc.abstractmethod
+    async def search(self, embedding: np.ndarray, collection: str, top_k: int = 5,
+                     min_score: float = None, filters: dict = None) -> list:
+        """
+        Returns up to `top_k` (score, product_id) pairs, best first.
+        """
+
+    async def search_batch(self, embeddings: np.ndarray, collection: str, top_k: int = 5,
+                           min_score: float = None, filters: dict = None) -> list:
+        """
+        Returns one ranked (score, product_id) list per row of `embeddings`, in input order.
+        """
+        return list(await asyncio.gather(*(self.search(e, collection, top_k, min_score, filters) for e in embeddings)))
+
+
+class QdrantBackend(SearchBackend):
+    """
+    Searches the Qdrant server.
+    """
+
+    name = "qdrant"
+
+    async def search(self, embedding, collection, top_k=5, min_score=None, filters=None):
+        return await qdrant_client.search_top_k(embedding, collection, top_k=top_k, min_score=min_score, filters=filters)
+
+    async def search_batch(self, embeddings, collection, top_k=5, min_score=None, filters=None):
+        return await qdrant_client.search_top_k_batch(embeddings, collection, top_k=top_k, min_score=min_score, filters=filters)
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def top_k_indices(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """
+    Indices of the `top_k` highest scores, best first, using argpartition (O(n)) before sorting k.
+    """
+    if top_k >= scores.shape[0]:
+        return np.argsort(-scores, kind="stable")
+    candidates = np.argpartition(-scores, top_k - 1)[:top_k]
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+class EmbeddedCollection:
+    """
+    One collection of an exported snapshot: vectors.npy (normalized rows), payloads.json
+    (one payload per row), for IVF mode ivf.npz (centroids and row assignments) and, for
+    compressed mode, compressed.npz (compressor parameters and codes).
+    """
+
+    def __init__(self, directory: str, mode: str = "exact", nprobe: int = EMBEDDED_IVF_NPROBE,
+                 rescore_multiplier: int = EMBEDDED_RESCORE_MULTIPLIER):
+        self.directory = directory
+        self.mode = mode
+        self.nprobe = nprobe
+        self.rescore_multiplier = rescore_multiplier
+        self.vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r")
+        with open(os.path.join(directory, "payloads.json"), "r", encoding="utf-8") as f:
+            self.payloads = json.load(f)
+        if len(self.payloads) != self.vectors.shape[0]:
+            raise ValueError(f"Snapshot {directory} has {self.vectors.shape[0]} vectors but {len(self.payloads)} payloads.")
+        self.ids = [payload["id"] for payload in self.payloads]
+        self._columns = {}
+
+        self.centroids = None
+        self.lists = None
+        if mode == "ivf":
+            ivf_path = os.path.join(directory, "ivf.npz")
+            if not os.path.exists(ivf_path):
+                raise FileNotFoundError(f"IVF mode needs {ivf_path}; build it with build_ivf().")
+            ivf = np.load(ivf_path)
+            self.centroids = ivf["centroids"]
+            assignments = ivf["assignments"]
+            order = np.argsort(assignments, kind="stable")
+            bounds = np.searchsorted(assignments[order], np.arange(self.centroids.shape[0] + 1))
+            self.lists = [order[bounds[i]:bounds[i + 1]] for i in range(self.centroids.shape[0])]
+
+        self.compressor = None
+        self.codes = None
+        if mode == "compressed":
+            compressed_path = os.path.join(directory, "compressed.npz")
+            if not os.path.exists(compressed_path):
+                raise FileNotFoundError(f"Compressed mode needs {compressed_path}; build it with build_compressed().")
+            self.compressor, self.codes = EmbeddingCompressor.load(compressed_path)
+            if self.codes.shape[0] != self.vectors.shape[0]:
+                raise ValueError(f"{compressed_path} has {self.codes.shape[0]} codes but the snapshot has {self.vectors.shape[0]} vectors.")
+
+    def __len__(self) -> int:
+        return self.vectors.shape[0]
+
+    def _column(self, field: str, numeric: bool) -> np.ndarray:
+        key = (field, numeric)
+        if key not in self._columns:
+            values = [payload.get(field) for payload in self.payloads]
+            if numeric:
+                self._columns[key] = np.array([np.nan if v is None else float(v) for v in values], dtype=np.float64)
+            else:
+                column = np.empty(len(values), dtype=object)
+                column[:] = values
+                self._columns[key] = column
+        return self._columns[key]
+
+    def filter_mask(self, filters: dict, rows: np.ndarray = None) -> np.ndarray:
+        """
+        Evaluates a qdrant_client.build_filter() spec against the payloads (all conditions must match).
+        """
+        mask = None
+        for field, condition in filters.items():
+            if isinstance(condition, dict):
+                column = self._column(field, numeric=True)
+                column = column if rows is None else column[rows]
+                current = ~np.isnan(column)
+                for op, bound in condition.items():
+                    if op == "gt":
+                        current &= column > bound
+                    elif op == "gte":
+                        current &= column >= bound
+                    elif op == "lt":
+                        current &= column < bound
+                    elif op == "lte":
+                        current &= column <= bound
+                    else:
+                        raise ValueError(f"Unsupported range key '{op}' for '{field}'.")
+            else:
+                column = self._column(field, numeric=False)
+                column = column if rows is None else column[rows]
+                allowed = list(condition) if isinstance(condition, (list, tuple, set)) else [condition]
+                current = np.array([value in allowed for value in column], dtype=bool)
+            mask = current if mask is None else mask & current
+        return mask
+
+    def _score(self, query: np.ndarray, rows: np.ndarray = None) -> np.ndarray:
+        matrix = self.vectors if rows is None else self.vectors[rows]
+        if matrix.dtype == np.float32:
+            return matrix @ query
+        scores = np.empty(matrix.shape[0], dtype=np.float32)
+        for start in range(0, matrix.shape[0], EMBEDDED_BLOCK_ROWS):
+            block = matrix[start:start + EMBEDDED_BLOCK_ROWS].astype(np.float32)
+            scores[start:start + block.shape[0]] = block @ query
+        return scores
+
+    def search(self, embedding: np.ndarray, top_k: int, min_score: float = None, filters: dict = None) -> list:
+        query = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(query)
+        if norm == 0:
+            raise ValueError("Cannot search with a zero embedding.")
+        query = query / norm
+
+        rows = None
+        if self.mode == "ivf":
+            nearest = top_k_indices(self.centroids @ query, min(self.nprobe, self.centroids.shape[0]))
+            rows = np.concatenate([self.lists[c] for c in nearest])
+            if rows.size == 0:
+                return []
+        elif self.mode == "compressed":
+            # First pass over the compact codes; only the candidates' full vectors are read.
+            approximate = self.compressor.score(query, self.codes)
+            if filters:
+                approximate[~self.filter_mask(filters)] = -np.inf
+            rows = top_k_indices(approximate, top_k * self.rescore_multiplier)
+            rows = np.sort(rows[np.isfinite(approximate[rows])])
+            if rows.size == 0:
+                return []
+            filters = None
+        scores = self._score(query, rows)
+        if filters:
+            scores[~self.filter_mask(filters, rows)] = -np.inf
+        best = top_k_indices(scores, top_k)
+        best = best[np.isfinite(scores[best])]
+        if min_score is not None:
+            best = best[scores[best] >= min_score]
+        row_ids = best if rows is None else rows[best]
+        return [(float(scores[i]), self.ids[r]) for i, r in zip(best, row_ids)]
+
+
+class EmbeddedBackend(SearchBackend):
+    """
+    In-process search over snapshots stored in `snapshot_dir/<collection>/`.
+    """
+
+    name = "embedded"
+
+    def __init__(self, snapshot_dir: str = EMBEDDED_SNAPSHOT_DIR, mode: str = EMBEDDED_MODE, nprobe: int = EMBEDDED_IVF_NPROBE,
+                 rescore_multiplier: int = EMBEDDED_RESCORE_MULTIPLIER):
+        if mode not in ("exact", "ivf", "compressed"):
+            raise ValueError(f"Unknown embedded search mode '{mode}'.")
+        self.snapshot_dir = snapshot_dir
+        self.mode = mode
+        self.nprobe = nprobe
+        self.rescore_multiplier = rescore_multiplier
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def collection(self, name: str) -> EmbeddedCollection:
+        if name not in self._collections:
+            with self._lock:
+                if name not in self._collections:
+                    self._collections[name] = EmbeddedCollection(
+                        os.path.join(self.snapshot_dir, name), self.mode, self.nprobe, self.rescore_multiplier
+                    )
+        return self._collections[name]
+
+    @metrics.traced("embedded.search", profile=True)
+    def _search(self, embedding, collection, top_k, min_score, filters):
+        return self.collection(collection).search(embedding, top_k, min_score, filters)
+
+    async def search(self, embedding, collection, top_k=5, min_score=None, filters=None):
+        try:
+            # Scoring (and loading the snapshot on first use) is CPU-bound; it runs on a worker
+            # thread so the event loop keeps serving other requests.
+            return await asyncio.to_thread(self._search, embedding, collection, top_k, min_score, filters)
+        except Exception as e:
+            log_event_sync("ERROR", f"Error during embedded search in collection '{collection}': {e}", extra={"collection": collection, "filters": filters})
+            raise
+
+    @metrics.traced("embedded.search_batch")
+    async def search_batch(self, embeddings, collection, top_k=5, min_score=None, filters=None):
+        try:
+            # One worker-thread hop for the whole batch instead of one per query.
+            return await asyncio.to_thread(lambda: [self.collection(collection).search(e, top_k, min_score, filters) for e in embeddings])
+        except Exception as e:
+            log_event_sync("ERROR", f"Error during embedded batch search in collection '{collection}': {e}", extra={"collection": collection, "filters": filters})
+            raise
+
+
+def export_qdrant_snapshot(collection: str, out_dir: str, dtype: str = "float32", page_size: int = 1024) -> int:
+    """
+    Exports all points of a Qdrant collection into an embedded-backend snapshot.
+
+    Returns:
+        int: The number of exported points.
+    """
+    vectors, payloads = [], []
+    offset = None
+    while True:
+        points, offset = qdrant_client.get_client().scroll(
+            collection_name=collection, limit=page_size, offset=offset, with_payload=True, with_vectors=True
+        )
+        for point in points:
+            vectors.append(point.vector)
+            payloads.append(point.payload)
+        if offset is None:
+            break
+
+    directory = os.path.join(out_dir, collection)
+    os.makedirs(directory, exist_ok=True)
+    matrix = _normalize_rows(np.asarray(vectors, dtype=np.float32)).astype(dtype)
+    np.save(os.path.join(directory, "vectors.npy"), matrix)
+    with open(os.path.join(directory, "payloads.json"), "w", encoding="utf-8") as f:
+        json.dump(payloads, f)
+    return len(payloads)
+
+
+def build_ivf(directory: str, nlist: int = None, iterations: int = 20, sample_size: int = 100_000, seed: int = 0):
+    """
+    Trains a k-means coarse quantizer on a snapshot and writes ivf.npz next to it.
+
+    Args:
+        directory (str): Snapshot directory of one collection.
+        nlist (int): Number of clusters (defaults to about sqrt(N)).
+    """
+    vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r")
+    n = vectors.shape[0]
+    nlist = nlist or max(1, int(np.sqrt(n)))
+    rng = np.random.default_rng(seed)
+    sample = np.asarray(vectors[np.sort(rng.choice(n, size=min(n, sample_size), replace=False))], dtype=np.float32)
+
+    # Spherical k-means: vectors and centroids are unit length, so assignment is by dot product.
+    centroids = sample[rng.choice(sample.shape[0], size=nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        for c in range(nlist):
+            members = sample[assignment == c]
+            if members.shape[0]:
+                centroids[c] = members.sum(axis=0)
+        centroids = _normalize_rows(centroids)
+
+    assignments = np.empty(n, dtype=np.int32)
+    for start in range(0, n, EMBEDDED_BLOCK_ROWS):
+        block = np.asarray(vectors[start:start + EMBEDDED_BLOCK_ROWS], dtype=np.float32)
+        assignments[start:start + block.shape[0]] = np.argmax(block @ centroids.T, axis=1)
+    np.savez(os.path.join(directory, "ivf.npz"), centroids=centroids, assignments=assignments)
+
+
+def build_compressed(directory: str, quantization: str = "int8", reduction: str = None, dim: int = None,
+                     sample_size: int = 100_000, seed: int = 0) -> EmbeddingCompressor:
+    """
+    Fits an EmbeddingCompressor on a snapshot and writes compressed.npz (parameters and codes) next to it.
+
+    Args:
+        directory (str): Snapshot directory of one collection.
+        quantization (str): "int8", "binary" or None (float32 codes, e.g. PCA only).
+        reduction (str): None, "pca" or "truncate".
+        dim (int): Target dimension of the reduction.
+    """
+    vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r")
+    compressor = EmbeddingCompressor(dim=dim, reduction=reduction, quantization=quantization)
+    compressor.fit(vectors, sample_size=sample_size, seed=seed)
+    compressor.save(os.path.join(directory, "compressed.npz"), compressor.encode(vectors))
+    return compressor
+
+
+def validate_filters(filters: dict):
+    """
+    Checks a filter spec (see qdrant_client.build_filter) before any search runs, so an invalid
+    one is reported as the caller's error, whatever the backend.
+
+    Raises:
+        ValueError: If the spec is not supported.
+    """
+    if filters is None:
+        return
+    if not isinstance(filters, dict):
+        raise ValueError("filters must be a dict of payload field -> condition.")
+    qdrant_client.build_filter(filters)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend() -> SearchBackend:
+    """
+    Returns the process-wide backend selected by SEARCH_BACKEND.
+    """
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if SEARCH_BACKEND == "qdrant":
+                    _backend = QdrantBackend()
+                elif SEARCH_BACKEND == "embedded":
+                    _backend = EmbeddedBackend()
+                else:
+                    raise ValueError(f"Unknown SEARCH_BACKEND '{SEARCH_BACKEND}'.")
+    return _backend
+
+
+def set_backend(backend: SearchBackend):
+    """
+    Replaces the process-wide backend (e.g. with a local stand-in in benchmarks).
+    """
+    global _backend
+    _backend = backend
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export Qdrant collections as embedded-backend snapshots.")
+    parser.add_argument("--out", default=EMBEDDED_SNAPSHOT_DIR, help="Snapshot directory.")
+    parser.add_argument("--collections", nargs="+", default=["products_visual", "products_text"])
+    parser.add_argument("--dtype", choices=["float32", "float16"], default="float32")
+    parser.add_argument("--ivf", action="store_true", help="Also build an IVF index for each collection.")
+    parser.add_argument("--nlist", type=int, default=None, help="IVF clusters (defaults to sqrt(N)).")
+    parser.add_argument("--compress", choices=["int8", "binary", "none"], default=None,
+                        help="Also build compressed first-pass codes with this quantization.")
+    parser.add_argument("--reduction", choices=["pca", "truncate"], default=None, help="Dimensionality reduction of the codes.")
+    parser.add_argument("--dim", type=int, default=None, help="Target dimension for --reduction.")
+    args = parser.parse_args()
+    for name in args.collections:
+        count = export_qdrant_snapshot(name, args.out, dtype=args.dtype)
+        if args.ivf:
+            build_ivf(os.path.join(args.out, name), nlist=args.nlist)
+        if args.compress:
+            quantization = None if args.compress == "none" else args.compress
+            build_compressed(os.path.join(args.out, name), quantization=quantization, reduction=args.reduction, dim=args.dim)
+        print(f"Exported {count} points from '{name}' to {os.path.join(args.out, name)}")
@@ -0,0 +1,161 @@
+"""
+dedup_catalog.py
+----------------
+Finds near-duplicate products in the catalog (the same item listed several times, colour or
+listing variants such as ...-BLACK and ...-BLACK-V1) from the stored `products_visual` /
+`products_text` vectors, and writes the duplicate clusters to a JSON report.
+
+Pipeline:
+  1. Load each collection from an embedded-backend snapshot (exported from Qdrant first when the
+     snapshot directory does not have it yet).
+  2. Find all product pairs with cosine similarity >= --threshold:
+       - "exact": blocked matrix multiplication over the memory-mapped vectors (utils/dedup.py),
+         never materializing the N x N similarity matrix;
+       - "ann": one batched top --neighbors search per chunk of products against the configured
+         search backend (Qdrant, or the embedded IVF / compressed index), for large catalogs.
+  3. Combine the collections: with --require all a pair must be similar in every collection,
+     with --require any in at least one.
+  4. Group pairs into clusters (union-find) and pick as canonical product the member closest to
+     the cluster centroid.
+
+With DEDUP_COLLAPSE_VARIANTS in product_matching.py the report is used at query time: each cluster
+is returned once, as its best-ranked member.
+
+Usage (from the Pipeline directory):
+    python dedup_catalog.py --threshold 0.95 --output dedup_clusters.json
+    python dedup_catalog.py --method ann --collections products_visual --require any
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+import numpy as np
+from db import search_backend
+from ingest_catalog import TEXT_COLLECTION, VISUAL_COLLECTION
+from utils.dedup import DEDUP_BLOCK_ROWS, choose_canonical, clusters_from_pairs, similar_pairs
+from utils.logger import log_event_sync
+
+DEFAULT_THRESHOLD = 0.95
+DEFAULT_OUTPUT = "dedup_clusters.json"
+
+
+def load_snapshot(snapshot_dir: str, collection: str, export: bool) -> tuple:
+    """
+    Returns (memory-mapped vectors, product ids) of one collection, exporting it from Qdrant
+    when it is missing (or when `export` is set).
+    """
+    directory = os.path.join(snapshot_dir, collection)
+    if export or not os.path.exists(os.path.join(directory, "vectors.npy")):
+        count = search_backend.export_qdrant_snapshot(collection, snapshot_dir)
+        print(f"Exported {count} points from '{collection}' to {directory}")
+    vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r")
+    with open(os.path.join(directory, "payloads.json"), "r", encoding="utf-8") as f:
+        ids = [payload["id"] for payload in json.load(f)]
+    if len(ids) != vectors.shape[0]:
+        raise ValueError(f"Snapshot {directory} has {vectors.shape[0]} vectors but {len(ids)} payloads.")
+    return vectors, ids
+
+
+def _pair(a: str, b: str) -> tuple:
+    return (a, b) if a < b else (b, a)
+
+
+def exact_pairs(vectors: np.ndarray, ids: list, threshold: float, block_rows: int) -> dict:
+    """
+    Returns {(id_a, id_b): similarity} for all pairs above `threshold` (blocked matrix products).
+    """
+    pairs = {}
+    for rows, cols, scores in similar_pairs(vectors, threshold, block_rows=block_rows):
+        for i, j, score in zip(rows.tolist(), cols.tolist(), scores.tolist()):
+            pairs[_pair(ids[i], ids[j])] = score
+    return pairs
+
+
+async def ann_pairs(vectors: np.ndarray, ids: list, collection: str, threshold: float, neighbors: int, batch_size: int) -> dict:
+    """
+    Returns {(id_a, id_b): similarity} from top-`neighbors` searches of every product against
+    the search backend. Pairs beyond a product's `neighbors` nearest are missed.
+    """
+    backend = search_backend.get_backend()
+    pairs = {}
+    for start in range(0, len(ids), batch_size):
+        batch = np.asarray(vectors[start:start + batch_size], dtype=np.float32)
+        # One extra hit, since every product finds itself.
+        results = await backend.search_batch(batch, collection, top_k=neighbors + 1, min_score=threshold)
+        for product_id, hits in zip(ids[start:start + batch_size], results):
+            for score, hit_id in hits:
+                if hit_id != product_id:
+                    key = _pair(product_id, hit_id)
+                    pairs[key] = max(score, pairs.get(key, score))
+    return pairs
+
+
+async def dedup(args) -> dict:
+    started = time.perf_counter()
+    per_collection = {}
+    base = None
+    for collection in args.collections:
+        vectors, ids = load_snapshot(args.snapshot, collection, args.export)
+        if base is None:
+            base = (vectors, ids)
+        if args.method == "exact":
+            per_collection[collection] = exact_pairs(vectors, ids, args.threshold, args.block_rows)
+        else:
+            per_collection[collection] = await ann_pairs(vectors, ids, collection, args.threshold, args.neighbors, args.batch_size)
+        print(f"{collection}: {len(ids)} products, {len(per_collection[collection])} pairs >= {args.threshold}")
+
+    pair_sets = [set(pairs) for pairs in per_collection.values()]
+    combined = set.intersection(*pair_sets) if args.require == "all" else set.union(*pair_sets)
+
+    vectors, ids = base
+    row_of = {product_id: row for row, product_id in enumerate(ids)}
+    edges = [(row_of[a], row_of[b]) for a, b in combined if a in row_of and b in row_of]
+    clusters = []
+    for members in clusters_from_pairs(len(ids), edges):
+        canonical = choose_canonical(vectors, members)
+        clusters.append({
+            "canonical": ids[canonical],
+            "size": len(members),
+            "members": [ids[canonical]] + [ids[row] for row in members if row != canonical],
+        })
+
+    report = {
+        "collections": args.collections, "method": args.method, "require": args.require,
+        "threshold": args.threshold, "products": len(ids), "pairs": len(combined),
+        "clusters": clusters, "duplicates": sum(cluster["size"] - 1 for cluster in clusters),
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    summary = {
+        "products": len(ids), "pairs": len(combined), "clusters": len(clusters),
+        "duplicates": report["duplicates"], "seconds": round(time.perf_counter() - started, 2),
+    }
+    log_event_sync("INFO", "Catalog deduplication finished.", extra={**summary, "output": args.output})
+    print(json.dumps(summary))
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Find near-duplicate products from the stored catalog embeddings.")
+    parser.add_argument("--snapshot", default=search_backend.EMBEDDED_SNAPSHOT_DIR, help="Embedded-backend snapshot directory.")
+    parser.add_argument("--export", action="store_true", help="Re-export the collections from Qdrant first.")
+    parser.add_argument("--collections", nargs="+", default=[VISUAL_COLLECTION, TEXT_COLLECTION])
+    parser.add_argument("--require", choices=["all", "any"], default="all",
+                        help="A pair must be similar in all collections, or in any of them.")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Minimum cosine similarity of duplicates.")
+    parser.add_argument("--method", choices=["exact", "ann"], default="exact")
+    parser.add_argument("--block-rows", type=int, default=DEDUP_BLOCK_ROWS, help="Tile size of the exact method.")
+    parser.add_argument("--neighbors", type=int, default=10, help="Neighbors searched per product by the ann method.")
+    parser.add_argument("--batch-size", type=int, default=256, help="Products per batched search of the ann method.")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="JSON report with the duplicate clusters.")
+    args = parser.parse_args(argv)
+    if not -1.0 <= args.threshold <= 1.0:
+        parser.error("--threshold must be in [-1, 1].")
+    return args
+
+
+if __name__ == "__main__":
+    asyncio.run(dedup(parse_args()))
@@ -0,0 +1,347 @@
+"""
+ingest_catalog.py
+-----------------
+Offline catalog ingestion: builds the Qdrant collections `products_visual` and `products_text`
+and the MongoDB `product_metadata` collection from a metadata file (Dataset/metadata.json).
+
+Pipeline:
+  1. Stream product records from a JSON array or a JSONL file.
+  2. Read image files on a worker pool and compute a content hash per product
+     (metadata record + image bytes).
+  3. Skip products whose hash matches the state file from a previous run (incremental / resumable).
+  4. Embed changed products through the batched CLIP path (embed_images / embed_texts).
+  5. Upsert to Qdrant in bulk batches, several in parallel, and bulk-write metadata to MongoDB.
+     With --quantization int8|binary, Qdrant keeps compact codes in RAM for the first search
+     pass and the float32 originals on disk for rescoring.
+  6. Record the new hashes in the state file after every committed batch, and the changed ids in
+     MongoDB's catalog change log, which running API servers poll to invalidate their caches.
+
+Usage (from the Pipeline directory):
+    python ingest_catalog.py --metadata ../Dataset/metadata.json --image-root ../Dataset
+"""
+
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from pymongo import UpdateOne
+from qdrant_client.http import models
+from clip_inference import embed_images, embed_texts
+from db import mongodb_client
+from db.qdrant_client import get_async_client, get_client
+from utils.logger import log_event_sync
+
+VISUAL_COLLECTION = "products_visual"
+TEXT_COLLECTION = "products_text"
+
+# Payload fields stored in Qdrant next to each vector; also used for filtered search.
+PAYLOAD_FIELDS = ("id", "SKU", "name", "brand", "category", "color", "price")
+PAYLOAD_INDEXES = {
+    "brand": models.PayloadSchemaType.KEYWORD,
+    "category": models.PayloadSchemaType.KEYWORD,
+    "color": models.PayloadSchemaType.KEYWORD,
+    "price": models.PayloadSchemaType.FLOAT,
+}
+
+# Scalar (int8) quantization clips values outside this quantile of each collection.
+SCALAR_QUANTILE = 0.99
+
+DEFAULT_METADATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Dataset", "metadata.json")
+DEFAULT_STATE = "ingest_state.json"
+
+
+def iter_metadata(path: str, chunk_size: int = 1 << 16):
+    """
+    Streams product records from a JSON array file or a JSONL file without loading it whole.
+    """
+    if path.endswith(".jsonl"):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        return
+
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buffer = f.read(chunk_size)
+        position = buffer.find("[")
+        if position < 0:
+            raise ValueError(f"{path} is not a JSON array.")
+        position += 1
+        eof = False
+        while True:
+            # Skip whitespace and separators between records.
+            while True:
+                while position < len(buffer) and buffer[position] in " \t\r\n,":
+                    position += 1
+                if position < len(buffer) or eof:
+                    break
+                buffer, position = f.read(chunk_size), 0
+                eof = not buffer
+            if position >= len(buffer) or buffer[position] == "]":
+                return
+            try:
+                record, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                more = f.read(chunk_size)
+                eof = not more
+                buffer, position = buffer[position:] + more, 0
+                continue
+            yield record
+            position = end
+
+
+def iter_batches(records, batch_size: int):
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def resolve_image_path(record: dict, image_root: str):
+    """
+    Returns a readable path for the record's image. Absolute paths from another machine are
+    re-rooted under `image_root` by file name.
+    """
+    image_path = record.get("image_path")
+    if not image_path:
+        return None
+    if os.path.exists(image_path):
+        return image_path
+    candidate = os.path.join(image_root, os.path.basename(image_path))
+    return candidate if os.path.exists(candidate) else None
+
+
+def read_image(path: str):
+    if path is None:
+        return None
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def decode_image(image_bytes: bytes):
+    """
+    Decodes image file bytes into an RGB image, or returns None if they are not a readable image
+    (corrupt, truncated or a decompression bomb).
+    """
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            return image.convert("RGB")
+    except (OSError, ValueError, Image.DecompressionBombError):
+        return None
+
+
+def content_hash(record: dict, image_bytes: bytes) -> str:
+    m = hashlib.sha256()
+    m.update(json.dumps(record, sort_keys=True, default=str).encode("utf-8"))
+    if image_bytes is not None:
+        m.update(image_bytes)
+    return m.hexdigest()
+
+
+def point_id(product_id: str):
+    """
+    Qdrant point ids must be unsigned integers or UUIDs.
+    """
+    product_id = str(product_id)
+    return int(product_id) if product_id.isdigit() else str(uuid.uuid5(uuid.NAMESPACE_URL, product_id))
+
+
+def load_state(path: str) -> dict:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_state(path: str, state: dict):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def quantization_config(quantization: str):
+    """
+    Returns the Qdrant quantization config for "int8" or "binary" (None for no quantization).
+    Quantized codes are kept in RAM; searches rescore with the original vectors.
+    """
+    if quantization == "int8":
+        return models.ScalarQuantization(
+            scalar=models.ScalarQuantizationConfig(type=models.ScalarType.INT8, quantile=SCALAR_QUANTILE, always_ram=True)
+        )
+    if quantization == "binary":
+        return models.BinaryQuantization(binary=models.BinaryQuantizationConfig(always_ram=True))
+    return None
+
+
+def ensure_collection(name: str, dim: int, quantization: str = None):
+    """
+    Creates a cosine-distance collection with payload indexes if it does not exist yet.
+    With `quantization`, the original vectors are stored on disk; an existing collection is
+    switched to the requested quantization.
+    """
+    client = get_client()
+    config = quantization_config(quantization)
+    if client.collection_exists(name):
+        if config is not None:
+            client.update_collection(collection_name=name, quantization_config=config)
+        return
+    client.create_collection(
+        collection_name=name,
+        vectors_config=models.VectorParams(size=dim, distance=models.Distance.COSINE, on_disk=config is not None),
+        quantization_config=config,
+    )
+    for field, schema in PAYLOAD_INDEXES.items():
+        client.create_payload_index(collection_name=name, field_name=field, field_schema=schema)
+
+
+async def upsert_points(collection: str, records: list, vectors, batch_size: int, parallel: int):
+    """
+    Upserts vectors to Qdrant in chunks of `batch_size`, with at most `parallel` requests in flight.
+    """
+    semaphore = asyncio.Semaphore(parallel)
+    points = [
+        models.PointStruct(
+            id=point_id(record["id"]),
+            vector=vector.tolist(),
+            payload={field: record[field] for field in PAYLOAD_FIELDS if field in record},
+        )
+        for record, vector in zip(records, vectors)
+    ]
+
+    async def upload(chunk):
+        async with semaphore:
+            await get_async_client().upsert(collection_name=collection, points=chunk, wait=True)
+
+    await asyncio.gather(*(upload(points[i:i + batch_size]) for i in range(0, len(points), batch_size)))
+
+
+async def write_metadata(records: list):
+    """
+    Bulk-upserts product documents into MongoDB, keyed by `id`.
+    """
+    operations = [UpdateOne({"id": record["id"]}, {"$set": record}, upsert=True) for record in records]
+    await mongodb_client.get_collection().bulk_write(operations, ordered=False)
+
+
+async def ingest(args):
+    state = {} if args.force else load_state(args.state)
+    await mongodb_client.ensure_indexes()
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="ingest-io")
+    collections_ready = False
+
+    seen = skipped = ingested = failed = 0
+    started = time.perf_counter()
+
+    for batch in iter_batches(iter_metadata(args.metadata), args.batch_size):
+        seen += len(batch)
+        paths = [resolve_image_path(record, args.image_root) for record in batch]
+        images_bytes = await asyncio.gather(*(loop.run_in_executor(executor, read_image, path) for path in paths))
+
+        changed = []
+        for record, path, image_bytes in zip(batch, paths, images_bytes):
+            if "id" not in record:
+                failed += 1
+                log_event_sync("ERROR", "Skipping catalog record without id.", extra={"function": "ingest", "record": record})
+                continue
+            if image_bytes is None:
+                failed += 1
+                log_event_sync("ERROR", f"Image not found for product {record['id']}.", extra={"function": "ingest", "image_path": record.get("image_path")})
+                continue
+            digest = content_hash(record, image_bytes)
+            if state.get(str(record["id"])) == digest:
+                skipped += 1
+                continue
+            changed.append((record, image_bytes, digest))
+
+        if changed:
+            decoded = await asyncio.gather(*(
+                loop.run_in_executor(executor, decode_image, image_bytes) for _, image_bytes, _ in changed
+            ))
+            # An unreadable image fails its product only, like a missing one.
+            for (record, _, _), image in zip(changed, decoded):
+                if image is None:
+                    failed += 1
+                    log_event_sync("ERROR", f"Unreadable image for product {record['id']}.", extra={"function": "ingest", "image_path": record.get("image_path")})
+            changed = [item for item, image in zip(changed, decoded) if image is not None]
+            images = [image for image in decoded if image is not None]
+
+        if changed:
+            records = [record for record, _, _ in changed]
+            texts = [record.get("text") or f"{record.get('name', '')}. {record.get('description', '')}" for record in records]
+            visual_vectors, text_vectors = await asyncio.gather(
+                embed_images(images, batch_size=args.embed_batch_size),
+                embed_texts(texts, batch_size=args.embed_batch_size),
+            )
+
+            if not collections_ready:
+                ensure_collection(VISUAL_COLLECTION, visual_vectors.shape[1], args.quantization)
+                ensure_collection(TEXT_COLLECTION, text_vectors.shape[1], args.quantization)
+                collections_ready = True
+
+            await asyncio.gather(
+                upsert_points(VISUAL_COLLECTION, records, visual_vectors, args.upsert_batch_size, args.parallel_uploads),
+                upsert_points(TEXT_COLLECTION, records, text_vectors, args.upsert_batch_size, args.parallel_uploads),
+                write_metadata(records),
+            )
+
+            # Only record hashes once the batch is committed everywhere, so a crash re-ingests it.
+            for record, _, digest in changed:
+                state[str(record["id"])] = digest
+            save_state(args.state, state)
+            # Tell running API servers to drop cached matches and documents of these products.
+            await mongodb_client.record_catalog_change([record["id"] for record in records])
+            ingested += len(changed)
+
+        elapsed = time.perf_counter() - started
+        print(f"seen={seen} ingested={ingested} skipped={skipped} failed={failed} "
+              f"rate={seen / elapsed:.1f} items/s")
+
+    executor.shutdown()
+    elapsed = time.perf_counter() - started
+    summary = {
+        "seen": seen, "ingested": ingested, "skipped": skipped, "failed": failed,
+        "seconds": round(elapsed, 2), "items_per_second": round(seen / elapsed, 2) if elapsed else 0.0,
+    }
+    log_event_sync("INFO", "Catalog ingestion finished.", extra=summary)
+    print(json.dumps(summary))
+    return summary
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Build the Qdrant and MongoDB catalog from a metadata file.")
+    parser.add_argument("--metadata", default=DEFAULT_METADATA, help="JSON array or JSONL file with product records.")
+    parser.add_argument("--image-root", default=None, help="Directory to resolve image files by name (defaults to the metadata directory).")
+    parser.add_argument("--state", default=DEFAULT_STATE, help="State file with per-product content hashes.")
+    parser.add_argument("--batch-size", type=int, default=256, help="Records processed per pipeline batch.")
+    parser.add_argument("--embed-batch-size", type=int, default=64, help="Items per Triton call.")
+    parser.add_argument("--upsert-batch-size", type=int, default=128, help="Points per Qdrant upsert request.")
+    parser.add_argument("--parallel-uploads", type=int, default=4, help="Concurrent Qdrant upsert requests.")
+    parser.add_argument("--workers", type=int, default=8, help="Threads reading and decoding images.")
+    parser.add_argument("--force", action="store_true", help="Ignore the state file and re-ingest everything.")
+    parser.add_argument("--quantization", choices=["none", "int8", "binary"], default="none",
+                        help="Qdrant vector quantization (originals kept on disk for rescoring).")
+    args = parser.parse_args(argv)
+    if args.quantization == "none":
+        args.quantization = None
+    if args.image_root is None:
+        args.image_root = os.path.dirname(os.path.abspath(args.metadata))
+    return args
+
+
+if __name__ == "__main__":
+    asyncio.run(ingest(parse_args()))
@@ -2,20 +2,83 @@
 product_matching.py
 -------------------
 Handles product matching logic by combining Qdrant and MongoDB queries.
-Includes an in-memory cache to optimize repeated queries.
+Returns ranked top-k matches with scores (match_products_by_text / match_products_by_visual),
+with optional minimum-score cutoff and payload filters pushed down into Qdrant.
+match_product_hybrid fuses image and text results, running both branches concurrently.
+Optionally collapses near-duplicate variants (clusters from dedup_catalog.py) to one result each.
+Includes a bounded in-memory cache (utils/cache.py) to optimize repeated queries; concurrent
+identical queries that miss it share one search (utils/singleflight.py).
 """
 
 import asyncio
+import json
 import numpy as np
 import hashlib
-from db import qdrant_client, mongodb_client
-from qdrant_client import QdrantClient
+from clip_inference import get_clip_text_embedding, get_clip_visual_embedding
+from db import mongodb_client, search_backend
+from utils.cache import ResultCache
+from utils.semantic_cache import SemanticCache
+from utils.dedup import collapse_hits, load_canonical_map
+from utils.lazy import Lazy
+from utils.singleflight import SingleFlight
 from utils.logger import log_event_sync  # our MongoDB logger
+from utils import metrics
 
-# In-memory cache for matching results.
-# Keys are hashes of embeddings; values are product metadata.
-product_cache = {}
-cache_lock = asyncio.Lock()
+# Bounded in-memory cache for matching results.
+# Keys are hashes of embeddings plus search parameters; values are ranked (score, product)
+# lists, tagged with their product ids so entries can be invalidated when the catalog changes.
+CACHE_POLICY = "lru"  # "lru" or "ttl"
+CACHE_MAX_ENTRIES = 10_000
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+# Cached matches are dropped when ingest_catalog.py records a change (see apply_catalog_changes);
+# the TTL bounds how stale an entry can get if a change is missed (e.g. written by another tool).
+CACHE_TTL_SECONDS = 3600
+
+product_cache = ResultCache(
+    "product_matches",
+    policy=CACHE_POLICY,
+    max_entries=CACHE_MAX_ENTRIES,
+    max_bytes=CACHE_MAX_BYTES,
+    ttl_seconds=CACHE_TTL_SECONDS,
+)
+
+# Concurrent identical queries (same cache key) that miss the cache wait for one search and
+# metadata join instead of each querying the search backend and MongoDB.
+SINGLE_FLIGHT_ENABLED = True
+match_flights = SingleFlight("product_matches")
+
+# Near-duplicate tier consulted after an exact-cache miss: a query whose embedding is within the
+# threshold cosine similarity of a recent query reuses that query's match.
+# It is on for images only (SEMANTIC_CACHE_KINDS). Re-encoded, resized or re-cropped uploads of one
+# photo stay above 0.97 while photos of different products rarely do. CLIP text embeddings of
+# prompts that differ in one attribute (a colour, a size, a model number) can be more similar
+# than that, so a text hit may return another product's matches. Add "text" only with a
+# threshold validated on real queries (see the similarity histogram in get_cache_stats()).
+SEMANTIC_CACHE_ENABLED = True
+SEMANTIC_CACHE_KINDS = ("visual",)
+SEMANTIC_CACHE_CAPACITY = 2048
+SEMANTIC_CACHE_THRESHOLD = 0.97
+SEMANTIC_CACHE_TEXT_THRESHOLD = 0.995
+
+text_semantic_cache = SemanticCache("text_matches", capacity=SEMANTIC_CACHE_CAPACITY, threshold=SEMANTIC_CACHE_TEXT_THRESHOLD)
+visual_semantic_cache = SemanticCache("visual_matches", capacity=SEMANTIC_CACHE_CAPACITY, threshold=SEMANTIC_CACHE_THRESHOLD)
+
+# Hybrid fusion: "rrf" (reciprocal rank fusion) or "weighted" (weighted sum of scores).
+HYBRID_FUSION = "rrf"
+HYBRID_VISUAL_WEIGHT = 0.5
+HYBRID_RRF_K = 60
+# Each branch retrieves top_k * HYBRID_CANDIDATE_MULTIPLIER candidates before fusion.
+HYBRID_CANDIDATE_MULTIPLIER = 3
+
+# Variant collapsing: with DEDUP_COLLAPSE_VARIANTS, every duplicate cluster of the report written
+# by dedup_catalog.py is returned once, as its best-ranked member (the one that passed the
+# filters and min_score). Searches retrieve top_k * DEDUP_CANDIDATE_MULTIPLIER candidates to
+# refill the top-k.
+DEDUP_COLLAPSE_VARIANTS = False
+DEDUP_CLUSTERS_PATH = "dedup_clusters.json"
+DEDUP_CANDIDATE_MULTIPLIER = 3
+
+canonical_products = Lazy(lambda: load_canonical_map(DEDUP_CLUSTERS_PATH), "dedup_clusters")
 
 def hash_embedding(embedding: np.ndarray) -> str:
     """
@@ -26,72 +89,341 @@ def hash_embedding(embedding: np.ndarray) -> str:
     m.update(embedding.tobytes())
     return m.hexdigest()
 
-async def match_product_by_text(text_embedding: np.ndarray):
+def invalidate_catalog(product_ids=None) -> int:
     """
-    Matches a product using a text embedding by querying the Qdrant 'product_text' collection,
-    then retrieving metadata from MongoDB.
-    Uses an in-memory cache to avoid redundant queries.
+    Drops cached matches and cached product documents after a catalog change.
+
+    Args:
+        product_ids (iterable): Ids of the products that changed. If None, the whole cache is cleared.
+
+    Returns:
+        int: The number of cache entries removed.
+    """
+    caches = (product_cache, text_semantic_cache, visual_semantic_cache)
+    if product_ids is None:
+        mongodb_client.invalidate_products()
+        canonical_products.reset()  # re-read the duplicate clusters on next use
+        removed = sum(cache.clear() for cache in caches)
+        log_event_sync("INFO", f"Product match cache cleared after catalog change ({removed} entries).")
+        return removed
+    product_ids = list(product_ids)
+    mongodb_client.invalidate_products(product_ids)
+    removed = sum(cache.invalidate_tag(product_id) for cache in caches for product_id in product_ids)
+    log_event_sync("INFO", f"Invalidated {removed} cached matches after catalog change.", extra={"product_ids": product_ids})
+    return removed
+
+# Last catalog version whose changes were applied to the caches (None until the first check).
+_catalog_version = None
+
+async def apply_catalog_changes() -> int:
+    """
+    Invalidates cached matches and documents for the catalog changes recorded in MongoDB
+    (mongodb_client.record_catalog_change) since the previous call. The first call only
+    records the current catalog version. Changes that are missing from the log (expired, or
+    not visible yet) and full-catalog changes clear the caches instead.
+
+    Returns:
+        int: The number of catalog changes applied.
+    """
+    global _catalog_version
+    if _catalog_version is None:
+        _catalog_version = await mongodb_client.get_catalog_version()
+        return 0
+    changes = await mongodb_client.get_catalog_changes(_catalog_version)
+    if not changes:
+        return 0
+    versions = [change["version"] for change in changes]
+    contiguous = versions == list(range(_catalog_version + 1, _catalog_version + 1 + len(changes)))
+    if not contiguous or any(change.get("product_ids") is None for change in changes):
+        invalidate_catalog()
+    else:
+        invalidate_catalog({product_id for change in changes for product_id in change["product_ids"]})
+    _catalog_version = versions[-1]
+    return len(changes)
+
+def get_cache_stats() -> dict:
+    """
+    Returns size, hit / miss and eviction metrics of the exact and near-duplicate match caches.
+    """
+    return {
+        "exact": product_cache.snapshot(),
+        "semantic_text": text_semantic_cache.snapshot(),
+        "semantic_visual": visual_semantic_cache.snapshot(),
+        "single_flight": {**match_flights.stats.snapshot(), "in_flight": match_flights.in_flight},
+    }
+
+def _collect_metrics():
+    stats = get_cache_stats()
+    yield from metrics.snapshot_samples(
+        "match_cache", stats["exact"], {"cache": "exact"},
+        counters=("hits", "misses", "evictions", "expirations", "invalidations"), gauges=("hit_ratio", "entries", "bytes"),
+    )
+    for name in ("semantic_text", "semantic_visual"):
+        yield from metrics.snapshot_samples(
+            "match_cache", stats[name], {"cache": name},
+            counters=("hits", "misses", "evictions", "invalidations"), gauges=("entries",),
+        )
+        yield "match_cache_hit_ratio", "gauge", {"cache": name}, stats[name]["hit_rate"]
+    yield from metrics.snapshot_samples(
+        "singleflight", stats["single_flight"], {"flight": match_flights.name},
+        counters=("calls", "coalesced", "failed", "abandoned"), gauges=("in_flight",),
+    )
+
+metrics.register_collector(_collect_metrics)
+
+def collapse_variants(hits: list, top_k: int) -> list:
+    """
+    Applies DEDUP_COLLAPSE_VARIANTS to ranked (score, product_id) hits and truncates them to top_k.
+    """
+    if DEDUP_COLLAPSE_VARIANTS:
+        hits = collapse_hits(hits, canonical_products.get())
+    return hits[:top_k]
+
+def candidate_limit(top_k: int) -> int:
+    """
+    Number of search hits needed to fill top_k results after collapse_variants.
+    """
+    return top_k * DEDUP_CANDIDATE_MULTIPLIER if DEDUP_COLLAPSE_VARIANTS else top_k
+
+def copy_results(results: list) -> list:
+    """
+    Copies ranked (score, product) results on their way out. Cached and coalesced results are
+    shared by every request, so callers must not get the cached lists or documents themselves.
+    """
+    return [(score, dict(product)) for score, product in results]
+
+def _params_key(top_k: int, min_score: float, filters: dict) -> str:
+    """
+    Serializes the search parameters into a stable cache-key suffix.
+    """
+    return json.dumps([top_k, min_score, filters], sort_keys=True, default=str)
+
+async def _match_ranked(embedding: np.ndarray, kind: str, collection: str, semantic_cache: SemanticCache,
+                        top_k: int, min_score: float, filters: dict) -> list:
+    """
+    Shared top-k matching path: cache lookups, vector search (Qdrant or the embedded backend,
+    see db/search_backend.py) and a bulk MongoDB metadata join.
+
+    Returns:
+        list[tuple[float, dict]]: (score, product) pairs in Qdrant's ranking order.
+    """
+    if top_k < 1:
+        raise ValueError("top_k must be at least 1.")
+    search_backend.validate_filters(filters)
+    cache_key = f"{kind}_{hash_embedding(embedding)}_{_params_key(top_k, min_score, filters)}"
+    cached = product_cache.get(cache_key)
+    if cached is not None:
+        log_event_sync("INFO", f"Cache hit for {kind} embedding.", extra={"cache_key": cache_key})
+        return copy_results(cached)
+
+    # The near-duplicate tier only serves unfiltered queries; it stores (top_k, results) so a
+    # hit can answer any request for at most that many results.
+    use_semantic = SEMANTIC_CACHE_ENABLED and kind in SEMANTIC_CACHE_KINDS and min_score is None and not filters
+    if use_semantic:
+        near = semantic_cache.lookup(embedding)
+        if near is not None and near[0][0] >= top_k:
+            (_, results), similarity = near
+            log_event_sync("INFO", f"Near-duplicate cache hit for {kind} embedding.", extra={"cache_key": cache_key, "similarity": similarity})
+            return copy_results(results[:top_k])
+
+    async def search():
+        try:
+            hits = await search_backend.get_backend().search(embedding, collection, top_k=candidate_limit(top_k), min_score=min_score, filters=filters)
+            hits = collapse_variants(hits, top_k)
+        except Exception as e:
+            log_event_sync("ERROR", f"Error during {kind} matching: {e}", extra={"cache_key": cache_key})
+            raise RuntimeError(f"{kind.capitalize()} matching failed: {e}")
+
+        product_ids = [product_id for _, product_id in hits]
+        try:
+            products = await mongodb_client.get_products(product_ids) if product_ids else []
+        except Exception as e:
+            log_event_sync("ERROR", f"Error retrieving product metadata for product ids {product_ids}: {e}", extra={"cache_key": cache_key})
+            raise RuntimeError(f"Error retrieving product metadata for product ids {product_ids}: {e}")
+
+        # Products missing from MongoDB are dropped (get_products logs them).
+        results = [(score, product) for (score, _), product in zip(hits, products) if product is not None]
+
+        product_cache.set(cache_key, results, tags=product_ids)
+        if use_semantic:
+            semantic_cache.add(embedding, (top_k, results), tags=product_ids)
+        return results
+
+    # Concurrent misses for the same key share one search and join.
+    if SINGLE_FLIGHT_ENABLED:
+        return copy_results(await match_flights.do(cache_key, search))
+    return copy_results(await search())
+
+@metrics.traced("match.text")
+async def match_products_by_text(text_embedding: np.ndarray, top_k: int = 5, min_score: float = None, filters: dict = None) -> list:
+    """
+    Ranks the top-k products for a text embedding using the Qdrant 'products_text' collection,
+    then retrieves their metadata from MongoDB in one bulk query.
 
     Args:
         text_embedding (np.ndarray): The text embedding vector.
-    
+        top_k (int): Maximum number of products to return.
+        min_score (float): Drop matches scoring below this value.
+        filters (dict): Payload filters applied by the search backend, e.g.
+            {"brand": "Sony", "price": {"gte": 100, "lte": 500}} (see qdrant_client.build_filter).
+
     Returns:
-        dict: The product metadata.
+        list[tuple[float, dict]]: (match_score, product) pairs, best first.
     """
-    cache_key = "text_" + hash_embedding(text_embedding)
-    async with cache_lock:
-        if cache_key in product_cache:
-            log_event_sync("INFO", f"Cache hit for text embedding.", extra={"cache_key": cache_key})
-            return product_cache[cache_key]
+    return await _match_ranked(text_embedding, "text", "products_text", text_semantic_cache, top_k, min_score, filters)
 
-    try:
-        product_id = await qdrant_client.search_embedding(text_embedding, collection="products_text")
-    except Exception as e:
-        log_event_sync("ERROR", f"Error during text matching: {e}", extra={"cache_key": cache_key})
-        raise RuntimeError(f"Text matching failed: {e}")
+@metrics.traced("match.visual")
+async def match_products_by_visual(visual_embedding: np.ndarray, top_k: int = 5, min_score: float = None, filters: dict = None) -> list:
+    """
+    Ranks the top-k products for a visual embedding using the Qdrant 'products_visual' collection,
+    then retrieves their metadata from MongoDB in one bulk query.
 
-    try:
-        product = await mongodb_client.get_product(product_id)
-    except Exception as e:
-        log_event_sync("ERROR", f"Error retrieving product metadata for product id {product_id}: {e}", extra={"cache_key": cache_key})
-        raise RuntimeError(f"Error retrieving product metadata for product id {product_id}: {e}")
+    Args:
+        visual_embedding (np.ndarray): The visual embedding vector.
+        top_k (int): Maximum number of products to return.
+        min_score (float): Drop matches scoring below this value.
+        filters (dict): Payload filters applied by the search backend (see qdrant_client.build_filter).
 
-    async with cache_lock:
-        product_cache[cache_key] = product
+    Returns:
+        list[tuple[float, dict]]: (match_score, product) pairs, best first.
+    """
+    return await _match_ranked(visual_embedding, "visual", "products_visual", visual_semantic_cache, top_k, min_score, filters)
 
-    return product
+async def match_product_by_text(text_embedding: np.ndarray):
+    """
+    Matches a product using a text embedding by querying the Qdrant 'products_text' collection,
+    then retrieving metadata from MongoDB.
+    Uses an in-memory cache, backed by a near-duplicate embedding cache, to avoid redundant queries.
+
+    Args:
+        text_embedding (np.ndarray): The text embedding vector.
+    
+    Returns:
+        tuple: (match_score, product metadata) of the best match.
+    """
+    results = await match_products_by_text(text_embedding, top_k=1)
+    if not results:
+        log_event_sync("ERROR", "No matching product found for text embedding.")
+        raise RuntimeError("Text matching failed: no matching product found.")
+    return results[0]
 
 async def match_product_by_visual(visual_embedding: np.ndarray):
     """
-    Matches a product using a visual embedding by querying the Qdrant 'products_image' collection,
+    Matches a product using a visual embedding by querying the Qdrant 'products_visual' collection,
     then retrieving metadata from MongoDB.
-    Uses an in-memory cache to optimize repeated queries.
+    Uses an in-memory cache, backed by a near-duplicate embedding cache, to optimize repeated queries.
 
     Args:
         visual_embedding (np.ndarray): The visual embedding vector.
     
     Returns:
-        dict: The product metadata.
+        tuple: (match_score, product metadata) of the best match.
     """
-    cache_key = "visual_" + hash_embedding(visual_embedding)
-    async with cache_lock:
-        if cache_key in product_cache:
-            log_event_sync("INFO", f"Cache hit for visual embedding.", extra={"cache_key": cache_key})
-            return product_cache[cache_key]
+    results = await match_products_by_visual(visual_embedding, top_k=1)
+    if not results:
+        log_event_sync("ERROR", "No matching product found for visual embedding.")
+        raise RuntimeError("Visual matching failed: no matching product found.")
+    return results[0]
 
-    try:
-        match_score, product_id = await qdrant_client.search_embedding(visual_embedding, collection="products_visual")
-    except Exception as e:
-        log_event_sync("ERROR", f"Error during visual matching: {e}", extra={"cache_key": cache_key})
-        raise RuntimeError(f"Visual matching failed: {e}")
+def fuse_results(visual_hits: list, text_hits: list, fusion: str = HYBRID_FUSION,
+                 visual_weight: float = HYBRID_VISUAL_WEIGHT, rrf_k: int = HYBRID_RRF_K) -> list:
+    """
+    Fuses two ranked (score, product_id) lists into one.
+
+    Args:
+        visual_hits (list): Ranked hits from the visual branch.
+        text_hits (list): Ranked hits from the text branch.
+        fusion (str): "rrf" sums weight / (rrf_k + rank) over the branches a product appears in;
+            "weighted" sums weight * score, counting a missing branch as 0.
+        visual_weight (float): Weight of the visual branch; the text branch gets 1 - visual_weight.
+
+    Returns:
+        list[tuple[float, str]]: (fused_score, product_id) pairs, best first.
+    """
+    if fusion not in ("rrf", "weighted"):
+        raise ValueError(f"Unknown fusion method '{fusion}'. Expected 'rrf' or 'weighted'.")
+    fused = {}
+    for hits, weight in ((visual_hits, visual_weight), (text_hits, 1.0 - visual_weight)):
+        for rank, (score, product_id) in enumerate(hits, start=1):
+            contribution = weight / (rrf_k + rank) if fusion == "rrf" else weight * score
+            fused[product_id] = fused.get(product_id, 0.0) + contribution
+    return sorted(((score, product_id) for product_id, score in fused.items()), key=lambda item: -item[0])
+
+@metrics.traced("match.hybrid")
+async def match_product_hybrid(image, text_prompt: str, top_k: int = 5, filters: dict = None,
+                               fusion: str = HYBRID_FUSION, visual_weight: float = HYBRID_VISUAL_WEIGHT) -> list:
+    """
+    Matches products using both an image and a text prompt.
+    Both CLIP embeddings are computed concurrently, then 'products_visual' and 'products_text'
+    are searched concurrently, so latency is close to the slower branch rather than the sum.
+    The rankings are fused and metadata for the final top-k is fetched in one bulk query.
 
+    Args:
+        image (PIL.Image.Image | bytes): The query image or its encoded bytes.
+        text_prompt (str): The query text.
+        top_k (int): Maximum number of products to return.
+        filters (dict): Payload filters applied to both branches (see qdrant_client.build_filter).
+        fusion (str): "rrf" or "weighted" (see fuse_results).
+        visual_weight (float): Weight of the visual branch in [0, 1].
+
+    Returns:
+        list[tuple[float, dict]]: (fused_score, product) pairs, best first.
+
+    Raises:
+        ValueError: For invalid parameters, or an image or text that cannot be preprocessed.
+    """
+    if top_k < 1:
+        raise ValueError("top_k must be at least 1.")
+    if fusion not in ("rrf", "weighted"):
+        raise ValueError(f"Unknown fusion method '{fusion}'. Expected 'rrf' or 'weighted'.")
+    if not 0.0 <= visual_weight <= 1.0:
+        raise ValueError("visual_weight must be in [0, 1].")
+    search_backend.validate_filters(filters)
     try:
-        product = await mongodb_client.get_product(product_id)
+        visual_embedding, text_embedding = await asyncio.gather(
+            get_clip_visual_embedding(image), get_clip_text_embedding(text_prompt)
+        )
+    except ValueError:
+        # Invalid image or text (already logged); the caller's input error, not a failure.
+        raise
     except Exception as e:
-        log_event_sync("ERROR", f"Error retrieving product metadata for product id {product_id}: {e}", extra={"cache_key": cache_key})
-        raise RuntimeError(f"Error retrieving product metadata for product id {product_id}: {e}")
+        log_event_sync("ERROR", f"Error computing embeddings for hybrid matching: {e}", extra={"function": "match_product_hybrid"})
+        raise RuntimeError(f"Hybrid matching failed: {e}")
+
+    cache_key = (
+        f"hybrid_{hash_embedding(visual_embedding)}_{hash_embedding(text_embedding)}_"
+        f"{_params_key(top_k, None, filters)}_{fusion}_{visual_weight}"
+    )
+    cached = product_cache.get(cache_key)
+    if cached is not None:
+        log_event_sync("INFO", "Cache hit for hybrid query.", extra={"cache_key": cache_key})
+        return copy_results(cached)
+
+    async def search():
+        candidates = candidate_limit(top_k) * HYBRID_CANDIDATE_MULTIPLIER
+        backend = search_backend.get_backend()
+        try:
+            visual_hits, text_hits = await asyncio.gather(
+                backend.search(visual_embedding, "products_visual", top_k=candidates, filters=filters),
+                backend.search(text_embedding, "products_text", top_k=candidates, filters=filters),
+            )
+        except Exception as e:
+            log_event_sync("ERROR", f"Error during hybrid matching: {e}", extra={"cache_key": cache_key})
+            raise RuntimeError(f"Hybrid matching failed: {e}")
+
+        with metrics.span("fuse"):
+            fused = collapse_variants(fuse_results(visual_hits, text_hits, fusion=fusion, visual_weight=visual_weight), top_k)
+        product_ids = [product_id for _, product_id in fused]
+        try:
+            products = await mongodb_client.get_products(product_ids) if product_ids else []
+        except Exception as e:
+            log_event_sync("ERROR", f"Error retrieving product metadata for product ids {product_ids}: {e}", extra={"cache_key": cache_key})
+            raise RuntimeError(f"Error retrieving product metadata for product ids {product_ids}: {e}")
 
-    async with cache_lock:
-        product_cache[cache_key] = product
+        results = [(score, product) for (score, _), product in zip(fused, products) if product is not None]
+        product_cache.set(cache_key, results, tags=product_ids)
+        return results
 
-    return match_score, product
+    if SINGLE_FLIGHT_ENABLED:
+        return copy_results(await match_flights.do(cache_key, search))
+    return copy_results(await search())
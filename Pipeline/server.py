@@ -0,0 +1,317 @@
+"""
+server.py
+---------
+Async HTTP API for product matching (FastAPI on uvicorn).
+
+Every request is served on one long-lived event loop per worker process, so the Triton,
+Qdrant and MongoDB clients (and the micro-batchers and caches in front of them) are shared
+across requests instead of being rebuilt per call. Each worker polls the catalog change log
+written by ingest_catalog.py and drops cached matches of changed products.
+
+Endpoints:
+  - GET  /health
+  - GET  /metrics       Prometheus text format (per-stage latency, caches, batchers, log shipper)
+  - GET  /debug/profile?stage=...   sampling-profiler output (PROFILE_SAMPLE_RATE > 0)
+  - POST /match/image   multipart: file, top_k, min_score, filters (JSON string)
+  - POST /match/text    JSON: {"text", "top_k", "min_score", "filters"}
+  - POST /match/hybrid  multipart: file, text, top_k, filters, fusion, visual_weight
+  - POST /match/batch   JSON: {"texts": [...]} or {"images": [base64, ...]}, "top_k", "min_score", "filters"
+
+Run (from the Pipeline directory):
+    python server.py --host 0.0.0.0 --port 8080 --workers 2
+"""
+
+import argparse
+import asyncio
+import base64
+import binascii
+import io
+import json
+import time
+from contextlib import asynccontextmanager
+from typing import List, Optional
+import uvicorn
+from fastapi import Depends, FastAPI, File, Form, HTTPException, Request, UploadFile
+from fastapi.responses import PlainTextResponse
+from PIL import Image
+from pydantic import BaseModel
+from clip_inference import (close_triton_client, embed_images, embed_texts, get_clip_text_embedding,
+                            get_clip_visual_embedding, warm_up)
+from db import mongodb_client, qdrant_client
+from db.search_backend import validate_filters
+from product_matching import (apply_catalog_changes, match_product_hybrid, match_products_by_text,
+                              match_products_by_visual)
+from utils.logger import log_event_sync
+from utils import metrics
+
+API_HOST = "0.0.0.0"
+API_PORT = 8080
+# Requests allowed to run at once per worker; others wait up to QUEUE_TIMEOUT seconds, then get a 503.
+MAX_CONCURRENT_REQUESTS = 64
+QUEUE_TIMEOUT = 5.0
+# Largest batch accepted by /match/batch.
+MAX_BATCH_ITEMS = 256
+# Load the tokenizer, connect to Triton and run one inference per model before serving.
+WARM_UP_ON_STARTUP = True
+# Seconds between checks of the catalog change log written by ingest_catalog.py.
+CATALOG_POLL_SECONDS = 5.0
+
+_request_slots = None
+
+
+async def watch_catalog():
+    """
+    Applies catalog changes to the caches every CATALOG_POLL_SECONDS until cancelled.
+    """
+    while True:
+        try:
+            await apply_catalog_changes()
+        except Exception as e:
+            log_event_sync("ERROR", f"Catalog change check failed: {e}", extra={"function": "watch_catalog"})
+        await asyncio.sleep(CATALOG_POLL_SECONDS)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global _request_slots
+    _request_slots = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    await mongodb_client.ensure_indexes()
+    if WARM_UP_ON_STARTUP:
+        try:
+            await warm_up()
+        except Exception as e:
+            # Serve anyway; the first requests pay the set-up cost instead.
+            log_event_sync("ERROR", f"Warm-up failed: {e}", extra={"function": "lifespan"})
+    catalog_watcher = asyncio.create_task(watch_catalog())
+    yield
+    catalog_watcher.cancel()
+    await close_triton_client()
+    await qdrant_client.close_async_client()
+    mongodb_client.close_client()
+
+
+app = FastAPI(title="Product Matching API", lifespan=lifespan)
+
+HTTP_REQUESTS = metrics.counter("http_requests", "HTTP requests by route and status.", ("path", "status"))
+HTTP_REQUEST_SECONDS = metrics.histogram("http_request_seconds", "HTTP request latency in seconds.", ("path",))
+HTTP_IN_FLIGHT = metrics.gauge("http_requests_in_flight", "HTTP requests being served.")
+
+
+@app.middleware("http")
+async def instrument_requests(request: Request, call_next):
+    """
+    Records request counts, latency and in-flight requests, and returns the request's per-stage
+    timings in a Server-Timing header.
+    """
+    if not metrics.METRICS_ENABLED:
+        return await call_next(request)
+    token = metrics.start_trace()
+    HTTP_IN_FLIGHT.inc()
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        HTTP_IN_FLIGHT.dec()
+        timings = metrics.end_trace(token)
+        route = request.scope.get("route")
+        path = getattr(route, "path", "unmatched")
+        HTTP_REQUESTS.inc(path=path, status=status)
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, path=path)
+    if timings:
+        response.headers["Server-Timing"] = ", ".join(f"{stage};dur={1000.0 * seconds:.2f}" for stage, seconds in timings.items())
+    return response
+
+
+async def request_slot():
+    """
+    Dependency enforcing MAX_CONCURRENT_REQUESTS per worker.
+    """
+    try:
+        await asyncio.wait_for(_request_slots.acquire(), timeout=QUEUE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=503, detail="Server is at its concurrency limit; retry later.")
+    try:
+        yield
+    finally:
+        _request_slots.release()
+
+
+class TextMatchRequest(BaseModel):
+    text: str
+    top_k: int = 5
+    min_score: Optional[float] = None
+    filters: Optional[dict] = None
+
+
+class BatchMatchRequest(BaseModel):
+    texts: Optional[List[str]] = None
+    images: Optional[List[str]] = None  # base64-encoded image files
+    top_k: int = 5
+    min_score: Optional[float] = None
+    filters: Optional[dict] = None
+
+
+def serialize_results(results: list) -> list:
+    return [{"score": float(score), "product": product} for score, product in results]
+
+
+def parse_filters(filters: Optional[str]) -> Optional[dict]:
+    if not filters:
+        return None
+    try:
+        parsed = json.loads(filters)
+    except json.JSONDecodeError as e:
+        raise HTTPException(status_code=422, detail=f"filters must be a JSON object: {e}")
+    if not isinstance(parsed, dict):
+        raise HTTPException(status_code=422, detail="filters must be a JSON object.")
+    return parsed
+
+
+def decode_image(encoded: str) -> Image.Image:
+    """
+    Decodes a base64 image file into an RGB image, so that preprocessing cannot fail on the
+    input later. Raises a 422 for anything that is not a readable image.
+    """
+    try:
+        with Image.open(io.BytesIO(base64.b64decode(encoded, validate=True))) as image:
+            return image.convert("RGB")
+    except (binascii.Error, OSError, ValueError, Image.DecompressionBombError) as e:
+        raise HTTPException(status_code=422, detail=f"Invalid base64 image: {e}")
+
+
+def decode_images(encoded_images: list) -> list:
+    """
+    Decodes a batch of base64 images (see decode_image), naming the first invalid item.
+    CPU-bound; called on a worker thread.
+    """
+    images = []
+    for index, encoded in enumerate(encoded_images):
+        try:
+            images.append(decode_image(encoded))
+        except HTTPException as e:
+            raise HTTPException(status_code=422, detail=f"images[{index}]: {e.detail}")
+    return images
+
+
+async def run_match(match_type: str, coro, extra: dict = None) -> dict:
+    """
+    Awaits a matching coroutine, maps input errors to 422 and other failures to 500,
+    and logs the result.
+    """
+    try:
+        results = await coro
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception as e:
+        log_event_sync("ERROR", f"Product matching error: {e}", extra={"match_type": match_type, **(extra or {})})
+        raise HTTPException(status_code=500, detail=f"An error occurred during product matching: {e}")
+    log_event_sync(
+        "RESULT",
+        f"{match_type.capitalize()} matching execution result stored.",
+        extra={"match_type": match_type, "product_ids": [product.get("id") for _, product in results], **(extra or {})}
+    )
+    return {"results": serialize_results(results)}
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/debug/profile")
+async def profile(stage: Optional[str] = None, limit: int = 25):
+    return PlainTextResponse(metrics.get_profile(stage, limit=limit))
+
+
+@app.post("/match/image", dependencies=[Depends(request_slot)])
+async def match_image(file: UploadFile = File(...), top_k: int = Form(5), min_score: Optional[float] = Form(None),
+                      filters: Optional[str] = Form(None)):
+    data = await file.read()
+    parsed_filters = parse_filters(filters)
+
+    async def match():
+        embedding = await get_clip_visual_embedding(data)
+        return await match_products_by_visual(embedding, top_k=top_k, min_score=min_score, filters=parsed_filters)
+
+    return await run_match("visual", match())
+
+
+@app.post("/match/text", dependencies=[Depends(request_slot)])
+async def match_text(request: TextMatchRequest):
+    async def match():
+        embedding = await get_clip_text_embedding(request.text)
+        return await match_products_by_text(embedding, top_k=request.top_k, min_score=request.min_score, filters=request.filters)
+
+    return await run_match("text", match(), extra={"input_text": request.text})
+
+
+@app.post("/match/hybrid", dependencies=[Depends(request_slot)])
+async def match_hybrid(file: UploadFile = File(...), text: str = Form(...), top_k: int = Form(5),
+                       filters: Optional[str] = Form(None), fusion: str = Form("rrf"), visual_weight: float = Form(0.5)):
+    data = await file.read()
+    coro = match_product_hybrid(data, text, top_k=top_k, filters=parse_filters(filters), fusion=fusion, visual_weight=visual_weight)
+    return await run_match("hybrid", coro, extra={"input_text": text})
+
+
+@app.post("/match/batch", dependencies=[Depends(request_slot)])
+async def match_batch(request: BatchMatchRequest):
+    if bool(request.texts) == bool(request.images):
+        raise HTTPException(status_code=422, detail="Provide exactly one of 'texts' or 'images'.")
+    items = request.texts or request.images
+    if len(items) > MAX_BATCH_ITEMS:
+        raise HTTPException(status_code=422, detail=f"At most {MAX_BATCH_ITEMS} items per batch.")
+    # Reject bad input before embedding: embed_texts / embed_images report any failure,
+    # including one caused by an item, as a RuntimeError.
+    if request.texts:
+        blank = [index for index, text in enumerate(request.texts) if not text.strip()]
+        if blank:
+            raise HTTPException(status_code=422, detail=f"texts{blank} must be non-empty strings.")
+    if request.top_k < 1:
+        raise HTTPException(status_code=422, detail="top_k must be at least 1.")
+    try:
+        validate_filters(request.filters)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    try:
+        if request.texts:
+            embeddings = await embed_texts(request.texts)
+            match_fn = match_products_by_text
+        else:
+            embeddings = await embed_images(await asyncio.to_thread(decode_images, request.images))
+            match_fn = match_products_by_visual
+        batches = await asyncio.gather(*(
+            match_fn(embedding[None, :], top_k=request.top_k, min_score=request.min_score, filters=request.filters)
+            for embedding in embeddings
+        ))
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception as e:
+        log_event_sync("ERROR", f"Batch matching error: {e}", extra={"match_type": "batch", "count": len(items)})
+        raise HTTPException(status_code=500, detail=f"An error occurred during batch matching: {e}")
+
+    return {"results": [serialize_results(results) for results in batches]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the product matching API.")
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--port", type=int, default=API_PORT)
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes, each with its own event loop and client pools.")
+    args = parser.parse_args()
+    uvicorn.run("server:app", host=args.host, port=args.port, workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
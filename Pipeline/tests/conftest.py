@@ -0,0 +1,65 @@
+"""
+conftest.py
+-----------
+Shared test setup. Tests import the pipeline modules the way they run from the Pipeline directory
+(`from db import ...`), use the local stand-ins of benchmarks/fakes.py instead of Triton, Qdrant
+and MongoDB (or mongomock-motor where real queries matter), and never ship log events to a real
+MongoDB.
+
+Run (from the Pipeline directory):
+    python -m pytest -q tests
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+from benchmarks import fakes  # noqa: E402
+from db import mongodb_client  # noqa: E402
+from utils import logger  # noqa: E402
+from utils.lazy import Lazy  # noqa: E402
+
+
+@pytest.fixture(autouse=True, scope="session")
+def log_collection():
+    """
+    Points the log shipper at an in-memory collection for the whole session.
+    """
+    collection = fakes.FakeLogCollection()
+    original = logger.CLIENT
+    logger.CLIENT = Lazy(lambda: {logger.LOG_DB_NAME: {logger.LOG_COLLECTION_NAME: collection}}, "test_log_client")
+    yield collection
+    logger.SHIPPER.flush()  # ship what is queued before the real client is back
+    logger.CLIENT = original
+
+
+class _SharedClient:
+    """
+    Stands in for mongodb_client.CLIENT: one mongomock-motor client for every event loop (it is
+    not bound to one), which close_client() leaves open.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def get(self):
+        return self.client
+
+    def pop(self):
+        return None
+
+
+@pytest.fixture
+def mongo(monkeypatch):
+    """
+    Points db/mongodb_client.py at an in-memory mongomock-motor client with an empty document
+    cache, and returns the product database.
+    """
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    client = mongomock_motor.AsyncMongoMockClient()
+    monkeypatch.setattr(mongodb_client, "CLIENT", _SharedClient(client))
+    mongodb_client.invalidate_products()
+    yield client[mongodb_client.DB_NAME]
+    mongodb_client.invalidate_products()
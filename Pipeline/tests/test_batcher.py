@@ -0,0 +1,136 @@
+"""
+Tests for utils/batcher.py, with benchmarks/fakes.FakeClipModel standing in for Triton.
+"""
+
+import asyncio
+import numpy as np
+import pytest
+from benchmarks.fakes import FakeClipModel
+from utils import metrics
+from utils.batcher import MicroBatcher
+
+
+def token_rows(n: int, seed: int = 0) -> list:
+    rng = np.random.default_rng(seed)
+    return [rng.integers(0, 49406, size=(1, 77), dtype=np.int64) for _ in range(n)]
+
+
+def test_rows_are_split_back_to_their_callers():
+    model = FakeClipModel()
+    items = token_rows(5)
+
+    async def run():
+        batcher = MicroBatcher("test", model.infer_text, max_batch_size=32, max_wait_ms=20)
+        return batcher, await asyncio.gather(*(batcher.submit(item) for item in items))
+
+    batcher, results = asyncio.run(run())
+    assert model.calls == 1 and model.rows == 5
+    assert batcher.stats.snapshot()["batch_size_histogram"] == {5: 1}
+    for item, result in zip(items, results):
+        assert result.shape == (1, model.dim)
+        np.testing.assert_allclose(result, model.embed_text(item), rtol=1e-6)
+
+
+def test_full_batch_flushes_without_waiting_for_the_timer():
+    model = FakeClipModel()
+
+    async def run():
+        batcher = MicroBatcher("test", model.infer_text, max_batch_size=4, max_wait_ms=10_000)
+        await asyncio.wait_for(asyncio.gather(*(batcher.submit(item) for item in token_rows(4))), timeout=2)
+        return batcher
+
+    batcher = asyncio.run(run())
+    assert batcher.stats.snapshot()["batch_size_histogram"] == {4: 1}
+
+
+def test_partial_batch_flushes_on_the_timer():
+    model = FakeClipModel()
+
+    async def run():
+        batcher = MicroBatcher("test", model.infer_text, max_batch_size=32, max_wait_ms=30)
+        await asyncio.gather(*(batcher.submit(item) for item in token_rows(3)))
+        return batcher
+
+    stats = asyncio.run(run()).stats.snapshot()
+    assert stats["batch_size_histogram"] == {3: 1}
+    assert stats["max_queue_wait_ms"] >= 25
+
+
+def test_requests_beyond_the_batch_size_start_a_new_batch():
+    model = FakeClipModel()
+
+    async def run():
+        batcher = MicroBatcher("test", model.infer_text, max_batch_size=4, max_wait_ms=20)
+        await asyncio.gather(*(batcher.submit(item) for item in token_rows(6)))
+        return batcher
+
+    assert asyncio.run(run()).stats.snapshot()["batch_size_histogram"] == {2: 1, 4: 1}
+    assert model.calls == 2
+
+
+def test_errors_are_delivered_to_every_caller():
+    async def failing(batch):
+        raise RuntimeError("triton unavailable")
+
+    async def run():
+        batcher = MicroBatcher("test", failing, max_batch_size=32, max_wait_ms=10)
+        results = await asyncio.gather(*(batcher.submit(item) for item in token_rows(3)), return_exceptions=True)
+        return batcher, results
+
+    batcher, results = asyncio.run(run())
+    assert all(isinstance(result, RuntimeError) and str(result) == "triton unavailable" for result in results)
+    assert batcher.stats.failed_batches == 1
+
+
+def test_wrong_number_of_output_rows_is_an_error():
+    async def truncated(batch):
+        return np.zeros((batch.shape[0] - 1, 4), dtype=np.float32)
+
+    async def run():
+        batcher = MicroBatcher("test", truncated, max_batch_size=32, max_wait_ms=10)
+        return await asyncio.gather(*(batcher.submit(item) for item in token_rows(2)), return_exceptions=True)
+
+    assert all(isinstance(result, ValueError) for result in asyncio.run(run()))
+
+
+def test_cancelled_submitter_does_not_affect_the_others():
+    model = FakeClipModel(latency_ms=50)
+    items = token_rows(3)
+
+    async def run():
+        batcher = MicroBatcher("test", model.infer_text, max_batch_size=32, max_wait_ms=10)
+        tasks = [asyncio.create_task(batcher.submit(item)) for item in items]
+        await asyncio.sleep(0.03)  # the batch is in flight
+        tasks[0].cancel()
+        done = await asyncio.gather(*tasks, return_exceptions=True)
+        return done
+
+    results = asyncio.run(run())
+    assert isinstance(results[0], asyncio.CancelledError)
+    for item, result in zip(items[1:], results[1:]):
+        np.testing.assert_allclose(result, model.embed_text(item), rtol=1e-6)
+    assert model.calls == 1
+
+
+def test_each_caller_traces_its_own_wait_not_the_batch():
+    model = FakeClipModel(latency_ms=20)
+
+    async def request(batcher, item):
+        token = metrics.start_trace()
+        await batcher.submit(item)
+        return metrics.end_trace(token)
+
+    async def run():
+        batcher = MicroBatcher("test", model.infer_text, max_batch_size=32, max_wait_ms=5)
+        return await asyncio.gather(*(request(batcher, item) for item in token_rows(3)))
+
+    for trace in asyncio.run(run()):
+        assert "batch.test" not in trace
+        assert trace["batch_wait.test"] >= 0.02
+
+
+def test_rejects_invalid_configuration():
+    with pytest.raises(ValueError):
+        MicroBatcher("test", None, max_batch_size=0)
+    with pytest.raises(ValueError):
+        MicroBatcher("test", None, max_wait_ms=-1)
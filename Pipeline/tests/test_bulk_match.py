@@ -0,0 +1,79 @@
+"""
+Tests for the writer side of bulk_match.py: the read-ahead window and resuming a JSONL output.
+"""
+
+import asyncio
+import json
+import pytest
+import bulk_match
+
+
+def listings(tmp_path, count: int) -> str:
+    path = tmp_path / "listings.jsonl"
+    path.write_text("".join(json.dumps({"id": str(i), "text": f"item {i}"}) + "\n" for i in range(count)))
+    return str(path)
+
+
+@pytest.fixture
+def stages(monkeypatch):
+    """
+    Replaces the CLIP, search and MongoDB stages; chunk 0 is held back in decode for 0.2 s.
+    """
+    state = {"decoded": []}
+
+    async def decode_chunk(chunk, executor, args):
+        state["decoded"].append(chunk["index"])
+        if chunk["index"] == 0:
+            await asyncio.sleep(0.2)
+            state["read_while_blocked"] = len(state["decoded"])
+        return chunk
+
+    async def passthrough(chunk, args):
+        return chunk
+
+    async def join_chunk(chunk, args):
+        chunk["rows"] = [{"key": item["key"], "status": "no_match", "matches": []} for item in chunk["items"]]
+        return chunk
+
+    monkeypatch.setattr(bulk_match, "decode_chunk", decode_chunk)
+    monkeypatch.setattr(bulk_match, "embed_chunk", passthrough)
+    monkeypatch.setattr(bulk_match, "search_chunk", passthrough)
+    monkeypatch.setattr(bulk_match, "join_chunk", join_chunk)
+    return state
+
+
+def test_a_slow_chunk_bounds_how_far_the_reader_gets_ahead(tmp_path, stages):
+    output = tmp_path / "matches.jsonl"
+    args = bulk_match.parse_args([
+        "--input", listings(tmp_path, 200), "--output", str(output), "--batch-size", "2",
+        "--concurrency", "4", "--max-pending", "6",
+    ])
+    summary = asyncio.run(bulk_match.bulk_match(args))
+
+    assert stages["read_while_blocked"] <= 6
+    assert summary["processed"] == 200
+    assert [json.loads(line)["key"] for line in output.read_text().splitlines()] == [str(i) for i in range(200)]
+
+
+def test_the_default_window_covers_the_stages_and_queues(tmp_path):
+    args = bulk_match.parse_args(["--input", str(tmp_path), "--output", "out.jsonl", "--concurrency", "3", "--queue-size", "2"])
+    assert args.max_pending == 4 * 3 + 5 * 2
+
+
+def test_resume_continues_after_the_checkpointed_bytes(tmp_path):
+    path = tmp_path / "matches.jsonl"
+    path.write_bytes(b'{"key": "0"}\n{"key": "partial')
+    sink = bulk_match.JsonlSink(str(path), {"output_bytes": 13})
+    sink.write([{"key": "1"}])
+    sink.commit()
+    sink.close()
+    assert path.read_text().splitlines() == ['{"key": "0"}', '{"key": "1"}']
+
+
+@pytest.mark.parametrize("contents", [None, b'{"key'], ids=["missing", "truncated"])
+def test_resume_without_the_checkpointed_output_is_an_error(tmp_path, contents):
+    path = tmp_path / "matches.jsonl"
+    if contents is not None:
+        path.write_bytes(contents)
+    with pytest.raises(ValueError, match="--restart"):
+        bulk_match.JsonlSink(str(path), {"output_bytes": 13})
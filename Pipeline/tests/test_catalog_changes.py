@@ -0,0 +1,73 @@
+"""
+Tests for the catalog change log (db/mongodb_client.py) and how product_matching.py applies it
+to its caches, against mongomock-motor.
+"""
+
+import asyncio
+import numpy as np
+import pytest
+import product_matching
+from db import mongodb_client
+
+
+@pytest.fixture
+def caches(monkeypatch):
+    monkeypatch.setattr(product_matching, "_catalog_version", None)
+    product_matching.invalidate_catalog()
+    yield product_matching.product_cache
+    product_matching.invalidate_catalog()
+
+
+def test_changes_are_recorded_under_increasing_versions(mongo):
+    async def run():
+        await mongodb_client.ensure_indexes()
+        initial = await mongodb_client.get_catalog_version()
+        first = await mongodb_client.record_catalog_change(["1", "2", "1"])
+        second = await mongodb_client.record_catalog_change()
+        return initial, first, second, await mongodb_client.get_catalog_version(), await mongodb_client.get_catalog_changes(1)
+
+    initial, first, second, current, since_first = asyncio.run(run())
+    assert (initial, first, second, current) == (0, 1, 2, 2)
+    assert since_first == [{"version": 2, "product_ids": None}]
+
+
+def test_large_changes_are_recorded_as_full_catalog_changes(mongo, monkeypatch):
+    monkeypatch.setattr(mongodb_client, "CATALOG_CHANGE_MAX_IDS", 2)
+
+    async def run():
+        await mongodb_client.record_catalog_change(["1", "2", "3"])
+        return await mongodb_client.get_catalog_changes(0)
+
+    assert asyncio.run(run()) == [{"version": 1, "product_ids": None}]
+
+
+def test_applied_changes_invalidate_only_the_changed_products(mongo, caches):
+    caches.set("a", [], tags=("1",))
+    caches.set("b", [], tags=("2",))
+
+    async def run():
+        applied = [await product_matching.apply_catalog_changes()]  # records the starting version
+        await mongodb_client.record_catalog_change(["1"])
+        applied.append(await product_matching.apply_catalog_changes())
+        applied.append(await product_matching.apply_catalog_changes())
+        return applied
+
+    assert asyncio.run(run()) == [0, 1, 0]
+    assert caches.get("a") is None
+    assert caches.get("b") == []
+
+
+def test_missing_versions_clear_every_cache(mongo, caches):
+    caches.set("a", [], tags=("1",))
+    product_matching.text_semantic_cache.add(np.ones(4, dtype=np.float32), (5, []), tags=("2",))
+
+    async def run():
+        await product_matching.apply_catalog_changes()
+        await mongodb_client.record_catalog_change(["3"])
+        await mongo[mongodb_client.CATALOG_CHANGES_COLLECTION].delete_many({})  # expired from the log
+        await mongodb_client.record_catalog_change(["4"])
+        return await product_matching.apply_catalog_changes()
+
+    assert asyncio.run(run()) == 1
+    assert caches.get("a") is None
+    assert product_matching.text_semantic_cache.snapshot()["entries"] == 0
@@ -0,0 +1,45 @@
+"""
+Tests for input validation in clip_inference.py (no Triton needed: invalid inputs fail before
+inference).
+"""
+
+import asyncio
+import io
+import threading
+import numpy as np
+import pytest
+from PIL import Image
+import clip_inference
+
+
+def png_bytes(width: int = 64, height: int = 48) -> bytes:
+    buffer = io.BytesIO()
+    Image.fromarray(np.zeros((height, width, 3), dtype=np.uint8)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("data", [b"not an image", png_bytes()[:40]], ids=["garbage", "truncated"])
+def test_undecodable_uploads_are_input_errors(data):
+    with pytest.raises(ValueError, match="Image preprocessing failed"):
+        asyncio.run(clip_inference.get_clip_visual_embedding(data))
+
+
+def test_uploads_are_decoded_and_preprocessed_off_the_event_loop(monkeypatch):
+    threads = []
+    original = clip_inference.preprocess_image
+
+    def recording(image):
+        threads.append(threading.current_thread())
+        return original(image)
+
+    async def infer(image_data):
+        return np.ones((image_data.shape[0], 4), dtype=np.float32)
+
+    monkeypatch.setattr(clip_inference, "preprocess_image", recording)
+    monkeypatch.setattr(clip_inference, "USE_MICRO_BATCHING", False)
+    monkeypatch.setattr(clip_inference, "EMBEDDING_CACHE_ENABLED", False)
+    monkeypatch.setattr(clip_inference, "_infer_visual", infer)
+
+    embedding = asyncio.run(clip_inference.get_clip_visual_embedding(png_bytes()))
+    assert embedding.shape == (1, 4)
+    assert threads and threads[0] is not threading.main_thread()
@@ -0,0 +1,84 @@
+"""
+Tests for query-time variant collapsing (utils/dedup.collapse_hits and DEDUP_COLLAPSE_VARIANTS in
+product_matching.py).
+"""
+
+import asyncio
+import numpy as np
+import pytest
+import product_matching
+from db import mongodb_client, search_backend
+from utils.dedup import collapse_hits
+from utils.lazy import Lazy
+
+# One cluster {"1", "2"} with canonical "1", plus an unrelated product "3".
+PRODUCTS = [
+    {"id": "1", "name": "Headphones (Black)", "brand": "Sony", "price": 399.0},
+    {"id": "2", "name": "Headphones (Beige)", "brand": "Sony", "price": 299.0},
+    {"id": "3", "name": "Speaker", "brand": "JBL", "price": 99.0},
+]
+CANONICAL_OF = {"1": "1", "2": "1"}
+
+
+class PayloadBackend(search_backend.SearchBackend):
+    """
+    Returns fixed ranked hits, minus those whose payload fails the filters or min_score.
+    Supports exact matches and {"lte": x} ranges.
+    """
+
+    name = "test"
+
+    def __init__(self, hits: list):
+        self.hits = hits
+
+    async def search(self, embedding, collection, top_k=5, min_score=None, filters=None):
+        payloads = {product["id"]: product for product in PRODUCTS}
+
+        def passes(product_id):
+            for field, condition in (filters or {}).items():
+                value = payloads[product_id][field]
+                if isinstance(condition, dict) and value > condition["lte"]:
+                    return False
+                if not isinstance(condition, dict) and value != condition:
+                    return False
+            return True
+
+        return [(score, product_id) for score, product_id in self.hits
+                if passes(product_id) and (min_score is None or score >= min_score)][:top_k]
+
+
+@pytest.fixture
+def collapsing(mongo, monkeypatch):
+    asyncio.run(mongo[mongodb_client.COLLECTION_NAME].insert_many([dict(product) for product in PRODUCTS]))
+    monkeypatch.setattr(product_matching, "DEDUP_COLLAPSE_VARIANTS", True)
+    monkeypatch.setattr(product_matching, "canonical_products", Lazy(lambda: CANONICAL_OF, "test_dedup_clusters"))
+    product_matching.invalidate_catalog()
+
+    def use(hits):
+        monkeypatch.setattr(search_backend, "_backend", PayloadBackend(hits))
+
+    yield use
+    product_matching.invalidate_catalog()
+
+
+def test_collapse_keeps_the_best_ranked_member_of_each_cluster():
+    hits = [(0.95, "2"), (0.9, "1"), (0.8, "3")]
+    assert collapse_hits(hits, CANONICAL_OF) == [(0.95, "2"), (0.8, "3")]
+    # Products outside every cluster are kept as they are.
+    assert collapse_hits([(0.9, "3"), (0.8, "4")], CANONICAL_OF) == [(0.9, "3"), (0.8, "4")]
+
+
+def test_collapsed_results_respect_filters_and_min_score(collapsing):
+    collapsing([(0.95, "1"), (0.9, "2"), (0.5, "3")])
+    embedding = np.ones(8, dtype=np.float32)
+
+    async def run():
+        filtered = await product_matching.match_products_by_text(embedding, top_k=5, filters={"price": {"lte": 350}})
+        unfiltered = await product_matching.match_products_by_text(embedding, top_k=5, min_score=0.6)
+        return filtered, unfiltered
+
+    filtered, unfiltered = asyncio.run(run())
+    # The canonical "1" costs 399, so the cheaper variant "2" represents the cluster.
+    assert [(score, product["id"]) for score, product in filtered] == [(0.9, "2"), (0.5, "3")]
+    assert all(product["price"] <= 350 for _, product in filtered)
+    assert [(score, product["id"]) for score, product in unfiltered] == [(0.95, "1")]
@@ -0,0 +1,93 @@
+"""
+Parity tests of utils/image_preprocessing.py against Hugging Face's CLIPImageProcessor (default
+config, i.e. openai/clip-vit-base-patch32 preprocessing; needs no download).
+"""
+
+import glob
+import io
+import os
+import numpy as np
+import pytest
+from PIL import Image
+from utils.image_preprocessing import ClipImagePreprocessor
+
+transformers = pytest.importorskip("transformers")
+
+DATASET_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "Dataset")
+
+# (mode, width, height): landscape, portrait, square, exact size, smaller than the crop, and
+# inputs that need a colour conversion.
+CASES = [
+    ("RGB", 640, 480),
+    ("RGB", 300, 900),
+    ("RGB", 224, 224),
+    ("RGB", 100, 60),
+    ("RGBA", 500, 500),
+    ("L", 333, 222),
+    ("P", 256, 300),
+]
+
+
+@pytest.fixture(scope="module")
+def reference():
+    processor = transformers.CLIPImageProcessor()
+    return lambda image: processor(images=image, return_tensors="np")["pixel_values"]
+
+
+def random_image(mode: str, width: int, height: int, seed: int = 0) -> Image.Image:
+    pixels = np.random.default_rng(seed).integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+    return Image.fromarray(pixels).convert(mode)
+
+
+@pytest.mark.parametrize("mode,width,height", CASES)
+def test_matches_clip_image_processor(reference, mode, width, height):
+    image = random_image(mode, width, height)
+    expected = reference(image)
+
+    ours = ClipImagePreprocessor(dtype=np.float32).preprocess(image)
+    assert ours.shape == (1, 3, 224, 224)
+    np.testing.assert_allclose(ours, expected, rtol=0, atol=1e-6)
+
+    # The float16 buffer sent to clip_visual equals the reference cast to float16.
+    half = ClipImagePreprocessor().preprocess(image)
+    assert half.dtype == np.float16
+    np.testing.assert_array_equal(half, expected.astype(np.float16))
+
+
+def test_matches_clip_image_processor_on_dataset_photos(reference):
+    paths = sorted(glob.glob(os.path.join(DATASET_DIR, "*.jpg")))[:3]
+    if not paths:
+        pytest.skip("Dataset images not found.")
+    engine = ClipImagePreprocessor(dtype=np.float32)
+    for path in paths:
+        with Image.open(path) as image:
+            np.testing.assert_allclose(engine.preprocess(image), reference(image), rtol=0, atol=1e-6)
+
+
+def test_batch_bytes_and_threads_match_single_images():
+    images = [random_image(mode, width, height, seed=i) for i, (mode, width, height) in enumerate(CASES)]
+    encoded = []
+    for image in images:
+        buffer = io.BytesIO()
+        image.convert("RGB").save(buffer, format="PNG")
+        encoded.append(buffer.getvalue())
+
+    engine = ClipImagePreprocessor()
+    singles = np.concatenate([engine.preprocess(image) for image in images])
+    np.testing.assert_array_equal(engine.preprocess_batch(images), singles)
+
+    threaded = ClipImagePreprocessor(num_workers=4)
+    try:
+        out = threaded.allocate(len(encoded))
+        assert threaded.preprocess_batch(encoded, out=out) is out
+        np.testing.assert_array_equal(out, singles)
+    finally:
+        threaded.close()
+
+
+def test_rejects_wrong_buffer_and_input_type():
+    engine = ClipImagePreprocessor()
+    with pytest.raises(ValueError):
+        engine.preprocess(random_image("RGB", 64, 64), out=np.empty((1, 3, 224, 224), dtype=np.float32))
+    with pytest.raises(ValueError):
+        engine.preprocess(12345)
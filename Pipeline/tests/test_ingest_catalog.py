@@ -0,0 +1,31 @@
+"""
+Tests for the per-record helpers of ingest_catalog.py.
+"""
+
+import io
+import numpy as np
+import pytest
+from PIL import Image
+from ingest_catalog import decode_image
+
+
+def jpeg_bytes(mode: str = "RGB") -> bytes:
+    buffer = io.BytesIO()
+    Image.fromarray(np.full((40, 60, 3), 128, dtype=np.uint8)).convert(mode).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("mode", ["RGB", "L", "CMYK"])
+def test_readable_images_are_decoded_to_rgb(mode):
+    image = decode_image(jpeg_bytes(mode))
+    assert image.mode == "RGB" and image.size == (60, 40)
+
+
+@pytest.mark.parametrize("data", [b"", b"not an image", jpeg_bytes()[:100]], ids=["empty", "garbage", "truncated"])
+def test_unreadable_images_are_reported_as_none(data):
+    assert decode_image(data) is None
+
+
+def test_decompression_bombs_are_reported_as_none(monkeypatch):
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 100)  # 2x the limit raises DecompressionBombError
+    assert decode_image(jpeg_bytes()) is None
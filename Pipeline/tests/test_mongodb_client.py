@@ -0,0 +1,84 @@
+"""
+Tests for the bulk product lookups of db/mongodb_client.py, against mongomock-motor.
+"""
+
+import asyncio
+import pytest
+from db import mongodb_client
+
+PRODUCTS = [
+    {"id": str(i), "SKU": f"SKU-{i}", "name": f"Product {i}", "brand": "Acme", "price": 10.0 + i,
+     "text": "long embedding text " * 50}
+    for i in range(1, 8)
+]
+
+
+@pytest.fixture
+def products(mongo):
+    asyncio.run(mongo[mongodb_client.COLLECTION_NAME].insert_many([dict(product) for product in PRODUCTS]))
+    return mongo[mongodb_client.COLLECTION_NAME]
+
+
+def test_order_is_preserved_across_in_query_chunks(products, monkeypatch):
+    monkeypatch.setattr(mongodb_client, "IN_QUERY_BATCH_SIZE", 2)
+    chunks = []
+    fetch = mongodb_client._fetch_products
+
+    async def recording(product_ids, projection):
+        chunks.append(list(product_ids))
+        return await fetch(product_ids, projection)
+
+    monkeypatch.setattr(mongodb_client, "_fetch_products", recording)
+    ids = ["7", "3", "5", "1", "6", "2", "4"]
+    documents = asyncio.run(mongodb_client.get_products(ids))
+    assert [document["id"] for document in documents] == ids
+    assert chunks == [["7", "3"], ["5", "1"], ["6", "2"], ["4"]]
+
+
+def test_missing_ids_return_none_in_place(products):
+    documents = asyncio.run(mongodb_client.get_products(["2", "missing", "1", "2"]))
+    assert [document and document["id"] for document in documents] == ["2", None, "1", "2"]
+
+
+def test_projection_is_applied(products):
+    async def run():
+        default = await mongodb_client.get_products(["1"])
+        names = await mongodb_client.get_products(["1"], projection={"_id": 0, "name": 1})
+        full = await mongodb_client.get_products(["1"], projection=None)
+        return default[0], names[0], full[0]
+
+    default, names, full = asyncio.run(run())
+    assert set(default) == {"id", "SKU", "name", "brand", "price"}  # no _id, no long text field
+    assert names == {"id": "1", "name": "Product 1"}  # `id` is always kept to match documents
+    assert "text" in full and "_id" in full
+
+
+def test_cached_documents_are_served_as_copies(products):
+    hits = mongodb_client.product_doc_cache.stats.hits
+
+    async def run():
+        first = (await mongodb_client.get_products(["1"]))[0]
+        first["name"] = "mutated"
+        await products.delete_many({})  # later calls can only be answered from the cache
+        return first, (await mongodb_client.get_products(["1"]))[0], (await mongodb_client.get_products(["1"]))[0]
+
+    first, second, third = asyncio.run(run())
+    assert second["name"] == "Product 1"
+    assert second is not third
+    assert mongodb_client.product_doc_cache.stats.hits == hits + 2
+
+
+def test_invalidated_products_are_fetched_again(products):
+    async def run():
+        await mongodb_client.get_products(["1"])
+        await products.update_one({"id": "1"}, {"$set": {"name": "Renamed"}})
+        mongodb_client.invalidate_products(["1"])
+        return (await mongodb_client.get_products(["1"]))[0]
+
+    assert asyncio.run(run())["name"] == "Renamed"
+
+
+def test_ensure_indexes_creates_the_id_index(mongo):
+    asyncio.run(mongodb_client.ensure_indexes())
+    indexes = asyncio.run(mongo[mongodb_client.COLLECTION_NAME].index_information())
+    assert indexes["id_1"]["key"] == [("id", 1)]
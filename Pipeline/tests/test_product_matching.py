@@ -0,0 +1,143 @@
+"""
+Tests for product_matching.py, with a fixed search backend and mongomock-motor for MongoDB.
+"""
+
+import asyncio
+import numpy as np
+import pytest
+import product_matching
+from db import mongodb_client, search_backend
+
+PRODUCTS = [{"id": str(i), "name": f"Product {i}", "price": 10.0 * i} for i in range(1, 6)]
+
+
+class FixedBackend(search_backend.SearchBackend):
+    """
+    Returns the same ranked hits for every query and counts the searches.
+    """
+
+    name = "test"
+
+    def __init__(self, hits: list):
+        self.hits = hits
+        self.searches = 0
+
+    async def search(self, embedding, collection, top_k=5, min_score=None, filters=None):
+        self.searches += 1
+        await asyncio.sleep(0.01)
+        return self.hits[:top_k]
+
+
+@pytest.fixture
+def backend(mongo, monkeypatch):
+    asyncio.run(mongo[mongodb_client.COLLECTION_NAME].insert_many([dict(product) for product in PRODUCTS]))
+    fixed = FixedBackend([(0.9, "1"), (0.8, "2"), (0.7, "3")])
+    monkeypatch.setattr(search_backend, "_backend", fixed)
+    product_matching.invalidate_catalog()
+    yield fixed
+    product_matching.invalidate_catalog()
+
+
+def query(seed: int = 0) -> np.ndarray:
+    vector = np.random.default_rng(seed).standard_normal((1, 8)).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def mutate(results: list):
+    results.sort(key=lambda result: result[1]["name"], reverse=True)
+    for _, product in results:
+        product["name"] = "mutated"
+        product.pop("price")
+
+
+@pytest.mark.parametrize("kind", ["text", "visual"])
+def test_cached_results_are_returned_as_copies(backend, kind):
+    match = product_matching.match_products_by_text if kind == "text" else product_matching.match_products_by_visual
+    embedding = query()
+
+    async def run():
+        mutate(await match(embedding, top_k=3))
+        exact = await match(embedding, top_k=3)
+        mutate(exact)
+        near = await match(embedding * 1.0001, top_k=2)  # near-duplicate tier for visual queries
+        return await match(embedding, top_k=3), near
+
+    again, near = asyncio.run(run())
+    assert backend.searches == (1 if kind == "visual" else 2)
+    assert [(score, product["id"], product["name"]) for score, product in again] == [
+        (0.9, "1", "Product 1"), (0.8, "2", "Product 2"), (0.7, "3", "Product 3"),
+    ]
+    assert all("price" in product for _, product in again + near)
+
+
+def test_coalesced_callers_get_their_own_copies(backend):
+    embedding = query(1)
+
+    async def run():
+        return await asyncio.gather(*(product_matching.match_products_by_text(embedding, top_k=3) for _ in range(3)))
+
+    first, second, third = asyncio.run(run())
+    assert backend.searches == 1
+    mutate(first)
+    assert second == third
+    assert second[0][1]["name"] == "Product 1" and second[0][1] is not third[0][1]
+
+
+VISUAL_HITS = [(0.9, "a"), (0.8, "b"), (0.5, "c")]
+TEXT_HITS = [(0.7, "b"), (0.6, "d"), (0.4, "a")]
+
+
+def test_rrf_fusion_sums_reciprocal_ranks():
+    fused = product_matching.fuse_results(VISUAL_HITS, TEXT_HITS, fusion="rrf", visual_weight=0.5, rrf_k=60)
+    expected = {
+        "a": 0.5 / 61 + 0.5 / 63,
+        "b": 0.5 / 62 + 0.5 / 61,
+        "c": 0.5 / 63,
+        "d": 0.5 / 62,
+    }
+    assert [product_id for _, product_id in fused] == ["b", "a", "d", "c"]
+    assert {product_id: score for score, product_id in fused} == pytest.approx(expected)
+
+
+def test_weighted_fusion_sums_weighted_scores():
+    fused = product_matching.fuse_results(VISUAL_HITS, TEXT_HITS, fusion="weighted", visual_weight=0.25)
+    expected = {
+        "a": 0.25 * 0.9 + 0.75 * 0.4,
+        "b": 0.25 * 0.8 + 0.75 * 0.7,
+        "c": 0.25 * 0.5,
+        "d": 0.75 * 0.6,
+    }
+    assert [product_id for _, product_id in fused] == ["b", "a", "d", "c"]
+    assert {product_id: score for score, product_id in fused} == pytest.approx(expected)
+
+
+@pytest.mark.parametrize("fusion", ["rrf", "weighted"])
+@pytest.mark.parametrize("visual_weight, leading", [(1.0, VISUAL_HITS), (0.0, TEXT_HITS)])
+def test_a_zero_weight_branch_does_not_change_the_ranking(fusion, visual_weight, leading):
+    fused = product_matching.fuse_results(VISUAL_HITS, TEXT_HITS, fusion=fusion, visual_weight=visual_weight)
+    ranked = [product_id for score, product_id in fused if score > 0]
+    assert ranked == [product_id for _, product_id in leading]
+    # Products only found by the zero-weight branch are still returned, with a score of 0.
+    assert {product_id for _, product_id in fused} == {"a", "b", "c", "d"}
+
+
+@pytest.mark.parametrize("fusion", ["rrf", "weighted"])
+def test_a_product_in_one_branch_scores_only_that_branch(fusion):
+    fused = dict((product_id, score) for score, product_id in product_matching.fuse_results(
+        [(0.9, "visual-only")], [(0.8, "text-only")], fusion=fusion, visual_weight=0.7, rrf_k=60))
+    if fusion == "rrf":
+        assert fused == pytest.approx({"visual-only": 0.7 / 61, "text-only": 0.3 / 61})
+    else:
+        assert fused == pytest.approx({"visual-only": 0.7 * 0.9, "text-only": 0.3 * 0.8})
+
+
+def test_unknown_fusion_is_rejected():
+    with pytest.raises(ValueError, match="Unknown fusion method"):
+        product_matching.fuse_results(VISUAL_HITS, TEXT_HITS, fusion="max")
+
+
+@pytest.mark.parametrize("params", [{"fusion": "max"}, {"visual_weight": 1.5}, {"visual_weight": -0.1}])
+def test_hybrid_match_rejects_bad_fusion_parameters_before_searching(backend, params):
+    with pytest.raises(ValueError):
+        asyncio.run(product_matching.match_product_hybrid(b"not an image", "red shoes", **params))
+    assert backend.searches == 0
@@ -0,0 +1,181 @@
+"""
+Tests for the embedded backend of db/search_backend.py: its exact, IVF and compressed rankings
+against brute force (np.argsort(-X @ q)) on a seeded snapshot.
+"""
+
+import json
+import os
+import numpy as np
+import pytest
+from db.search_backend import EmbeddedCollection, build_compressed, build_ivf
+
+N, DIM, CLUSTERS = 3000, 64, 40
+BRANDS = ("Acme", "Globex", "Initech")
+QUERIES = 50
+TOP_K = 10
+# Minimum mean recall@TOP_K of IVF search at the default nprobe (8 of ~55 lists).
+IVF_MIN_RECALL = 0.9
+# Minimum mean recall@TOP_K of each compressed mode after rescoring the best
+# TOP_K * EMBEDDED_RESCORE_MULTIPLIER candidates with the float32 vectors.
+COMPRESSED_MIN_RECALL = {
+    "int8": 0.99,
+    "binary": 0.95,
+    "pca": 0.95,
+    "pca_int8": 0.95,
+    "pca_binary": 0.9,
+}
+COMPRESSION_MODES = {
+    "int8": {"quantization": "int8"},
+    "binary": {"quantization": "binary"},
+    "pca": {"quantization": None, "reduction": "pca", "dim": 16},
+    "pca_int8": {"quantization": "int8", "reduction": "pca", "dim": 16},
+    "pca_binary": {"quantization": "binary", "reduction": "pca", "dim": 32},
+}
+
+
+def clustered_vectors(n: int, dim: int, clusters: int, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim))
+    vectors = centers[rng.integers(clusters, size=n)] + 0.6 * rng.standard_normal((n, dim))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def write_snapshot(directory, vectors: np.ndarray) -> list:
+    payloads = [{"id": str(i), "brand": BRANDS[i % len(BRANDS)], "price": float(i % 100)} for i in range(len(vectors))]
+    np.save(os.path.join(directory, "vectors.npy"), vectors)
+    with open(os.path.join(directory, "payloads.json"), "w", encoding="utf-8") as f:
+        json.dump(payloads, f)
+    return payloads
+
+
+@pytest.fixture(scope="module")
+def snapshot(tmp_path_factory):
+    directory = str(tmp_path_factory.mktemp("products_visual"))
+    vectors = clustered_vectors(N, DIM, CLUSTERS, seed=0)
+    payloads = write_snapshot(directory, vectors)
+    return directory, vectors, payloads
+
+
+def queries_near(vectors: np.ndarray, count: int, seed: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    picked = vectors[rng.choice(len(vectors), size=count, replace=False)]
+    noisy = picked + 0.3 * rng.standard_normal(picked.shape) / np.sqrt(vectors.shape[1])
+    return (noisy / np.linalg.norm(noisy, axis=1, keepdims=True)).astype(np.float32)
+
+
+def brute_force(vectors: np.ndarray, query: np.ndarray, top_k: int, mask: np.ndarray = None) -> list:
+    scores = vectors @ query
+    if mask is not None:
+        scores = np.where(mask, scores, -np.inf)
+    order = np.argsort(-scores, kind="stable")[:top_k]
+    return [str(i) for i in order if np.isfinite(scores[i])]
+
+
+def matches(payload: dict, filters: dict) -> bool:
+    for field, condition in filters.items():
+        value = payload[field]
+        if isinstance(condition, dict):
+            if not (condition.get("gte", -np.inf) <= value <= condition.get("lte", np.inf)
+                    and condition.get("gt", -np.inf) < value < condition.get("lt", np.inf)):
+                return False
+        elif value not in (condition if isinstance(condition, list) else [condition]):
+            return False
+    return True
+
+
+def ids(hits: list) -> list:
+    return [product_id for _, product_id in hits]
+
+
+def test_exact_search_matches_brute_force(snapshot):
+    directory, vectors, _ = snapshot
+    collection = EmbeddedCollection(directory, mode="exact")
+    for query in queries_near(vectors, QUERIES, seed=1):
+        hits = collection.search(query, TOP_K)
+        assert ids(hits) == brute_force(vectors, query, TOP_K)
+        np.testing.assert_allclose([score for score, _ in hits], np.sort(vectors @ query)[::-1][:TOP_K], rtol=1e-5)
+
+
+def test_top_k_larger_than_the_collection_returns_everything_ranked(snapshot):
+    directory, vectors, _ = snapshot
+    query = queries_near(vectors, 1, seed=2)[0]
+    hits = EmbeddedCollection(directory, mode="exact").search(query, N + 50)
+    assert ids(hits) == brute_force(vectors, query, N)
+
+
+def test_ties_keep_row_order_and_the_cut_off_keeps_the_best_scores(tmp_path):
+    vectors = clustered_vectors(200, 16, 5, seed=3)
+    vectors[[10, 50, 120, 170]] = vectors[7]  # five identical rows
+    write_snapshot(str(tmp_path), vectors)
+    collection = EmbeddedCollection(str(tmp_path), mode="exact")
+
+    hits = collection.search(vectors[7], 5)
+    assert ids(hits) == ["7", "10", "50", "120", "170"]
+    # Cutting inside the tie returns tied rows in row order, with the same scores as brute force.
+    hits = collection.search(vectors[7], 3)
+    assert [score for score, _ in hits] == pytest.approx([float(vectors[7] @ vectors[7])] * 3)
+    assert ids(hits) == sorted(ids(hits), key=int)
+
+
+@pytest.mark.parametrize("filters", [
+    {"brand": "Acme"},
+    {"brand": ["Globex", "Initech"]},
+    {"price": {"gte": 20, "lt": 40}},
+    {"brand": "Initech", "price": {"lte": 10}},
+    {"brand": "Unknown"},
+], ids=["match", "match_any", "range", "combined", "no_match"])
+def test_filtered_search_matches_brute_force_on_the_matching_rows(snapshot, filters):
+    directory, vectors, payloads = snapshot
+    mask = np.array([matches(payload, filters) for payload in payloads])
+    collection = EmbeddedCollection(directory, mode="exact")
+    for query in queries_near(vectors, 10, seed=4):
+        assert ids(collection.search(query, TOP_K, filters=filters)) == brute_force(vectors, query, TOP_K, mask)
+
+
+def test_min_score_drops_weaker_hits(snapshot):
+    directory, vectors, _ = snapshot
+    query = queries_near(vectors, 1, seed=5)[0]
+    cutoff = float(np.sort(vectors @ query)[::-1][4])
+    hits = EmbeddedCollection(directory, mode="exact").search(query, TOP_K, min_score=cutoff)
+    assert ids(hits) == brute_force(vectors, query, 5)
+
+
+def test_ivf_recall_at_the_default_nprobe(tmp_path):
+    vectors = clustered_vectors(N, DIM, CLUSTERS, seed=0)
+    write_snapshot(str(tmp_path), vectors)
+    build_ivf(str(tmp_path))
+    collection = EmbeddedCollection(str(tmp_path), mode="ivf")
+
+    recalls = []
+    for query in queries_near(vectors, QUERIES, seed=6):
+        hits = collection.search(query, TOP_K)
+        scores = [score for score, _ in hits]
+        assert scores == sorted(scores, reverse=True)
+        recalls.append(len(set(ids(hits)) & set(brute_force(vectors, query, TOP_K))) / TOP_K)
+    assert np.mean(recalls) >= IVF_MIN_RECALL
+
+
+def test_ivf_with_every_list_probed_is_exact(tmp_path):
+    vectors = clustered_vectors(1000, DIM, 10, seed=7)
+    write_snapshot(str(tmp_path), vectors)
+    build_ivf(str(tmp_path), nlist=16)
+    collection = EmbeddedCollection(str(tmp_path), mode="ivf", nprobe=16)
+    for query in queries_near(vectors, 10, seed=8):
+        assert ids(collection.search(query, TOP_K)) == brute_force(vectors, query, TOP_K)
+
+
+@pytest.mark.parametrize("mode", list(COMPRESSION_MODES))
+def test_compressed_search_with_rescoring_recalls_the_exact_top_k(tmp_path, mode):
+    vectors = clustered_vectors(N, DIM, CLUSTERS, seed=0)
+    write_snapshot(str(tmp_path), vectors)
+    build_compressed(str(tmp_path), **COMPRESSION_MODES[mode])
+    collection = EmbeddedCollection(str(tmp_path), mode="compressed")
+
+    recalls = []
+    for query in queries_near(vectors, QUERIES, seed=9):
+        hits = collection.search(query, TOP_K)
+        # Returned scores are the rescored float32 ones, not the approximate first pass.
+        exact = vectors @ query
+        np.testing.assert_allclose([score for score, _ in hits], [exact[int(i)] for i in ids(hits)], rtol=1e-5)
+        recalls.append(len(set(ids(hits)) & set(brute_force(vectors, query, TOP_K))) / TOP_K)
+    assert np.mean(recalls) >= COMPRESSED_MIN_RECALL[mode]
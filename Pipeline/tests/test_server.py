@@ -0,0 +1,118 @@
+"""
+Tests for the status codes of server.py: invalid input is a 422 and a failure on the server's
+side is a 500, on every /match route. Embedding and matching functions are replaced where a
+test would otherwise need Triton or Qdrant.
+"""
+
+import numpy as np
+import pytest
+
+testclient = pytest.importorskip("fastapi.testclient")
+pytest.importorskip("multipart")
+
+import product_matching  # noqa: E402
+import server  # noqa: E402
+
+EMBEDDING = np.full((1, 8), 1 / np.sqrt(8), dtype=np.float32)
+BAD_RANGE = {"price": {"between": [1, 2]}}
+
+
+@pytest.fixture
+def client(mongo, monkeypatch):
+    monkeypatch.setattr(server, "WARM_UP_ON_STARTUP", False)
+    with testclient.TestClient(server.app) as test_client:
+        yield test_client
+
+
+@pytest.fixture
+def embeddings(monkeypatch):
+    """
+    Answers text embedding requests with EMBEDDING instead of calling Triton.
+    """
+    async def embed(text):
+        return EMBEDDING
+
+    async def embed_many(texts, batch_size=None):
+        return np.repeat(EMBEDDING, len(texts), axis=0)
+
+    monkeypatch.setattr(server, "get_clip_text_embedding", embed)
+    monkeypatch.setattr(product_matching, "get_clip_text_embedding", embed)
+    monkeypatch.setattr(server, "embed_texts", embed_many)
+
+
+async def failing(*args, **kwargs):
+    raise RuntimeError("qdrant unavailable")
+
+
+def upload(data: bytes = b"not an image"):
+    return {"file": ("upload.jpg", data, "image/jpeg")}
+
+
+def test_blank_text_is_422(client):
+    # Rejected by the tokenizer step of the real get_clip_text_embedding, before Triton.
+    assert client.post("/match/text", json={"text": "   "}).status_code == 422
+
+
+@pytest.mark.parametrize("body", [
+    {"text": "headphones", "top_k": 0},
+    {"text": "headphones", "filters": BAD_RANGE},
+    {"text": "headphones", "filters": {"price": {"gte": "cheap"}}},
+], ids=["top_k", "range_key", "range_value"])
+def test_text_input_errors_are_422(client, embeddings, body):
+    assert client.post("/match/text", json=body).status_code == 422
+
+
+def test_text_failures_are_500(client, embeddings, monkeypatch):
+    monkeypatch.setattr(server, "match_products_by_text", failing)
+    assert client.post("/match/text", json={"text": "headphones"}).status_code == 500
+
+
+@pytest.mark.parametrize("form", [{}, {"filters": "not json"}], ids=["undecodable", "filters"])
+def test_image_input_errors_are_422(client, form):
+    assert client.post("/match/image", files=upload(), data=form).status_code == 422
+
+
+def test_image_failures_are_500(client, monkeypatch):
+    monkeypatch.setattr(server, "get_clip_visual_embedding", failing)
+    assert client.post("/match/image", files=upload()).status_code == 500
+
+
+@pytest.mark.parametrize("form", [
+    {"text": "headphones"},
+    {"text": "headphones", "fusion": "max"},
+    {"text": "headphones", "visual_weight": "1.5"},
+], ids=["undecodable", "fusion", "visual_weight"])
+def test_hybrid_input_errors_are_422(client, embeddings, form):
+    assert client.post("/match/hybrid", files=upload(), data=form).status_code == 422
+
+
+def test_hybrid_failures_are_500(client, monkeypatch):
+    monkeypatch.setattr(server, "match_product_hybrid", failing)
+    assert client.post("/match/hybrid", files=upload(), data={"text": "headphones"}).status_code == 500
+
+
+@pytest.mark.parametrize("body", [
+    {"texts": ["headphones", " "]},
+    {"texts": ["headphones"], "top_k": 0},
+    {"texts": ["headphones"], "filters": BAD_RANGE},
+    {"texts": ["headphones"], "images": ["aGk="]},
+    {"images": ["not base64!"]},
+    {"images": ["aGk="]},  # valid base64, not an image
+], ids=["blank_text", "top_k", "filters", "both", "base64", "undecodable"])
+def test_batch_input_errors_are_422(client, embeddings, body):
+    assert client.post("/match/batch", json=body).status_code == 422
+
+
+def test_batch_failures_are_500(client, embeddings, monkeypatch):
+    monkeypatch.setattr(server, "embed_texts", failing)
+    assert client.post("/match/batch", json={"texts": ["headphones"]}).status_code == 500
+
+
+def test_batch_returns_one_result_list_per_item(client, embeddings, monkeypatch):
+    async def match(embedding, top_k=5, min_score=None, filters=None):
+        return [(0.9, {"id": "1"})]
+
+    monkeypatch.setattr(server, "match_products_by_text", match)
+    response = client.post("/match/batch", json={"texts": ["headphones", "speaker"]})
+    assert response.status_code == 200
+    assert response.json() == {"results": [[{"score": 0.9, "product": {"id": "1"}}]] * 2}
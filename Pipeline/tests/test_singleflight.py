@@ -0,0 +1,147 @@
+"""
+Tests for utils/singleflight.py.
+"""
+
+import asyncio
+from utils import metrics
+from utils.singleflight import SingleFlight
+
+
+def counting(result=None, delay: float = 0.02, error: Exception = None):
+    """
+    Returns (fn, calls): fn() starts a coroutine that sleeps, then returns `result` or raises
+    `error`; calls[0] counts how many were started.
+    """
+    calls = [0]
+
+    def fn():
+        calls[0] += 1
+
+        async def work():
+            await asyncio.sleep(delay)
+            if error is not None:
+                raise error
+            return result
+
+        return work()
+
+    return fn, calls
+
+
+def test_concurrent_identical_keys_share_one_call():
+    flights = SingleFlight("test")
+    fn, calls = counting(result={"value": 42})
+
+    async def run():
+        return await asyncio.gather(*(flights.do("key", fn) for _ in range(20)))
+
+    results = asyncio.run(run())
+    assert calls[0] == 1
+    assert all(result is results[0] for result in results)
+    assert flights.stats.snapshot()["calls"] == 1
+    assert flights.stats.snapshot()["coalesced"] == 19
+    assert flights.in_flight == 0
+
+
+def test_different_keys_and_later_calls_are_not_coalesced():
+    flights = SingleFlight("test")
+    fn, calls = counting(result=1)
+
+    async def run():
+        await asyncio.gather(flights.do("a", fn), flights.do("b", fn))
+        await flights.do("a", fn)  # the first flight has finished; nothing is remembered
+
+    asyncio.run(run())
+    assert calls[0] == 3
+
+
+def test_exception_is_delivered_to_every_waiter():
+    flights = SingleFlight("test")
+    fn, calls = counting(error=RuntimeError("search failed"))
+
+    async def run():
+        return await asyncio.gather(*(flights.do("key", fn) for _ in range(5)), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert calls[0] == 1
+    assert all(isinstance(result, RuntimeError) and str(result) == "search failed" for result in results)
+    assert flights.stats.failed == 1
+
+
+def test_cancelled_waiter_does_not_cancel_the_others():
+    flights = SingleFlight("test")
+    fn, calls = counting(result="done", delay=0.05)
+
+    async def run():
+        waiters = [asyncio.create_task(flights.do("key", fn)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        waiters[0].cancel()
+        return await asyncio.gather(*waiters, return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert isinstance(results[0], asyncio.CancelledError)
+    assert results[1:] == ["done", "done"]
+    assert calls[0] == 1
+    assert flights.stats.abandoned == 0
+
+
+def test_task_is_cancelled_once_the_last_waiter_leaves():
+    flights = SingleFlight("test")
+    cancelled = []
+
+    def fn():
+        async def work():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+        return work()
+
+    async def run():
+        waiters = [asyncio.create_task(flights.do("key", fn)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        waiters[0].cancel()
+        await asyncio.sleep(0.01)
+        assert not cancelled and flights.in_flight == 1  # one waiter is still there
+        waiters[1].cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        await asyncio.sleep(0)  # let the cancelled task run its handler
+
+    asyncio.run(run())
+    assert cancelled == [True]
+    assert flights.stats.abandoned == 1
+    assert flights.in_flight == 0
+
+
+def test_flights_are_not_shared_across_event_loops():
+    flights = SingleFlight("test")
+    fn, calls = counting(result=1)
+    assert asyncio.run(flights.do("key", fn)) == 1
+    assert asyncio.run(flights.do("key", fn)) == 1
+    assert calls[0] == 2
+
+
+
+def test_shared_work_is_not_charged_to_the_caller_that_started_it():
+    flights = SingleFlight("test")
+
+    def fn():
+        async def work():
+            with metrics.span("work"):
+                await asyncio.sleep(0.02)
+            return 1
+        return work()
+
+    async def request():
+        token = metrics.start_trace()
+        await flights.do("key", fn)
+        return metrics.end_trace(token)
+
+    async def run():
+        return await asyncio.gather(request(), request())
+
+    traces = asyncio.run(run())
+    for trace in traces:
+        assert "work" not in trace
+        assert trace["singleflight.test"] >= 0.015
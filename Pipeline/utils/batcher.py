@@ -0,0 +1,194 @@
+"""
+batcher.py
+----------
+Dynamic micro-batching for Triton inference calls.
+Concurrent single-item requests submitted within a short time window are coalesced into
+one batched infer call ([N, 3, 224, 224] for clip_visual, [N, 77] for clip_text), and each
+caller receives its own row of the batched output.
+
+The batcher does not talk to Triton itself: it is given an async `infer_fn(batch) -> outputs`
+callable, so a local stand-in can replace Triton in tests and benchmarks.
+
+Batches run as background tasks outside any request trace, so the span `batch.<name>` (and the
+inference spans inside it) is recorded once per batch in the stage histograms. Each caller
+traces its own queue wait plus inference as `batch_wait.<name>`.
+"""
+
+import asyncio
+import time
+import numpy as np
+from utils import metrics
+
+BATCH_SIZE = metrics.histogram("batch_size", "Rows per micro-batch.", ("batcher",), buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+BATCH_QUEUE_WAIT = metrics.histogram("batch_queue_wait_seconds", "Time a request waited for its micro-batch.", ("batcher",))
+
+
+class BatcherStats:
+    """
+    Per-batcher counters: number of batches, batch sizes and queue-wait times.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.batches = 0
+        self.items = 0
+        self.failed_batches = 0
+        self.batch_size_histogram = {}
+        self.total_queue_wait = 0.0
+        self.max_queue_wait = 0.0
+        self.last_batch_size = 0
+
+    def record_batch(self, batch_size: int, queue_waits: list):
+        self.batches += 1
+        self.items += batch_size
+        self.last_batch_size = batch_size
+        self.batch_size_histogram[batch_size] = self.batch_size_histogram.get(batch_size, 0) + 1
+        for wait in queue_waits:
+            self.total_queue_wait += wait
+            if wait > self.max_queue_wait:
+                self.max_queue_wait = wait
+
+    def snapshot(self) -> dict:
+        """
+        Returns the current counters as a plain dict (waits in milliseconds).
+        """
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "failed_batches": self.failed_batches,
+            "avg_batch_size": self.items / self.batches if self.batches else 0.0,
+            "last_batch_size": self.last_batch_size,
+            "batch_size_histogram": dict(sorted(self.batch_size_histogram.items())),
+            "avg_queue_wait_ms": 1000.0 * self.total_queue_wait / self.items if self.items else 0.0,
+            "max_queue_wait_ms": 1000.0 * self.max_queue_wait,
+        }
+
+
+class MicroBatcher:
+    """
+    Gathers concurrent requests for up to `max_wait_ms` (or until `max_batch_size` rows are
+    pending) and dispatches them as one call to `infer_fn`.
+
+    Args:
+        name (str): Name used in logs and metrics (e.g. "clip_visual").
+        infer_fn (callable): Async function taking a stacked np.ndarray of shape [N, ...]
+            and returning an np.ndarray whose first dimension is also N.
+        max_batch_size (int): Maximum number of rows sent in a single infer call.
+        max_wait_ms (float): Maximum time the first request of a batch waits for company.
+    """
+
+    def __init__(self, name: str, infer_fn, max_batch_size: int = 32, max_wait_ms: float = 5.0):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1.")
+        if max_wait_ms < 0:
+            raise ValueError("max_wait_ms must be non-negative.")
+        self.name = name
+        self.infer_fn = infer_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.stats = BatcherStats()
+
+        self._loop = None
+        self._pending = []
+        self._pending_rows = 0
+        self._timer = None
+        self._tasks = set()
+
+    async def submit(self, item: np.ndarray) -> np.ndarray:
+        """
+        Queues a single request and waits for its slice of the batched result.
+
+        Args:
+            item (np.ndarray): Model input with a leading batch dimension (usually 1).
+
+        Returns:
+            np.ndarray: The rows of the batched output belonging to this request.
+        """
+        rows = item.shape[0]
+        if rows > self.max_batch_size:
+            # Too large to share a batch; send it on its own.
+            return await self.infer_fn(item)
+
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Futures are bound to their loop (Streamlit creates a new loop per asyncio.run),
+            # so anything pending on a previous loop can never complete here.
+            self._loop = loop
+            self._pending = []
+            self._pending_rows = 0
+            self._timer = None
+
+        if self._pending_rows + rows > self.max_batch_size:
+            self._flush()
+
+        future = loop.create_future()
+        self._pending.append((item, future, time.perf_counter()))
+        self._pending_rows += rows
+
+        if self._pending_rows >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+
+        with metrics.span(f"batch_wait.{self.name}"):
+            return await future
+
+    def _flush(self):
+        """
+        Hands the currently pending requests to a background task.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+
+        batch = self._pending
+        self._pending = []
+        self._pending_rows = 0
+
+        task = self._loop.create_task(metrics.untraced(self._run_batch(batch)))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, batch: list):
+        started = time.perf_counter()
+        items = [item for item, _, _ in batch]
+        futures = [future for _, future, _ in batch]
+        sizes = [item.shape[0] for item in items]
+        total_rows = sum(sizes)
+
+        queue_waits = [started - enqueued for _, _, enqueued in batch]
+        self.stats.record_batch(total_rows, queue_waits)
+        BATCH_SIZE.observe(total_rows, batcher=self.name)
+        for wait in queue_waits:
+            BATCH_QUEUE_WAIT.observe(wait, batcher=self.name)
+
+        try:
+            with metrics.span(f"batch.{self.name}"):
+                inputs = items[0] if len(items) == 1 else np.concatenate(items, axis=0)
+                outputs = await self.infer_fn(inputs)
+            if outputs is None or outputs.shape[0] != total_rows:
+                raise ValueError(
+                    f"{self.name} returned {None if outputs is None else outputs.shape[0]} rows "
+                    f"for a batch of {total_rows}."
+                )
+        except asyncio.CancelledError:
+            self.stats.failed_batches += 1
+            for future in futures:
+                future.cancel()
+            raise
+        except Exception as e:
+            self.stats.failed_batches += 1
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        offset = 0
+        for future, size in zip(futures, sizes):
+            if not future.done():
+                future.set_result(outputs[offset:offset + size])
+            offset += size
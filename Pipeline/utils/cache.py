@@ -0,0 +1,240 @@
+"""
+cache.py
+--------
+Bounded in-process result cache used by product matching.
+
+Features:
+  - "lru" policy (least-recently-used eviction) or "ttl" policy (entries expire after
+    ttl_seconds and are evicted oldest-first when full).
+  - Limits by entry count and by (estimated) memory.
+  - Keys are spread over independent shards, each with its own lock, so lookups never
+    contend on one global lock. Under the "ttl" policy reads take no lock at all.
+  - Hit / miss / eviction / expiration counters.
+  - Entries can carry tags (e.g. product ids) so they can be invalidated when the
+    catalog changes.
+"""
+
+import sys
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+CACHE_POLICIES = ("lru", "ttl")
+
+
+def estimate_size(value) -> int:
+    """
+    Roughly estimates the memory held by a cached value, in bytes.
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes + sys.getsizeof(value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(k) + estimate_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in value)
+    return sys.getsizeof(value)
+
+
+class CacheStats:
+    """
+    Hit / miss / eviction counters for one cache.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def snapshot(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+
+class _Entry:
+    __slots__ = ("value", "size", "expires_at", "tags")
+
+    def __init__(self, value, size, expires_at, tags):
+        self.value = value
+        self.size = size
+        self.expires_at = expires_at
+        self.tags = tags
+
+
+class _Shard:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.nbytes = 0
+
+
+class ResultCache:
+    """
+    A sharded, bounded key/value cache.
+
+    Args:
+        name (str): Name used in logs and metrics.
+        policy (str): "lru" or "ttl".
+        max_entries (int): Maximum number of entries across all shards.
+        max_bytes (int): Maximum estimated memory across all shards (None for no limit).
+        ttl_seconds (float): Entry lifetime. Required for the "ttl" policy, optional for "lru".
+        num_shards (int): Number of independently locked shards.
+    """
+
+    def __init__(self, name: str, policy: str = "lru", max_entries: int = 10_000,
+                 max_bytes: int = None, ttl_seconds: float = None, num_shards: int = 16):
+        if policy not in CACHE_POLICIES:
+            raise ValueError(f"Unknown cache policy '{policy}'. Expected one of {CACHE_POLICIES}.")
+        if policy == "ttl" and not ttl_seconds:
+            raise ValueError("The 'ttl' policy requires ttl_seconds.")
+        if max_entries < 1 or num_shards < 1:
+            raise ValueError("max_entries and num_shards must be at least 1.")
+
+        self.name = name
+        self.policy = policy
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.stats = CacheStats()
+
+        num_shards = min(num_shards, max_entries)
+        self._shards = [_Shard() for _ in range(num_shards)]
+        self._shard_max_entries = max(1, max_entries // num_shards)
+        self._shard_max_bytes = max(1, max_bytes // num_shards) if max_bytes else None
+
+    def _shard(self, key) -> _Shard:
+        return self._shards[hash(key) % len(self._shards)]
+
+    def get(self, key, default=None):
+        """
+        Returns the cached value for `key`, or `default` on a miss or an expired entry.
+        """
+        shard = self._shard(key)
+        entry = shard.entries.get(key)
+        if entry is not None and entry.expires_at is not None and entry.expires_at <= time.monotonic():
+            with shard.lock:
+                if shard.entries.get(key) is entry:
+                    self._remove(shard, key)
+                    self.stats.expirations += 1
+            entry = None
+
+        if entry is None:
+            self.stats.misses += 1
+            return default
+
+        if self.policy == "lru":
+            with shard.lock:
+                if key in shard.entries:
+                    shard.entries.move_to_end(key)
+        self.stats.hits += 1
+        return entry.value
+
+    def __contains__(self, key) -> bool:
+        entry = self._shard(key).entries.get(key)
+        return entry is not None and (entry.expires_at is None or entry.expires_at > time.monotonic())
+
+    def set(self, key, value, tags=()):
+        """
+        Stores `value` under `key`, evicting old entries if the shard is over its limits.
+
+        Args:
+            key: A hashable cache key.
+            value: The value to cache.
+            tags (iterable): Labels (e.g. product ids) usable with invalidate_tag().
+        """
+        size = estimate_size(value)
+        if self._shard_max_bytes is not None and size > self._shard_max_bytes:
+            # Never cache something larger than a whole shard's budget.
+            return
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds else None
+        entry = _Entry(value, size, expires_at, frozenset(tags))
+
+        shard = self._shard(key)
+        with shard.lock:
+            if key in shard.entries:
+                self._remove(shard, key)
+            shard.entries[key] = entry
+            shard.nbytes += size
+            while len(shard.entries) > self._shard_max_entries or (
+                self._shard_max_bytes is not None and shard.nbytes > self._shard_max_bytes
+            ):
+                # OrderedDict order is recency for "lru" and insertion time for "ttl".
+                oldest_key = next(iter(shard.entries))
+                self._remove(shard, oldest_key)
+                self.stats.evictions += 1
+
+    def _remove(self, shard: _Shard, key):
+        entry = shard.entries.pop(key)
+        shard.nbytes -= entry.size
+
+    def invalidate(self, key) -> bool:
+        """
+        Removes a single key. Returns True if it was present.
+        """
+        shard = self._shard(key)
+        with shard.lock:
+            if key not in shard.entries:
+                return False
+            self._remove(shard, key)
+        self.stats.invalidations += 1
+        return True
+
+    def invalidate_tag(self, tag) -> int:
+        """
+        Removes every entry carrying `tag`. Returns the number of entries removed.
+        """
+        removed = 0
+        for shard in self._shards:
+            with shard.lock:
+                stale = [key for key, entry in shard.entries.items() if tag in entry.tags]
+                for key in stale:
+                    self._remove(shard, key)
+            removed += len(stale)
+        self.stats.invalidations += removed
+        return removed
+
+    def clear(self) -> int:
+        """
+        Removes every entry. Returns the number of entries removed.
+        """
+        removed = 0
+        for shard in self._shards:
+            with shard.lock:
+                removed += len(shard.entries)
+                shard.entries.clear()
+                shard.nbytes = 0
+        self.stats.invalidations += removed
+        return removed
+
+    def __len__(self) -> int:
+        return sum(len(shard.entries) for shard in self._shards)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(shard.nbytes for shard in self._shards)
+
+    def snapshot(self) -> dict:
+        """
+        Returns size and counter metrics as a plain dict.
+        """
+        return {
+            "name": self.name,
+            "policy": self.policy,
+            "entries": len(self),
+            "bytes": self.nbytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            **self.stats.snapshot(),
+        }
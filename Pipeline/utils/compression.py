@@ -0,0 +1,195 @@
+"""
+compression.py
+--------------
+Embedding compression for cheaper storage and a faster first search pass.
+
+  - L2 normalization, so cosine similarity is a dot product.
+  - Optional dimensionality reduction to `dim` coordinates: "pca" projects onto the top
+    principal components of the catalog; "truncate" keeps the leading coordinates
+    (Matryoshka-style). Reduced vectors are re-normalized.
+  - Quantization: "int8" (symmetric per-dimension scales, 4x smaller than float32) or "binary"
+    (one sign bit per coordinate, 32x smaller, scored by Hamming distance). None keeps float32.
+
+Compressed scores are approximate. db/search_backend.py uses them for a first pass over the
+whole catalog and rescores the best candidates with the full vectors.
+"""
+
+import numpy as np
+
+REDUCTIONS = (None, "pca", "truncate")
+QUANTIZATIONS = (None, "int8", "binary")
+# int8 scales cover this quantile of |x| per dimension; larger values are clipped.
+INT8_CLIP_QUANTILE = 0.999
+# Rows encoded / Hamming-scored per block, bounding temporaries.
+SCORE_BLOCK_ROWS = 65_536
+# Rows of int8 codes upcast per block when scoring; small enough for the float32 copy
+# to stay in CPU cache (larger blocks made the int8 pass slower than float32 search).
+UPCAST_BLOCK_ROWS = 512
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def l2_normalize(matrix: np.ndarray) -> np.ndarray:
+    """
+    Returns the rows of `matrix` scaled to unit length, as float32 (zero rows stay zero).
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+def _popcount(bits: np.ndarray) -> np.ndarray:
+    """
+    Returns the number of set bits per row of a packed uint8 matrix.
+    """
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(bits).sum(axis=1, dtype=np.int32)
+    return _POPCOUNT[bits].sum(axis=1, dtype=np.int32)
+
+
+class EmbeddingCompressor:
+    """
+    Normalizes, optionally reduces and quantizes embeddings.
+
+    Args:
+        dim (int): Target dimension for "pca" / "truncate" (ignored without a reduction).
+        reduction (str): None, "pca" or "truncate".
+        quantization (str): None, "int8" or "binary".
+    """
+
+    def __init__(self, dim: int = None, reduction: str = None, quantization: str = "int8"):
+        if reduction not in REDUCTIONS:
+            raise ValueError(f"Unknown reduction '{reduction}'. Expected one of {REDUCTIONS[1:]} or None.")
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization '{quantization}'. Expected one of {QUANTIZATIONS[1:]} or None.")
+        if reduction is not None and (dim is None or dim < 1):
+            raise ValueError(f"Reduction '{reduction}' needs a positive dim.")
+        self.dim = dim if reduction is not None else None
+        self.reduction = reduction
+        self.quantization = quantization
+        self.mean = None
+        self.components = None
+        self.scales = None
+        self.fitted = reduction != "pca" and quantization != "int8"
+
+    @property
+    def name(self) -> str:
+        parts = [f"{self.reduction}{self.dim}"] if self.reduction else []
+        parts.append(self.quantization or "float32")
+        return "-".join(parts)
+
+    def output_dim(self, input_dim: int) -> int:
+        return min(self.dim, input_dim) if self.reduction else input_dim
+
+    def bytes_per_vector(self, input_dim: int) -> int:
+        dim = self.output_dim(input_dim)
+        if self.quantization == "binary":
+            return (dim + 7) // 8
+        return dim * (1 if self.quantization == "int8" else 4)
+
+    def fit(self, vectors: np.ndarray, sample_size: int = 100_000, seed: int = 0) -> "EmbeddingCompressor":
+        """
+        Fits the PCA projection and int8 scales on (a sample of) the catalog vectors.
+        """
+        n = vectors.shape[0]
+        rng = np.random.default_rng(seed)
+        rows = np.sort(rng.choice(n, size=min(n, sample_size), replace=False))
+        sample = l2_normalize(vectors[rows])
+        if self.reduction == "pca":
+            if self.dim > sample.shape[1]:
+                raise ValueError(f"PCA dim {self.dim} exceeds the embedding dimension {sample.shape[1]}.")
+            self.mean = sample.mean(axis=0)
+            # Right singular vectors of the centered sample are the principal axes, largest first.
+            _, _, vt = np.linalg.svd(sample - self.mean, full_matrices=False)
+            self.components = np.ascontiguousarray(vt[:self.dim].T, dtype=np.float32)
+        if self.quantization == "int8":
+            reduced = self.reduce(sample)
+            scales = np.quantile(np.abs(reduced), INT8_CLIP_QUANTILE, axis=0) / 127.0
+            self.scales = np.maximum(scales, 1e-8).astype(np.float32)
+        self.fitted = True
+        return self
+
+    def reduce(self, vectors: np.ndarray) -> np.ndarray:
+        """
+        Returns normalized, dimension-reduced float32 vectors (rows of a 2-D array).
+        """
+        vectors = l2_normalize(np.atleast_2d(vectors))
+        if self.reduction == "pca":
+            return l2_normalize((vectors - self.mean) @ self.components)
+        if self.reduction == "truncate":
+            return l2_normalize(vectors[:, :self.dim])
+        return vectors
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        """
+        Returns the compressed codes of `vectors`: int8 [N, dim], packed uint8 [N, dim / 8] or float32 [N, dim].
+        """
+        if not self.fitted:
+            raise RuntimeError("EmbeddingCompressor.fit() must be called before encode().")
+        codes = []
+        for start in range(0, vectors.shape[0], SCORE_BLOCK_ROWS):
+            reduced = self.reduce(vectors[start:start + SCORE_BLOCK_ROWS])
+            if self.quantization == "int8":
+                codes.append(np.clip(np.rint(reduced / self.scales), -127, 127).astype(np.int8))
+            elif self.quantization == "binary":
+                codes.append(np.packbits(reduced > 0, axis=1))
+            else:
+                codes.append(reduced)
+        return np.concatenate(codes) if codes else np.empty((0, 0), dtype=np.float32)
+
+    def score(self, query: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        """
+        Returns approximate cosine similarities between one query embedding and every code row.
+        """
+        q = self.reduce(np.asarray(query, dtype=np.float32).reshape(1, -1))[0]
+        scores = np.empty(codes.shape[0], dtype=np.float32)
+        if self.quantization == "binary":
+            bits = np.packbits(q > 0)
+            dim = q.shape[0]
+            for start in range(0, codes.shape[0], SCORE_BLOCK_ROWS):
+                distance = _popcount(np.bitwise_xor(codes[start:start + SCORE_BLOCK_ROWS], bits))
+                # Fraction of agreeing signs, mapped to [-1, 1].
+                scores[start:start + distance.shape[0]] = 1.0 - 2.0 * distance / dim
+            return scores
+        if self.quantization is None:
+            return codes @ q
+        # Dequantize into the query instead of the matrix: x . q ~= codes . (scales * q).
+        q = q * self.scales
+        for start in range(0, codes.shape[0], UPCAST_BLOCK_ROWS):
+            block = codes[start:start + UPCAST_BLOCK_ROWS]
+            scores[start:start + block.shape[0]] = block.astype(np.float32, copy=False) @ q
+        return scores
+
+    def save(self, path: str, codes: np.ndarray):
+        """
+        Writes the fitted parameters and `codes` to one .npz file.
+        """
+        np.savez(
+            path,
+            codes=codes,
+            reduction=np.array(self.reduction or ""),
+            quantization=np.array(self.quantization or ""),
+            dim=np.array(self.dim or 0),
+            mean=self.mean if self.mean is not None else np.empty(0, dtype=np.float32),
+            components=self.components if self.components is not None else np.empty((0, 0), dtype=np.float32),
+            scales=self.scales if self.scales is not None else np.empty(0, dtype=np.float32),
+        )
+
+    @classmethod
+    def load(cls, path: str):
+        """
+        Reads a file written by save(). Returns (compressor, codes).
+        """
+        data = np.load(path)
+        compressor = cls(
+            dim=int(data["dim"]) or None,
+            reduction=str(data["reduction"]) or None,
+            quantization=str(data["quantization"]) or None,
+        )
+        if data["mean"].size:
+            compressor.mean = data["mean"]
+            compressor.components = data["components"]
+        if data["scales"].size:
+            compressor.scales = data["scales"]
+        compressor.fitted = True
+        return compressor, data["codes"]
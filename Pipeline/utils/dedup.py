@@ -0,0 +1,130 @@
+"""
+dedup.py
+--------
+Near-duplicate detection over catalog embeddings (used by dedup_catalog.py and, for query-time
+collapsing of variants, by product_matching.py).
+
+  - similar_pairs: all row pairs with cosine similarity >= threshold. The upper triangle of the
+    similarity matrix is computed in block_rows x block_rows tiles, so memory stays bounded by
+    one tile instead of the full N x N matrix.
+  - UnionFind / clusters_from_pairs: groups transitively connected pairs into clusters.
+  - choose_canonical: picks the member closest to the cluster centroid as its representative.
+  - collapse_hits: keeps one hit per cluster in a ranked result list.
+"""
+
+import json
+import numpy as np
+
+# Rows per tile side in similar_pairs; a float32 tile takes DEDUP_BLOCK_ROWS^2 * 4 bytes.
+DEDUP_BLOCK_ROWS = 2048
+
+
+def similar_pairs(vectors: np.ndarray, threshold: float, block_rows: int = DEDUP_BLOCK_ROWS):
+    """
+    Yields the pairs of rows of `vectors` (normalized, e.g. a memory-mapped snapshot) whose dot
+    product is at least `threshold`, one tile at a time.
+
+    Yields:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: Row indices i < j and their similarities.
+    """
+    n = vectors.shape[0]
+    for a in range(0, n, block_rows):
+        left = np.asarray(vectors[a:a + block_rows], dtype=np.float32)
+        for b in range(a, n, block_rows):
+            right = left if b == a else np.asarray(vectors[b:b + block_rows], dtype=np.float32)
+            scores = left @ right.T
+            rows, cols = np.nonzero(scores >= threshold)
+            if b == a:
+                upper = rows < cols
+                rows, cols = rows[upper], cols[upper]
+            if rows.size:
+                yield rows + a, cols + b, scores[rows, cols]
+
+
+class UnionFind:
+    """
+    Disjoint sets over the integers 0..n-1 (union by size, path halving).
+    """
+
+    def __init__(self, n: int):
+        self.parent = list(range(n))
+        self.size = [1] * n
+
+    def find(self, x: int) -> int:
+        parent = self.parent
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def union(self, x: int, y: int) -> bool:
+        x, y = self.find(x), self.find(y)
+        if x == y:
+            return False
+        if self.size[x] < self.size[y]:
+            x, y = y, x
+        self.parent[y] = x
+        self.size[x] += self.size[y]
+        return True
+
+
+def clusters_from_pairs(n: int, pairs) -> list:
+    """
+    Returns the connected components of the pair graph that have at least two members, as sorted
+    lists of row indices, largest first.
+
+    Args:
+        n (int): Number of rows.
+        pairs (iterable): (i, j) row index pairs.
+    """
+    sets = UnionFind(n)
+    for i, j in pairs:
+        sets.union(int(i), int(j))
+    groups = {}
+    for row in range(n):
+        if sets.size[sets.find(row)] > 1:
+            groups.setdefault(sets.find(row), []).append(row)
+    return sorted(groups.values(), key=lambda members: (-len(members), members[0]))
+
+
+def choose_canonical(vectors: np.ndarray, members: list) -> int:
+    """
+    Returns the member row closest to the normalized centroid of the cluster (ties: lowest row).
+    """
+    block = np.asarray(vectors[members], dtype=np.float32)
+    centroid = block.sum(axis=0)
+    centroid /= max(float(np.linalg.norm(centroid)), 1e-12)
+    return members[int(np.argmax(block @ centroid))]
+
+
+def load_canonical_map(path: str) -> dict:
+    """
+    Reads a clusters file written by dedup_catalog.py. Returns {product_id: canonical product_id}
+    for every member of a cluster.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        report = json.load(f)
+    return {member: cluster["canonical"] for cluster in report["clusters"] for member in cluster["members"]}
+
+
+def collapse_hits(hits: list, canonical_of: dict) -> list:
+    """
+    Keeps the best-ranked hit of every cluster. The hit keeps its own product id: it is the
+    member that passed the search's filters and score cutoff, which the canonical product may
+    not. Canonical ids only identify the cluster.
+
+    Args:
+        hits (list): Ranked (score, product_id) pairs.
+        canonical_of (dict): {product_id: canonical product_id}; products not in it are kept as is.
+
+    Returns:
+        list[tuple[float, str]]: (score, product_id) pairs in the original order.
+    """
+    seen = set()
+    collapsed = []
+    for score, product_id in hits:
+        canonical = canonical_of.get(product_id, product_id)
+        if canonical not in seen:
+            seen.add(canonical)
+            collapsed.append((score, product_id))
+    return collapsed
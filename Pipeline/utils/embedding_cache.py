@@ -0,0 +1,209 @@
+"""
+embedding_cache.py
+------------------
+Content-addressed cache for CLIP embeddings, checked before preprocessing and Triton.
+
+Keys are fast hashes of the raw input: the uploaded image bytes, or the normalized text prompt.
+Two tiers:
+  - memory: a bounded LRU ResultCache (utils/cache.py)
+  - disk (optional): a fixed-capacity float32 matrix stored as a memory-mapped .npy file,
+    plus an append-only index log mapping keys to rows, so cached embeddings survive restarts.
+    When the disk store is full, rows are reused in ring order (oldest write first).
+
+A disk directory should be owned by a single process; give each worker its own directory.
+"""
+
+import hashlib
+import os
+import threading
+import numpy as np
+from utils.cache import ResultCache
+
+
+def hash_bytes(data: bytes) -> str:
+    """
+    Returns a 128-bit BLAKE2b hex digest of raw input bytes.
+    """
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def normalize_prompt(text: str) -> str:
+    """
+    Normalizes a text prompt the way CLIPTokenizer does before tokenizing (collapsed
+    whitespace, lower case), so prompts that tokenize identically share a cache key.
+    """
+    return " ".join(text.split()).lower()
+
+
+def hash_image(image) -> str:
+    """
+    Returns a digest of a decoded PIL image (mode, size and pixel data).
+    Hashing the encoded upload bytes with hash_bytes() is cheaper when they are available.
+    """
+    m = hashlib.blake2b(digest_size=16)
+    m.update(f"{image.mode}:{image.size}".encode())
+    m.update(image.tobytes())
+    return m.hexdigest()
+
+
+class DiskEmbeddingStore:
+    """
+    A memory-mapped, fixed-capacity store of float32 embeddings keyed by string.
+
+    Args:
+        directory (str): Directory holding `embeddings.npy` and `index.log`.
+        capacity (int): Maximum number of stored embeddings.
+    """
+
+    def __init__(self, directory: str, capacity: int = 100_000):
+        self.directory = directory
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._matrix_path = os.path.join(directory, "embeddings.npy")
+        self._index_path = os.path.join(directory, "index.log")
+        self._matrix = None
+        self._key_to_row = {}
+        self._row_to_key = {}
+        self._next_row = 0
+        self._log_lines = 0
+
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self._matrix_path):
+            self._matrix = np.load(self._matrix_path, mmap_mode="r+")
+            if self._matrix.shape[0] != capacity:
+                raise ValueError(
+                    f"Embedding store at {directory} has capacity {self._matrix.shape[0]}, expected {capacity}."
+                )
+            self._replay_index()
+
+    def _replay_index(self):
+        if not os.path.exists(self._index_path):
+            return
+        with open(self._index_path, "r", encoding="utf-8") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) != 2:
+                    continue  # a torn last line after a crash
+                key, row = parts[0], int(parts[1])
+                self._assign(key, row)
+                self._next_row = (row + 1) % self.capacity
+                self._log_lines += 1
+        if self._log_lines > 2 * self.capacity:
+            self._compact_index()
+
+    def _assign(self, key: str, row: int):
+        previous = self._row_to_key.pop(row, None)
+        if previous is not None:
+            self._key_to_row.pop(previous, None)
+        old_row = self._key_to_row.pop(key, None)
+        if old_row is not None:
+            self._row_to_key.pop(old_row, None)
+        self._key_to_row[key] = row
+        self._row_to_key[row] = key
+
+    def _compact_index(self):
+        # Rewrite the log with live entries only, ordered so that replay restores _next_row.
+        rows = sorted(self._row_to_key, key=lambda row: (row - self._next_row) % self.capacity)
+        tmp_path = self._index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for row in rows:
+                f.write(f"{self._row_to_key[row]} {row}\n")
+        os.replace(tmp_path, self._index_path)
+        self._log_lines = len(rows)
+
+    def get(self, key: str):
+        """
+        Returns a copy of the stored embedding (shape [1, D]) or None.
+        """
+        row = self._key_to_row.get(key)
+        if row is None or self._matrix is None:
+            return None
+        return np.array(self._matrix[row:row + 1])
+
+    def put(self, key: str, embedding: np.ndarray):
+        """
+        Stores a single embedding, reusing the oldest row when the store is full.
+        """
+        vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        with self._lock:
+            if key in self._key_to_row:
+                return
+            if self._matrix is None:
+                self._matrix = np.lib.format.open_memmap(
+                    self._matrix_path, mode="w+", dtype=np.float32, shape=(self.capacity, vector.shape[0])
+                )
+            if vector.shape[0] != self._matrix.shape[1]:
+                raise ValueError(f"Embedding dimension {vector.shape[0]} does not match store dimension {self._matrix.shape[1]}.")
+
+            row = self._next_row
+            self._matrix[row] = vector
+            # Write the row before indexing it, so a crash never indexes garbage.
+            with open(self._index_path, "a", encoding="utf-8") as f:
+                f.write(f"{key} {row}\n")
+            self._assign(key, row)
+            self._next_row = (row + 1) % self.capacity
+            self._log_lines += 1
+            if self._log_lines > 2 * self.capacity:
+                self._compact_index()
+
+    def flush(self):
+        """
+        Flushes dirty pages of the memory-mapped matrix to disk.
+        """
+        if self._matrix is not None:
+            self._matrix.flush()
+
+    def __len__(self) -> int:
+        return len(self._key_to_row)
+
+
+class EmbeddingCache:
+    """
+    Two-tier (memory, optional disk) cache of embeddings keyed by content hash.
+
+    Args:
+        name (str): Name used in logs and metrics; also the subdirectory of `disk_dir`.
+        max_entries (int): Capacity of the in-memory tier.
+        disk_dir (str): Root directory for the on-disk tier, or None to keep it in memory only.
+        disk_capacity (int): Capacity of the on-disk tier.
+    """
+
+    def __init__(self, name: str, max_entries: int = 50_000, disk_dir: str = None, disk_capacity: int = 100_000):
+        self.name = name
+        self.memory = ResultCache(f"{name}_embeddings", policy="lru", max_entries=max_entries)
+        self.disk = DiskEmbeddingStore(os.path.join(disk_dir, name), capacity=disk_capacity) if disk_dir else None
+        self.disk_hits = 0
+
+    def get(self, key: str):
+        """
+        Returns the cached embedding for `key` (read-only, shape [1, D]) or None.
+        """
+        embedding = self.memory.get(key)
+        if embedding is not None or self.disk is None:
+            return embedding
+        embedding = self.disk.get(key)
+        if embedding is not None:
+            self.disk_hits += 1
+            embedding.setflags(write=False)
+            self.memory.set(key, embedding)
+        return embedding
+
+    def set(self, key: str, embedding: np.ndarray):
+        """
+        Stores a private, read-only copy of `embedding` in both tiers (the disk tier stores float32).
+        """
+        embedding = np.array(embedding, copy=True)
+        embedding.setflags(write=False)
+        self.memory.set(key, embedding)
+        if self.disk is not None:
+            self.disk.put(key, embedding)
+
+    def snapshot(self) -> dict:
+        """
+        Returns metrics of both tiers as a plain dict.
+        """
+        return {
+            **self.memory.snapshot(),
+            "disk_entries": len(self.disk) if self.disk is not None else 0,
+            "disk_hits": self.disk_hits,
+        }
@@ -0,0 +1,171 @@
+"""
+image_preprocessing.py
+----------------------
+A dedicated preprocessing engine for the fixed CLIP ViT-B/32 image pipeline:
+  - convert to RGB
+  - resize the shortest edge to 224 (bicubic)
+  - center-crop 224 x 224
+  - rescale to [0, 1] and normalize with the CLIP mean/std
+
+It reproduces what Hugging Face's CLIPProcessor does for "openai/clip-vit-base-patch32",
+but writes the result straight into a (preallocated) float16 NCHW buffer. Normalization is a
+per-channel 256-entry lookup table, so each pixel is converted with a single table read and
+no intermediate float32 image is ever materialized.
+"""
+
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+
+CLIP_IMAGE_SIZE = 224
+CLIP_MEAN = (0.48145466, 0.4578275, 0.40821073)
+CLIP_STD = (0.26862954, 0.26130258, 0.27577711)
+
+
+class ClipImagePreprocessor:
+    """
+    Resize / center-crop / normalize engine for CLIP image inputs.
+
+    Args:
+        size (int): Output height and width (and target length of the shortest edge).
+        mean (tuple): Per-channel mean applied after rescaling to [0, 1].
+        std (tuple): Per-channel standard deviation applied after rescaling to [0, 1].
+        dtype (np.dtype): Output dtype (float16 for the clip_visual model).
+        num_workers (int): If > 0, batches are decoded and resized on a thread pool of this size.
+        use_draft (bool): Let the JPEG decoder downscale while decoding encoded inputs. This is
+            much faster for large photos but no longer matches CLIPProcessor bit-for-bit.
+    """
+
+    def __init__(self, size: int = CLIP_IMAGE_SIZE, mean=CLIP_MEAN, std=CLIP_STD,
+                 dtype=np.float16, num_workers: int = 0, use_draft: bool = False):
+        self.size = size
+        self.dtype = np.dtype(dtype)
+        self.num_workers = num_workers
+        self.use_draft = use_draft
+        self._executor = None
+
+        # lut[c, v] == (v / 255 - mean[c]) / std[c], computed in float32 like CLIPProcessor.
+        values = np.arange(256, dtype=np.float32) / np.float32(255.0)
+        mean = np.asarray(mean, dtype=np.float32)[:, None]
+        std = np.asarray(std, dtype=np.float32)[:, None]
+        self._lut = ((values[None, :] - mean) / std).astype(self.dtype)
+
+    def load(self, source) -> Image.Image:
+        """
+        Returns an RGB PIL image for a PIL image, encoded image bytes or a file path.
+        """
+        if isinstance(source, Image.Image):
+            image = source
+        elif isinstance(source, (bytes, bytearray, memoryview)):
+            image = Image.open(io.BytesIO(source))
+        elif isinstance(source, (str, os.PathLike)):
+            image = Image.open(source)
+        else:
+            raise ValueError(f"Unsupported image input of type {type(source).__name__}.")
+
+        if self.use_draft and image is not source and image.format == "JPEG":
+            image.draft("RGB", (self.size, self.size))
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        return image
+
+    def resize_and_crop(self, image: Image.Image) -> np.ndarray:
+        """
+        Resizes the shortest edge to `size` and center-crops to `size` x `size`.
+
+        Returns:
+            np.ndarray: uint8 pixels with shape [size, size, 3].
+        """
+        width, height = image.size
+        short, long = (width, height) if width <= height else (height, width)
+        new_short, new_long = self.size, int(self.size * long / short)
+        new_width, new_height = (new_short, new_long) if width <= height else (new_long, new_short)
+        if (new_width, new_height) != (width, height):
+            image = image.resize((new_width, new_height), resample=Image.BICUBIC)
+
+        pixels = np.asarray(image, dtype=np.uint8)
+        top = max((new_height - self.size) // 2, 0)
+        left = max((new_width - self.size) // 2, 0)
+        pixels = pixels[top:top + self.size, left:left + self.size]
+        if pixels.shape[:2] != (self.size, self.size):
+            # Images smaller than the crop are zero-padded around the center, as CLIPProcessor does.
+            padded = np.zeros((self.size, self.size, 3), dtype=np.uint8)
+            pad_top = (self.size - pixels.shape[0]) // 2
+            pad_left = (self.size - pixels.shape[1]) // 2
+            padded[pad_top:pad_top + pixels.shape[0], pad_left:pad_left + pixels.shape[1]] = pixels
+            pixels = padded
+        return pixels
+
+    def normalize_into(self, pixels: np.ndarray, out: np.ndarray) -> np.ndarray:
+        """
+        Normalizes uint8 HWC pixels into a CHW slice of the output buffer.
+        """
+        for channel in range(3):
+            np.take(self._lut[channel], pixels[:, :, channel], out=out[channel])
+        return out
+
+    def _preprocess_one(self, source, out: np.ndarray):
+        self.normalize_into(self.resize_and_crop(self.load(source)), out)
+
+    def allocate(self, batch_size: int) -> np.ndarray:
+        """
+        Allocates an NCHW output buffer that can be reused across calls.
+        """
+        return np.empty((batch_size, 3, self.size, self.size), dtype=self.dtype)
+
+    def _check_buffer(self, out: np.ndarray, batch_size: int) -> np.ndarray:
+        if out is None:
+            return self.allocate(batch_size)
+        expected = (batch_size, 3, self.size, self.size)
+        if out.shape != expected or out.dtype != self.dtype:
+            raise ValueError(f"Output buffer must have shape {expected} and dtype {self.dtype}.")
+        return out
+
+    def preprocess(self, image, out: np.ndarray = None) -> np.ndarray:
+        """
+        Preprocesses a single image.
+
+        Args:
+            image: A PIL image, encoded image bytes or a file path.
+            out (np.ndarray): Optional preallocated buffer of shape [1, 3, size, size].
+
+        Returns:
+            np.ndarray: The pixel values with shape [1, 3, size, size].
+        """
+        out = self._check_buffer(out, 1)
+        self._preprocess_one(image, out[0])
+        return out
+
+    def preprocess_batch(self, images: list, out: np.ndarray = None) -> np.ndarray:
+        """
+        Preprocesses a list of images into one stacked NCHW array.
+        With `num_workers > 0` the per-image decode and resize run on a thread pool
+        (PIL releases the GIL while decoding and resampling).
+
+        Args:
+            images (list): PIL images, encoded image bytes or file paths.
+            out (np.ndarray): Optional preallocated buffer of shape [N, 3, size, size].
+
+        Returns:
+            np.ndarray: The pixel values with shape [N, 3, size, size].
+        """
+        out = self._check_buffer(out, len(images))
+        if self.num_workers > 0 and len(images) > 1:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.num_workers, thread_name_prefix="clip-preprocess")
+            # Each worker writes to its own row of the buffer; list() re-raises the first error.
+            list(self._executor.map(self._preprocess_one, images, out))
+        else:
+            for image, row in zip(images, out):
+                self._preprocess_one(image, row)
+        return out
+
+    def close(self):
+        """
+        Shuts down the thread pool, if one was started.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
@@ -0,0 +1,90 @@
+"""
+lazy.py
+-------
+Thread-safe lazy initialization for heavy module-level objects (tokenizers, processors, clients),
+so importing a module never loads a model or opens a connection.
+
+  - Lazy: one instance per process, built on first get() under a lock (double-checked).
+  - LoopLocal: one instance per asyncio event loop, for clients whose connections are bound to
+    the loop that created them. Instances are dropped together with their loop.
+"""
+
+import asyncio
+import threading
+import time
+import weakref
+
+
+class Lazy:
+    """
+    Builds `factory()` on first use and returns the same object afterwards.
+
+    Args:
+        factory (callable): Zero-argument function creating the object.
+        name (str): Label used in snapshots (defaults to the factory's name).
+    """
+
+    def __init__(self, factory, name: str = None):
+        self._factory = factory
+        self.name = name or getattr(factory, "__name__", "lazy")
+        self._lock = threading.Lock()
+        self._value = None
+        self._loaded = False
+        self.load_seconds = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def get(self):
+        if self._loaded:
+            return self._value
+        with self._lock:
+            if not self._loaded:
+                started = time.perf_counter()
+                self._value = self._factory()
+                self.load_seconds = time.perf_counter() - started
+                self._loaded = True
+        return self._value
+
+    def reset(self):
+        """
+        Forgets the instance so the next get() builds a new one. Returns the old instance (or None).
+        """
+        with self._lock:
+            value, self._value, self._loaded = self._value, None, False
+        return value
+
+
+class LoopLocal:
+    """
+    Builds `factory()` once per running event loop.
+
+    Args:
+        factory (callable): Zero-argument function creating the object; called inside the loop.
+        name (str): Label used in snapshots (defaults to the factory's name).
+    """
+
+    def __init__(self, factory, name: str = None):
+        self._factory = factory
+        self.name = name or getattr(factory, "__name__", "loop_local")
+        self._lock = threading.Lock()
+        self._values = weakref.WeakKeyDictionary()
+
+    def get(self):
+        loop = asyncio.get_running_loop()
+        value = self._values.get(loop)
+        if value is None:
+            with self._lock:
+                value = self._values.get(loop)
+                if value is None:
+                    value = self._factory()
+                    self._values[loop] = value
+        return value
+
+    def pop(self):
+        """
+        Forgets the running loop's instance and returns it (or None), e.g. to close it.
+        """
+        with self._lock:
+            return self._values.pop(asyncio.get_running_loop(), None)
@@ -1,60 +1,257 @@
 """
 mongodb_logger.py
 -----------------
-A module for logging errors and system events to a mocked MongoDB instance.
-This module uses Motor (the asynchronous MongoDB driver) to log events.
+A module for logging errors and system events to a MongoDB instance.
+
+Events never touch MongoDB on the caller's path: they are put on a bounded in-memory queue and
+shipped by a background thread with `insert_many`, whenever LOG_FLUSH_BATCH_SIZE events are
+pending or LOG_FLUSH_INTERVAL seconds have passed. Under backpressure, low-severity events are
+sampled and, once the queue is full, dropped; dropped errors and batches MongoDB rejects go to
+the local `logging` module instead.
+
+The flusher uses the synchronous PyMongo client on its own thread, so it works the same whether
+or not the caller has an event loop running (Streamlit usually does not). The client is created
+on the first flush, so importing this module opens no connection.
 """
 
-import asyncio
+import atexit
+import datetime
 import logging
-import motor.motor_asyncio
+import os
+import queue
+import random
+import threading
+import time
+import pymongo
+from utils.lazy import Lazy
+from utils import metrics
 
 # Configure logging for fallback in case MongoDB logging fails.
 logging.basicConfig(level=logging.INFO)
 
 # Configuration parameters for the MongoDB logging instance.
-LOG_MONGO_URI = "mongodb://localhost:27017"  # Use a separate port/instance for logging.
+LOG_MONGO_URI = os.environ.get("LOG_MONGO_URI", os.environ.get("MONGO_URI", "mongodb://localhost:27017"))  # Use a separate port/instance for logging.
 LOG_DB_NAME = "log_db"
 LOG_COLLECTION_NAME = "system_logs"
 
-# Create an asynchronous MongoDB client using Motor.
-client = motor.motor_asyncio.AsyncIOMotorClient(LOG_MONGO_URI)
-db = client[LOG_DB_NAME]
-collection = db[LOG_COLLECTION_NAME]
+# Shipping: queue bound, flush triggers and backpressure policy.
+LOG_QUEUE_MAX = 10_000
+LOG_FLUSH_BATCH_SIZE = 200
+LOG_FLUSH_INTERVAL = 1.0  # seconds
+LOG_HIGH_WATER_MARK = 0.8  # fraction of LOG_QUEUE_MAX above which low-severity events are sampled
+LOG_SAMPLE_RATE = 0.1  # fraction of low-severity events kept above the high-water mark
+LOG_SAMPLED_LEVELS = ("DEBUG", "INFO")
 
-async def log_event(level: str, message: str, extra: dict = None):
+
+def _create_client():
+    return pymongo.MongoClient(LOG_MONGO_URI, serverSelectionTimeoutMS=2000)
+
+
+# Synchronous MongoDB client used by the background flusher, created on its first flush.
+CLIENT = Lazy(_create_client, "log_mongodb_client")
+
+
+def get_collection():
+    return CLIENT.get()[LOG_DB_NAME][LOG_COLLECTION_NAME]
+
+
+fallback_logger = logging.getLogger("product_matching.events")
+
+
+def _fallback(log_doc: dict, reason: str = None):
     """
-    Asynchronously logs an event to MongoDB.
+    Writes an event to the local logging module.
     """
-    log_doc = {
+    level = getattr(logging, str(log_doc.get("level", "INFO")).upper(), logging.INFO)
+    suffix = f" [{reason}]" if reason else ""
+    fallback_logger.log(level, f"{log_doc.get('message')} {log_doc.get('extra') or ''}{suffix}")
+
+
+class LogShipper:
+    """
+    Bounded queue plus a background thread that ships events to MongoDB in batches.
+    """
+
+    def __init__(self, max_queue: int = LOG_QUEUE_MAX, batch_size: int = LOG_FLUSH_BATCH_SIZE,
+                 flush_interval: float = LOG_FLUSH_INTERVAL):
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.high_water = int(max_queue * LOG_HIGH_WATER_MARK)
+
+        self.enqueued = 0
+        self.shipped = 0
+        self.dropped = 0
+        self.sampled_out = 0
+        self.failed_batches = 0
+
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._flush_requested = threading.Event()
+        self._idle = threading.Condition()
+        self._in_flight = 0
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="mongodb-log-shipper", daemon=True)
+                self._thread.start()
+
+    def submit(self, log_doc: dict) -> bool:
+        """
+        Queues an event without blocking. Returns False if it was sampled out or dropped.
+        """
+        self._ensure_started()
+        if self.queue.qsize() >= self.high_water and log_doc.get("level") in LOG_SAMPLED_LEVELS:
+            if random.random() >= LOG_SAMPLE_RATE:
+                self.sampled_out += 1
+                return False
+        try:
+            self.queue.put_nowait(log_doc)
+        except queue.Full:
+            self.dropped += 1
+            if log_doc.get("level") not in LOG_SAMPLED_LEVELS:
+                _fallback(log_doc, "log queue full")
+            return False
+        self.enqueued += 1
+        if self.queue.qsize() >= self.batch_size:
+            self._flush_requested.set()
+        return True
+
+    def _drain(self) -> list:
+        batch = []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _ship(self, batch: list):
+        try:
+            with metrics.span("log.ship"):
+                get_collection().insert_many(batch, ordered=False)
+            self.shipped += len(batch)
+        except Exception as e:
+            self.failed_batches += 1
+            logging.error(f"Failed to log {len(batch)} events to MongoDB: {e}")
+            for log_doc in batch:
+                _fallback(log_doc)
+
+    def _run(self):
+        next_flush = time.monotonic() + self.flush_interval
+        while not self._stop.is_set():
+            self._flush_requested.wait(timeout=max(0.0, next_flush - time.monotonic()))
+            self._flush_requested.clear()
+            self._flush_pending()
+            next_flush = time.monotonic() + self.flush_interval
+        self._flush_pending()
+
+    def _flush_pending(self):
+        with self._idle:
+            self._in_flight += 1
+        try:
+            while True:
+                batch = self._drain()
+                if not batch:
+                    break
+                self._ship(batch)
+        finally:
+            with self._idle:
+                self._in_flight -= 1
+                self._idle.notify_all()
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """
+        Asks the flusher to ship everything queued so far and waits up to `timeout` seconds.
+        Returns True if the queue was drained in time.
+        """
+        if self._thread is None:
+            return self.queue.empty()
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            self._flush_requested.set()
+            with self._idle:
+                if self.queue.empty() and self._in_flight == 0:
+                    return True
+                self._idle.wait(timeout=0.05)
+        return self.queue.empty()
+
+    def shutdown(self, timeout: float = 5.0):
+        """
+        Ships pending events and stops the background thread.
+        """
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._flush_requested.set()
+        self._thread.join(timeout=timeout)
+
+    def snapshot(self) -> dict:
+        """
+        Returns queue depth and shipping counters as a plain dict.
+        """
+        return {
+            "queued": self.queue.qsize(),
+            "enqueued": self.enqueued,
+            "shipped": self.shipped,
+            "dropped": self.dropped,
+            "sampled_out": self.sampled_out,
+            "failed_batches": self.failed_batches,
+        }
+
+
+SHIPPER = LogShipper()
+atexit.register(SHIPPER.shutdown)
+
+
+def _make_log_doc(level: str, message: str, extra: dict = None) -> dict:
+    return {
         "level": level,
         "message": message,
-        "extra": extra or {}
+        "extra": extra or {},
+        "timestamp": datetime.datetime.now(datetime.timezone.utc),
     }
-    try:
-        result = await collection.insert_one(log_doc)
-        return result.inserted_id
-    except Exception as e:
-        logging.error(f"Failed to log event to MongoDB: {e}")
-        return None
+
+
+async def log_event(level: str, message: str, extra: dict = None):
+    """
+    Asynchronously logs an event to MongoDB.
+    The event is queued for the background shipper; this never waits on MongoDB.
+
+    Returns:
+        bool: False if the event was sampled out or dropped under backpressure.
+    """
+    return SHIPPER.submit(_make_log_doc(level, message, extra))
+
 
 def log_event_sync(level: str, message: str, extra: dict = None):
     """
     Synchronous wrapper for logging events.
-    If an event loop is already running (e.g., in Streamlit), the logging coroutine is scheduled
-    as a fire-and-forget task. Otherwise, a new event loop is created to run the coroutine.
-    """
-    try:
-        # Try to get the current running loop.
-        loop = asyncio.get_running_loop()
-        # If the loop is running, schedule the log_event coroutine.
-        if loop.is_running():
-            loop.create_task(log_event(level, message, extra))
-        else:
-            # Should rarely happen, but run synchronously if the loop isn't running.
-            loop.run_until_complete(log_event(level, message, extra))
-    except RuntimeError:
-        # No running loop; create a new one.
-        new_loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(new_loop)
-        new_loop.run_until_complete(log_event(level, message, extra))
+    Queues the event for the background shipper and returns immediately, whether or not an
+    event loop is running.
+
+    Returns:
+        bool: False if the event was sampled out or dropped under backpressure.
+    """
+    return SHIPPER.submit(_make_log_doc(level, message, extra))
+
+
+def get_log_stats() -> dict:
+    """
+    Returns the log shipper's queue depth and counters.
+    """
+    return SHIPPER.snapshot()
+
+
+def _collect_metrics():
+    yield from metrics.snapshot_samples(
+        "log_shipper", SHIPPER.snapshot(), {},
+        counters=("enqueued", "shipped", "dropped", "sampled_out", "failed_batches"), gauges=("queued",),
+    )
+
+
+metrics.register_collector(_collect_metrics)
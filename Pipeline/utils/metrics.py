@@ -0,0 +1,493 @@
+"""
+metrics.py
+----------
+Lightweight in-process metrics and tracing for the matching pipeline.
+
+  - Counter / Gauge / Histogram with optional labels. Histograms keep Prometheus buckets plus a
+    window of recent observations for p50 / p95 / p99.
+  - span(stage): times one pipeline stage (histogram `stage_seconds`), tracks how many are in
+    flight and counts errors. Works in sync and async code. Inside a trace (start_trace()), the
+    stage durations of the current request are also collected, e.g. for a Server-Timing header.
+    Work shared by several requests runs untraced(); each request traces its own wait for it.
+  - Collectors: callables that turn existing snapshot() dicts (caches, batchers, log shipper)
+    into samples at export time, so hot paths are not counted twice.
+  - render_prometheus(): Prometheus text exposition format (0.0.4).
+  - Sampling profiler: spans opened with profile=True run under cProfile with probability
+    PROFILE_SAMPLE_RATE, one at a time; get_profile(stage) lists the hottest functions.
+
+With METRICS_ENABLED=0 every update returns immediately and span() hands back a shared no-op.
+"""
+
+import bisect
+import contextvars
+import cProfile
+import functools
+import inspect
+import io
+import os
+import pstats
+import random
+import threading
+import time
+from collections import deque
+import numpy as np
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1").lower() not in ("0", "false", "no")
+NAMESPACE = "product_matching"
+# Latency buckets in seconds.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Observations kept per histogram series for quantiles.
+QUANTILE_WINDOW = 2048
+QUANTILES = (0.5, 0.95, 0.99)
+# Fraction of profile=True spans run under cProfile (0 disables the profiler).
+PROFILE_SAMPLE_RATE = float(os.environ.get("PROFILE_SAMPLE_RATE", "0"))
+
+
+def set_enabled(enabled: bool):
+    global METRICS_ENABLED
+    METRICS_ENABLED = bool(enabled)
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    body = ",".join(
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels.items()
+    )
+    return "{" + body + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, help_text: str = "", labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels[name] for name in self.labelnames)
+
+    def _labels(self, key: tuple) -> dict:
+        return dict(zip(self.labelnames, key))
+
+
+class Counter(_Metric):
+    """
+    A monotonically increasing count, e.g. requests or errors.
+    """
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._series.items())
+        for key, value in items:
+            yield f"{self.name}_total", self._labels(key), value
+
+
+class Gauge(_Metric):
+    """
+    A value that goes up and down, e.g. requests in flight.
+    """
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._series.items())
+        for key, value in items:
+            yield self.name, self._labels(key), value
+
+
+class _HistogramSeries:
+    __slots__ = ("counts", "sum", "count", "window")
+
+    def __init__(self, num_buckets: int):
+        self.counts = [0] * (num_buckets + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.window = deque(maxlen=QUANTILE_WINDOW)
+
+
+class Histogram(_Metric):
+    """
+    A distribution of observations (e.g. latencies in seconds) with fixed buckets, plus
+    quantiles over the most recent QUANTILE_WINDOW observations.
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str = "", labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = _HistogramSeries(len(self.buckets))
+            series.counts[index] += 1
+            series.sum += value
+            series.count += 1
+            series.window.append(value)
+
+    def quantiles(self, **labels) -> dict:
+        """
+        Returns {quantile: value} over the recent window of one series (empty if unobserved).
+        """
+        with self._lock:
+            series = self._series.get(self._key(labels))
+            window = list(series.window) if series is not None else []
+        if not window:
+            return {}
+        values = np.percentile(window, [100.0 * q for q in QUANTILES])
+        return {q: float(v) for q, v in zip(QUANTILES, values)}
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(s.counts), s.sum, s.count) for key, s in self._series.items()]
+        for key, counts, total, count in items:
+            labels = self._labels(key)
+            cumulative = 0
+            for edge, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket", {**labels, "le": "+Inf" if edge == float("inf") else repr(edge)}, cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, count
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            keys = [(key, s.count, s.sum) for key, s in self._series.items()]
+        result = {}
+        for key, count, total in keys:
+            labels = self._labels(key)
+            quantiles = self.quantiles(**labels)
+            result[",".join(str(v) for v in key) or self.name] = {
+                "count": count,
+                "mean_ms": 1000.0 * total / count if count else 0.0,
+                **{f"p{int(q * 100)}_ms": 1000.0 * v for q, v in quantiles.items()},
+            }
+        return result
+
+
+class Registry:
+    """
+    Holds metrics and collectors and renders them for export.
+    """
+
+    def __init__(self, namespace: str = NAMESPACE):
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._collectors = []
+
+    def _get_or_create(self, cls, name: str, help_text: str, labelnames, **kwargs):
+        full_name = f"{self.namespace}_{name}"
+        with self._lock:
+            metric = self._metrics.get(full_name)
+            if metric is None:
+                metric = self._metrics[full_name] = cls(full_name, help_text, labelnames, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric '{full_name}' is already registered as a {metric.kind}.")
+        return metric
+
+    def counter(self, name: str, help_text: str = "", labelnames=()) -> Counter:
+        return self._get_or_create(Counter, name, help_text, labelnames)
+
+    def gauge(self, name: str, help_text: str = "", labelnames=()) -> Gauge:
+        return self._get_or_create(Gauge, name, help_text, labelnames)
+
+    def histogram(self, name: str, help_text: str = "", labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, help_text, labelnames, buckets=buckets)
+
+    def register_collector(self, collector):
+        """
+        Registers a callable returning (name, kind, labels, value) samples at export time.
+        Names are prefixed with the namespace; counters should end in `_total`.
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render_prometheus(self) -> str:
+        """
+        Renders every metric and collector sample in the Prometheus text format.
+        """
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+
+        for metric in metrics:
+            if metric.help:
+                lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {float(value)!r}")
+            if isinstance(metric, Histogram):
+                # Recent-window quantiles, exported as a separate summary-style gauge.
+                quantile_name = f"{metric.name}_quantile"
+                lines.append(f"# TYPE {quantile_name} gauge")
+                with metric._lock:
+                    keys = list(metric._series)
+                for key in keys:
+                    labels = metric._labels(key)
+                    for q, v in metric.quantiles(**labels).items():
+                        lines.append(f"{quantile_name}{_format_labels({**labels, 'quantile': q})} {float(v)!r}")
+
+        declared = set()
+        for collector in collectors:
+            try:
+                samples = list(collector())
+            except Exception:
+                continue
+            for name, kind, labels, value in samples:
+                full_name = f"{self.namespace}_{name}"
+                base_name = full_name[:-len("_total")] if kind == "counter" and full_name.endswith("_total") else full_name
+                if base_name not in declared:
+                    lines.append(f"# TYPE {base_name} {kind}")
+                    declared.add(base_name)
+                lines.append(f"{full_name}{_format_labels(labels)} {float(value)!r}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        """
+        Drops every recorded series (collectors are kept), e.g. between benchmark scenarios.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            with metric._lock:
+                metric._series.clear()
+
+    def snapshot(self) -> dict:
+        """
+        Returns histogram quantiles (ms) and counter / gauge values as a plain dict.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        result = {}
+        for metric in metrics:
+            if isinstance(metric, Histogram):
+                result[metric.name] = metric.snapshot()
+            else:
+                result[metric.name] = {
+                    ",".join(str(v) for v in labels.values()) or metric.name: value
+                    for _, labels, value in metric.samples()
+                }
+        return result
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+register_collector = REGISTRY.register_collector
+render_prometheus = REGISTRY.render_prometheus
+snapshot = REGISTRY.snapshot
+reset = REGISTRY.reset
+
+
+def snapshot_samples(prefix: str, snapshot_dict: dict, labels: dict, counters=(), gauges=()):
+    """
+    Turns selected numeric fields of a snapshot() dict into collector samples: `counters` become
+    `<prefix>_<field>_total` counters and `gauges` become `<prefix>_<field>` gauges.
+    """
+    for field in counters:
+        yield f"{prefix}_{field}_total", "counter", labels, snapshot_dict[field]
+    for field in gauges:
+        yield f"{prefix}_{field}", "gauge", labels, snapshot_dict[field]
+
+
+##########################
+# Spans and traces
+##########################
+STAGE_SECONDS = histogram("stage_seconds", "Latency of each pipeline stage in seconds.", ("stage",))
+STAGE_IN_FLIGHT = gauge("stage_in_flight", "Executions of each pipeline stage in progress.", ("stage",))
+STAGE_ERRORS = counter("stage_errors", "Executions of each pipeline stage that raised.", ("stage",))
+
+_trace = contextvars.ContextVar("metrics_trace", default=None)
+
+
+def start_trace():
+    """
+    Starts collecting per-stage durations for the current request (context).
+    Returns a token for end_trace().
+    """
+    return _trace.set({})
+
+
+def end_trace(token) -> dict:
+    """
+    Stops the trace started with `token` and returns {stage: seconds}.
+    Stages that ran several times (or in parallel) are summed.
+    """
+    timings = _trace.get() or {}
+    _trace.reset(token)
+    return timings
+
+
+async def untraced(coro):
+    """
+    Awaits `coro` outside any request trace. Wrap the coroutine of a task shared by several
+    requests (a coalesced call, a micro-batch): a task inherits the trace of the request that
+    created it, which would otherwise be charged for everyone's work. Its spans still reach the
+    stage histograms.
+    """
+    _trace.set(None)  # tasks run in a copy of the context, so the creator's trace is untouched
+    return await coro
+
+
+class _Span:
+    __slots__ = ("stage", "profile", "started", "profiler")
+
+    def __init__(self, stage: str, profile: bool):
+        self.stage = stage
+        self.profile = profile
+        self.profiler = None
+
+    def __enter__(self):
+        STAGE_IN_FLIGHT.inc(stage=self.stage)
+        if self.profile and PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+            self.profiler = _start_profiler()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        elapsed = time.perf_counter() - self.started
+        if self.profiler is not None:
+            _stop_profiler(self.stage, self.profiler)
+        STAGE_SECONDS.observe(elapsed, stage=self.stage)
+        STAGE_IN_FLIGHT.dec(stage=self.stage)
+        if exc_type is not None:
+            STAGE_ERRORS.inc(stage=self.stage)
+        trace = _trace.get()
+        if trace is not None:
+            trace[self.stage] = trace.get(self.stage, 0.0) + elapsed
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(stage: str, profile: bool = False):
+    """
+    Context manager timing one execution of a pipeline stage, e.g.
+    `with span("triton.clip_visual"): ...`. Set `profile=True` on hot paths to make them
+    eligible for the sampling profiler.
+    """
+    if not METRICS_ENABLED:
+        return _NOOP_SPAN
+    return _Span(stage, profile)
+
+
+def traced(stage: str, profile: bool = False):
+    """
+    Decorator running a sync or async function inside span(stage).
+    """
+    def decorator(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with span(stage, profile):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage, profile):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+##########################
+# Sampling profiler
+##########################
+# cProfile allows one active profiler per process, so sampled spans are profiled one at a time.
+# In async code the profile covers everything the loop runs during the span, not just the stage.
+_profile_lock = threading.Lock()
+_profiles = {}
+
+
+def _start_profiler():
+    if not _profile_lock.acquire(blocking=False):
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiling tool is active.
+        _profile_lock.release()
+        return None
+    return profiler
+
+
+def _stop_profiler(stage: str, profiler):
+    try:
+        profiler.disable()
+        stats = _profiles.get(stage)
+        if stats is None:
+            _profiles[stage] = pstats.Stats(profiler)
+        else:
+            stats.add(profiler)
+    finally:
+        _profile_lock.release()
+
+
+def get_profile(stage: str = None, limit: int = 25) -> str:
+    """
+    Returns the accumulated profile of a stage (or the list of profiled stages if None),
+    sorted by cumulative time.
+    """
+    if stage is None:
+        return "\n".join(sorted(_profiles)) + "\n"
+    stats = _profiles.get(stage)
+    if stats is None:
+        return f"No profile samples for stage '{stage}'.\n"
+    out = io.StringIO()
+    stats.stream = out
+    stats.sort_stats("cumulative").print_stats(limit)
+    return out.getvalue()
+
+
+def reset_profiles():
+    _profiles.clear()
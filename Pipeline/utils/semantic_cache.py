@@ -0,0 +1,180 @@
+"""
+semantic_cache.py
+-----------------
+Approximate (near-duplicate) cache tier keyed on embedding similarity.
+
+Exact caches keyed on embedding bytes miss whenever the input changes slightly (a re-encoded
+JPEG, a prompt with different punctuation). This cache keeps a small in-process matrix of
+recently queried, L2-normalized embeddings and returns the cached value of the most similar
+one if its cosine similarity is at or above a threshold.
+
+The index is a brute-force matrix-vector product over at most `capacity` rows, which for the
+few thousand entries it is meant for is cheaper than a Qdrant + MongoDB round trip.
+"""
+
+import threading
+import numpy as np
+
+# Bucket edges used to report the best similarity seen on each lookup (for threshold tuning).
+SIMILARITY_BUCKETS = (0.80, 0.85, 0.90, 0.92, 0.94, 0.95, 0.96, 0.97, 0.98, 0.99, 0.995, 1.0)
+
+
+class SemanticCacheStats:
+    """
+    Hit / miss / eviction counters and a histogram of best-match similarities.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.similarity_histogram = [0] * (len(SIMILARITY_BUCKETS) + 1)
+
+    def record_similarity(self, similarity: float):
+        self.similarity_histogram[int(np.searchsorted(SIMILARITY_BUCKETS, similarity, side="right"))] += 1
+
+    def snapshot(self) -> dict:
+        lookups = self.hits + self.misses
+        labels = [f"<{edge}" for edge in SIMILARITY_BUCKETS] + [f">={SIMILARITY_BUCKETS[-1]}"]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "best_similarity_histogram": dict(zip(labels, self.similarity_histogram)),
+        }
+
+
+class SemanticCache:
+    """
+    A bounded nearest-neighbour cache over recently queried embeddings.
+
+    Args:
+        name (str): Name used in logs and metrics.
+        capacity (int): Maximum number of cached embeddings.
+        threshold (float): Minimum cosine similarity for a hit.
+    """
+
+    def __init__(self, name: str, capacity: int = 1024, threshold: float = 0.97):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1.")
+        if not -1.0 <= threshold <= 1.0:
+            raise ValueError("threshold must be a cosine similarity in [-1, 1].")
+        self.name = name
+        self.capacity = capacity
+        self.threshold = threshold
+        self.stats = SemanticCacheStats()
+
+        self._lock = threading.Lock()
+        self._matrix = None  # (capacity, dim) float32, allocated on first insert
+        self._values = [None] * capacity
+        self._tags = [frozenset()] * capacity
+        self._occupied = np.zeros(capacity, dtype=bool)
+        self._last_used = np.zeros(capacity, dtype=np.int64)
+        self._clock = 0
+
+    @staticmethod
+    def _normalize(embedding: np.ndarray) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            raise ValueError("Cannot cache a zero embedding.")
+        return vector / norm
+
+    def lookup(self, embedding: np.ndarray):
+        """
+        Returns `(value, similarity)` for the most similar cached embedding if it clears the
+        threshold, otherwise None.
+        """
+        query = self._normalize(embedding)
+        with self._lock:
+            if self._matrix is None or not self._occupied.any() or self._matrix.shape[1] != query.shape[0]:
+                self.stats.misses += 1
+                return None
+
+            similarities = self._matrix @ query
+            similarities[~self._occupied] = -np.inf
+            best = int(np.argmax(similarities))
+            similarity = float(similarities[best])
+            self.stats.record_similarity(similarity)
+
+            if similarity < self.threshold:
+                self.stats.misses += 1
+                return None
+
+            self._clock += 1
+            self._last_used[best] = self._clock
+            self.stats.hits += 1
+            return self._values[best], similarity
+
+    def add(self, embedding: np.ndarray, value, tags=()):
+        """
+        Caches `value` under `embedding`, evicting the least recently used entry when full.
+        """
+        vector = self._normalize(embedding)
+        with self._lock:
+            if self._matrix is None or self._matrix.shape[1] != vector.shape[0]:
+                self._matrix = np.zeros((self.capacity, vector.shape[0]), dtype=np.float32)
+                self._occupied[:] = False
+
+            free = np.flatnonzero(~self._occupied)
+            if free.size:
+                slot = int(free[0])
+            else:
+                slot = int(np.argmin(self._last_used))
+                self.stats.evictions += 1
+
+            self._clock += 1
+            self._matrix[slot] = vector
+            self._values[slot] = value
+            self._tags[slot] = frozenset(tags)
+            self._occupied[slot] = True
+            self._last_used[slot] = self._clock
+
+    def invalidate_tag(self, tag) -> int:
+        """
+        Removes every entry carrying `tag`. Returns the number of entries removed.
+        """
+        with self._lock:
+            stale = [slot for slot in np.flatnonzero(self._occupied) if tag in self._tags[slot]]
+            for slot in stale:
+                self._release(slot)
+            self.stats.invalidations += len(stale)
+            return len(stale)
+
+    def clear(self) -> int:
+        """
+        Removes every entry. Returns the number of entries removed.
+        """
+        with self._lock:
+            stale = np.flatnonzero(self._occupied)
+            for slot in stale:
+                self._release(slot)
+            self.stats.invalidations += len(stale)
+            return len(stale)
+
+    def _release(self, slot: int):
+        self._occupied[slot] = False
+        self._values[slot] = None
+        self._tags[slot] = frozenset()
+        self._last_used[slot] = 0
+
+    def __len__(self) -> int:
+        return int(self._occupied.sum())
+
+    def snapshot(self) -> dict:
+        """
+        Returns size, threshold and counter metrics as a plain dict.
+        """
+        return {
+            "name": self.name,
+            "entries": len(self),
+            "capacity": self.capacity,
+            "threshold": self.threshold,
+            **self.stats.snapshot(),
+        }
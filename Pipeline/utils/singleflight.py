@@ -0,0 +1,112 @@
+"""
+singleflight.py
+---------------
+Request coalescing ("single flight") for async calls.
+
+Caches are checked before work starts and filled after it ends, so N identical requests that
+arrive together all miss and all do the work (a stampede on Triton, Qdrant and MongoDB). A
+SingleFlight runs the work for a key once, as a task, and every concurrent caller with the same
+key awaits that task's result instead:
+
+  - Results and exceptions are shared by all callers of the flight. Nothing is remembered once
+    the task finishes; the next call for the key starts a new flight (caching stays the job of
+    the caches).
+  - Callers await the task through asyncio.shield, so a cancelled caller does not cancel the
+    work the others are waiting for. The task is cancelled only when every caller has gone.
+  - The task runs outside any request trace (its spans would all be charged to the caller that
+    started it); every caller records its own wait as the span `singleflight.<name>`.
+"""
+
+import asyncio
+from utils import metrics
+
+
+class SingleFlightStats:
+    """
+    Counters: flights started, callers that joined a flight in progress, failed flights and
+    flights cancelled because all their callers were cancelled.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.coalesced = 0
+        self.failed = 0
+        self.abandoned = 0
+
+    def snapshot(self) -> dict:
+        requests = self.calls + self.coalesced
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "coalesced_ratio": self.coalesced / requests if requests else 0.0,
+            "failed": self.failed,
+            "abandoned": self.abandoned,
+        }
+
+
+class _Flight:
+    __slots__ = ("loop", "task", "waiters")
+
+    def __init__(self, loop, task):
+        self.loop = loop
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Deduplicates concurrent calls by key.
+
+    Args:
+        name (str): Name used in logs and metrics (e.g. "clip_text").
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.stats = SingleFlightStats()
+        self._flights = {}
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._flights)
+
+    async def do(self, key, fn):
+        """
+        Returns the result of `fn()`, sharing one execution among concurrent callers with the
+        same key.
+
+        Args:
+            key (hashable): Identifies identical requests (e.g. a content hash or cache key).
+            fn (callable): Zero-argument function returning the coroutine that does the work.
+        """
+        loop = asyncio.get_running_loop()
+        flight = self._flights.get(key)
+        # A flight from another event loop (Streamlit runs a new loop per request) cannot be
+        # awaited here; a finished one is about to be removed.
+        if flight is None or flight.loop is not loop or flight.task.done():
+            flight = _Flight(loop, loop.create_task(metrics.untraced(fn())))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda task: self._finish(key, flight))
+            self.stats.calls += 1
+        else:
+            self.stats.coalesced += 1
+
+        flight.waiters += 1
+        try:
+            with metrics.span(f"singleflight.{self.name}"):
+                return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # Every caller was cancelled; nobody is left to use the result.
+                flight.task.cancel()
+                self.stats.abandoned += 1
+
+    def _finish(self, key, flight: _Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        if not flight.task.cancelled() and flight.task.exception() is not None:
+            self.stats.failed += 1
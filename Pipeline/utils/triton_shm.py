@@ -0,0 +1,144 @@
+"""
+triton_shm.py
+-------------
+A pool of Triton system shared-memory regions for sending input tensors without copying them
+into a request body.
+
+Each region is created under /dev/shm, registered with Triton once per process and lent to one
+request at a time. Callers write a batch straight into the region's NumPy view and reference the
+region from the InferInput, so only the (small) request header travels over the socket.
+This only works when the client and Triton share a host (or an IPC namespace in Docker).
+"""
+
+import asyncio
+import os
+from contextlib import asynccontextmanager
+import numpy as np
+import tritonclient.utils.shared_memory as shm
+
+
+class SharedMemorySlot:
+    """
+    One registered region: its Triton name, the local handle and its size in bytes.
+    """
+
+    def __init__(self, name: str, handle, byte_size: int):
+        self.name = name
+        self.handle = handle
+        self.byte_size = byte_size
+
+    def view(self, shape, dtype) -> np.ndarray:
+        """
+        Returns a writable array of `shape` / `dtype` backed by the start of the region.
+        """
+        return shm.get_contents_as_numpy(self.handle, np.dtype(dtype), shape)
+
+
+class SharedMemoryPool:
+    """
+    Fixed set of equally sized regions, created and registered lazily on first use.
+
+    Args:
+        prefix (str): Region name prefix; the process id is appended so workers do not collide.
+        region_bytes (int): Size of each region, i.e. the largest batch it can hold.
+        num_regions (int): Number of batches that can be in flight at once.
+    """
+
+    def __init__(self, prefix: str, region_bytes: int, num_regions: int = 4):
+        self.prefix = f"{prefix}_{os.getpid()}"
+        self.region_bytes = int(region_bytes)
+        self.num_regions = num_regions
+
+        self.acquired = 0
+        self.waited = 0
+
+        self._slots = []
+        self._free = []
+        self._loop = None
+        self._available = None
+        self._setup_lock = None
+
+    def fits(self, nbytes: int) -> bool:
+        return nbytes <= self.region_bytes
+
+    def _bind_loop(self):
+        # asyncio primitives belong to one loop; rebuild them (and return every slot) if it changes.
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._free = list(self._slots)
+            self._available = asyncio.Semaphore(len(self._slots) or self.num_regions)
+            self._setup_lock = asyncio.Lock()
+
+    async def _ensure_registered(self, client):
+        if self._slots:
+            return
+        async with self._setup_lock:
+            if self._slots:
+                return
+            slots = []
+            try:
+                for i in range(self.num_regions):
+                    name = f"{self.prefix}_{i}"
+                    handle = shm.create_shared_memory_region(name, "/" + name, self.region_bytes)
+                    slots.append(SharedMemorySlot(name, handle, self.region_bytes))
+                    await client.register_system_shared_memory(name, "/" + name, self.region_bytes)
+            except Exception:
+                for slot in slots:
+                    shm.destroy_shared_memory_region(slot.handle)
+                raise
+            self._slots = slots
+            self._free = list(slots)
+
+    @asynccontextmanager
+    async def slot(self, client):
+        """
+        Lends a registered region for the duration of the `async with` block, waiting if all
+        regions are in use.
+        """
+        self._bind_loop()
+        await self._ensure_registered(client)
+        if self._available.locked():
+            self.waited += 1
+        await self._available.acquire()
+        slot = self._free.pop()
+        self.acquired += 1
+        try:
+            yield slot
+        finally:
+            self._free.append(slot)
+            self._available.release()
+
+    async def close(self, client=None):
+        """
+        Unregisters the regions from Triton (when a client is given) and removes them locally.
+        """
+        slots, self._slots, self._free = self._slots, [], []
+        for slot in slots:
+            if client is not None:
+                try:
+                    await client.unregister_system_shared_memory(slot.name)
+                except Exception:
+                    pass
+            shm.destroy_shared_memory_region(slot.handle)
+        self._loop = None
+
+    def destroy(self):
+        """
+        Removes the regions locally without talking to Triton (for interpreter shutdown).
+        """
+        slots, self._slots, self._free = self._slots, [], []
+        for slot in slots:
+            shm.destroy_shared_memory_region(slot.handle)
+
+    def snapshot(self) -> dict:
+        """
+        Returns pool size and usage counters as a plain dict.
+        """
+        return {
+            "regions": len(self._slots),
+            "region_bytes": self.region_bytes,
+            "in_use": len(self._slots) - len(self._free),
+            "acquired": self.acquired,
+            "waited": self.waited,
+        }